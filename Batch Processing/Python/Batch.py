@@ -0,0 +1,249 @@
+"""
+Batch processing of the CGM performance assessment tools (CG_DIVA, CI_calculation, DGR_plot and CTCA)
+
+Runs the jobs of a job specification file on a pool of worker processes. Each job writes a log file and
+a hash file, jobs whose input data and settings did not change since the last run are skipped
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import traceback
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Folder, required input columns and default parameters of each tool
+TOOLS = {"CG_DIVA": {"folder": "CG-DIVA",
+                     "columns": ["SensorID","Comp","CGM"],
+                     "params": {"N_BS": 10000, "seed": 1, "save_fig": True, "save_res": True}},
+         "CI_calculation": {"folder": "Confidence Intervals",
+                            "columns": ["SensorID","Comp","CGM"],
+                            "params": {"N_BS": 10000, "seed": 1, "alpha": 0.05}},
+         "DGR_plot": {"folder": "Dynamic Glucose Region (DGR) Plot",
+                      "columns": ["BG","ROC"],
+                      "params": {"remove_dat": True, "show_mmol": True}},
+         "CTCA": {"folder": "Clinical Trend Concurrence Analysis",
+                  "columns": ["Comp_ROC","Comp_ROC_Cat","CGM_ROC_Cat"],
+                  "params": {}}}
+
+# Parameters that are set by the batch driver and must not be given in the params of a job
+RESERVED = {"CG_DIVA": ["save_path","filename","show_fig"],
+            "CI_calculation": ["save_path","filename"],
+            "DGR_plot": ["save_path","filename","save_fig","show_fig"],
+            "CTCA": ["save_path","filename","save_fig","show_fig"]}
+
+
+def load_jobs(file):
+    """
+    Read a job specification file (json)
+
+    The file contains a list "jobs" and optionally "defaults" that apply to all jobs. Each job has the entries
+    tool:       "CG_DIVA", "CI_calculation", "DGR_plot" or "CTCA"
+    input:      Path of csv file with input data (relative to the job file)
+    output:     Path for saving the results (relative to the job file)
+    filename:   Filename of output files (optional, default: name of input file)
+    columns:    Mapping of tool columns to columns of the input file (optional), e.g. {"Comp": "YSI"}
+    params:     Parameters of the tool function (optional), e.g. {"N_BS": 10000, "seed": 1}, except the
+                parameters set by the batch driver (see RESERVED)
+
+    Output:
+    jobs:       List of job dicts with absolute paths and complete parameters
+
+    """
+
+    with open(file) as f:
+        spec = json.load(f)
+    base = os.path.dirname(os.path.abspath(file))
+    defaults = spec.get("defaults",{})
+
+    jobs = []
+    for i, job in enumerate(spec["jobs"]):
+        job = {**defaults, **job, "params": {**defaults.get("params",{}), **job.get("params",{})}}
+        for key in ["tool","input","output"]:
+            if not(key in job):
+                raise ValueError("Job "+str(i)+": entry "+key+" missing")
+        if not(job["tool"] in TOOLS):
+            raise ValueError("Job "+str(i)+": unknown tool "+str(job["tool"]))
+        reserved = [k for k in RESERVED[job["tool"]] if k in job["params"]]
+        if reserved:
+            raise ValueError("Job "+str(i)+": parameters "+", ".join(reserved)+" are set by the batch driver")
+        job["input"] = os.path.normpath(os.path.join(base,job["input"]))
+        job["output"] = os.path.normpath(os.path.join(base,job["output"]))
+        job.setdefault("filename",os.path.splitext(os.path.basename(job["input"]))[0])
+        job.setdefault("columns",{})
+        job["params"] = {**TOOLS[job["tool"]]["params"], **job["params"]}
+        jobs.append(job)
+
+    return jobs
+
+
+def job_hash(job):
+    """
+    Hash of input data and settings of a job
+
+    """
+
+    h = hashlib.sha256()
+    with open(job["input"],"rb") as f:
+        for chunk in iter(lambda: f.read(1<<20), b""):
+            h.update(chunk)
+    h.update(json.dumps({k: job[k] for k in ["tool","filename","columns","params"]},sort_keys=True).encode())
+
+    return h.hexdigest()
+
+
+def output_files(job):
+    """
+    List of files written by a job
+
+    """
+
+    out = os.path.join(job["output"],job["filename"])
+    p = job["params"]
+    if job["tool"] == "CG_DIVA":
+        return [out+".csv"]*p.get("save_res",True) + [out+".png"]*p.get("save_fig",True)
+    if job["tool"] == "CI_calculation":
+        return [out+".csv"]
+    return [out+".png"]
+
+
+def up_to_date(job):
+    """
+    Check whether the outputs of a job exist and were created from the same input data and settings
+
+    """
+
+    file = os.path.join(job["output"],job["filename"]+".hash")
+    if not(os.path.isfile(file)) or not all(os.path.isfile(f) for f in output_files(job)):
+        return False
+    with open(file) as f:
+        return f.read().strip() == job_hash(job)
+
+
+def run_job(job):
+    """
+    Run a single job (in a worker process), output of the tool is written to a log file
+
+    Output:
+    status:     Dict with "filename", "status" ("done" or "failed"), "time" and "error"
+
+    """
+
+    os.environ.setdefault("MPLBACKEND","Agg")
+    import pandas as pd
+
+    tool = job["tool"]
+    sys.path.append(os.path.join(root,TOOLS[tool]["folder"],"Python"))
+    os.makedirs(job["output"],exist_ok=True)
+    save_path = os.path.join(job["output"],"")
+    log = os.path.join(job["output"],job["filename"]+".log")
+
+    # Changes of the rc parameters (e.g. font size set by CG_DIVA) are reverted after each job, so that the
+    # figures do not depend on the jobs run before in the same worker process
+    if tool == "CI_calculation":
+        rc = contextlib.nullcontext()
+    else:
+        import matplotlib
+        rc = matplotlib.rc_context()
+
+    start = time.perf_counter()
+    status = {"filename": job["filename"], "tool": tool, "status": "done", "error": None}
+    with open(log,"w") as f, contextlib.redirect_stdout(f), contextlib.redirect_stderr(f), rc:
+        try:
+            print("Job:",json.dumps({k: job[k] for k in ["tool","input","output","filename","columns","params"]}))
+            df = pd.read_csv(job["input"])
+            missing = [c for c in job["columns"].values() if not(c in df.columns)]
+            if missing:
+                raise ValueError("Columns "+", ".join(missing)+" do not exist in input file")
+            df = df.rename(columns={v: k for k, v in job["columns"].items()})
+            missing = [c for c in TOOLS[tool]["columns"] if not(c in df.columns)]
+            if missing:
+                raise ValueError("Columns "+", ".join(missing)+" do not exist")
+            p = job["params"]
+            if tool == "CG_DIVA":
+                import CG_DIVA
+                CG_DIVA.CG_DIVA(df,save_path,filename=job["filename"],show_fig=False,**p)
+                if p.get("save_fig",True):
+                    CG_DIVA.plt.close("all")
+            elif tool == "CI_calculation":
+                import CI_calculation as CI_calc
+                CI_calc.CI_calculation(df,save_path,filename=job["filename"],**p)
+            elif tool == "DGR_plot":
+                import DGR_plot as dgr_plt
+                dgr_plt.DGR_plot(df,save_path=save_path,filename=job["filename"],save_fig=True,show_fig=False,**p)
+                dgr_plt.plt.close("all")
+            elif tool == "CTCA":
+                import CTCA as ctca
+                ctca.CTCA(df,save_path=save_path,filename=job["filename"],save_fig=True,show_fig=False,**p)
+                ctca.plt.close("all")
+            with open(os.path.join(job["output"],job["filename"]+".hash"),"w") as h:
+                h.write(job_hash(job))
+        except Exception as e:
+            traceback.print_exc()
+            status["status"] = "failed"
+            status["error"] = repr(e)
+        status["time"] = time.perf_counter() - start
+        print("Status:",json.dumps(status))
+
+    return status
+
+
+def run_batch(jobs, workers=None, force=False):
+    """
+    Run jobs on a pool of worker processes
+
+    Inputs:
+    jobs:       List of jobs (see load_jobs)
+    workers:    Maximum number of worker processes (default: number of CPUs)
+    force:      True/False whether to rerun jobs that are up to date
+
+    Output:
+    res:        List of status dicts of all jobs (status "skipped" for up-to-date jobs)
+
+    """
+
+    res = []
+    todo = []
+    for job in jobs:
+        if not(force) and up_to_date(job):
+            res.append({"filename": job["filename"], "tool": job["tool"], "status": "skipped", "error": None, "time": 0})
+        else:
+            todo.append(job)
+    print("Jobs: {:d} total, {:d} up to date, {:d} to run".format(len(jobs),len(res),len(todo)))
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futures = [ex.submit(run_job,job) for job in todo]
+            for fut in as_completed(futures):
+                st = fut.result()
+                res.append(st)
+                print("{:<8} {:<15} {} ({:.1f} s)".format(st["status"],st["tool"],st["filename"],st["time"]))
+
+    return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch processing of the CGM performance assessment tools")
+    parser.add_argument("jobfile",help="Job specification file (json)")
+    parser.add_argument("--workers",type=int,default=None,help="Maximum number of worker processes")
+    parser.add_argument("--force",action="store_true",help="Rerun jobs that are up to date")
+    args = parser.parse_args()
+
+    res = run_batch(load_jobs(args.jobfile),workers=args.workers,force=args.force)
+    failed = [r for r in res if r["status"] == "failed"]
+    for r in failed:
+        print("FAILED:",r["filename"],r["error"])
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,310 @@
+"""
+Pipelined batch processing of the CGM performance assessment tools (CG_DIVA, CI_calculation, DGR_plot and CTCA)
+
+Runs the jobs of a job specification file (see Batch.py) as a pipeline: the input of the next jobs is read and
+parsed while the bootstrapping of the current jobs runs on a pool of worker processes, finished results are
+passed to rendering processes and the results are written asynchronously. The stages are connected by bounded
+queues, so that a slow stage holds back the faster stages before it
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import asyncio
+import argparse
+import traceback
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from Batch import TOOLS, load_jobs, job_hash, up_to_date, root
+
+# Tools have to be importable in all processes for passing results objects between the stages
+for tool in TOOLS.values():
+    sys.path.append(os.path.join(root,tool["folder"],"Python"))
+
+# Parameters of the figures of CG_DIVA (all other parameters are passed to CG_DIVA_compute)
+PLOT_PARAMS = ["ylims","s_max","figsize"]
+
+
+def tool_module(tool):
+    """
+    Import a tool (in the main process or a worker process)
+
+    """
+
+    os.environ.setdefault("MPLBACKEND","Agg")
+    return __import__(tool)
+
+
+def read_input(job):
+    """
+    Read and check the input data of a job (stage "read", run in a thread)
+
+    Output:
+    item:       Dict with "job", "data" (Pandas dataframe with renamed columns), "log", "times", "status"
+                and "error"
+
+    """
+
+    import pandas as pd
+
+    item = {"job": job, "data": None, "log": "", "times": {}, "status": "done", "error": None}
+    start = time.perf_counter()
+    try:
+        df = pd.read_csv(job["input"])
+        missing = [c for c in job["columns"].values() if not(c in df.columns)]
+        if missing:
+            raise ValueError("Columns "+", ".join(missing)+" do not exist in input file")
+        df = df.rename(columns={v: k for k, v in job["columns"].items()})
+        missing = [c for c in TOOLS[job["tool"]]["columns"] if not(c in df.columns)]
+        if missing:
+            raise ValueError("Columns "+", ".join(missing)+" do not exist")
+        item["data"] = df
+    except Exception as e:
+        item["log"] = traceback.format_exc()
+        item["status"], item["error"] = "failed", repr(e)
+    item["times"]["read"] = time.perf_counter() - start
+
+    return item
+
+
+def compute_job(item):
+    """
+    Calculations of a job (stage "compute", run in a worker process)
+    CG_DIVA and CI_calculation are calculated with CG_DIVA_compute and CI_compute, DGR_plot and CTCA are
+    calculated together with the figure in the rendering stage
+
+    Output:
+    item:       Input dict with the results object in "res" and the output of the tool appended to "log"
+
+    """
+
+    job, p = item["job"], item["job"]["params"]
+    start = time.perf_counter()
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+        try:
+            if job["tool"] == "CG_DIVA":
+                CG_DIVA = tool_module("CG_DIVA")
+                args = {k: v for k, v in p.items() if not(k in PLOT_PARAMS+["save_fig","save_res","show_fig"])}
+                item["res"] = CG_DIVA.CG_DIVA_compute(item["data"],**args)
+                print("\n\n")
+            elif job["tool"] == "CI_calculation":
+                CI_calc = tool_module("CI_calculation")
+                item["res"] = CI_calc.CI_compute(item["data"],**p)
+        except Exception as e:
+            traceback.print_exc()
+            item["status"], item["error"] = "failed", repr(e)
+    item["log"] += out.getvalue()
+    item["times"]["compute"] = time.perf_counter() - start
+    # The input data is not needed anymore (the preprocessed data of CG_DIVA is part of the results)
+    if job["tool"] in ["CG_DIVA","CI_calculation"]:
+        item["data"] = None
+
+    return item
+
+
+def render_job(item):
+    """
+    Creation of the figure of a job and rendering to png (stage "render", run in a worker process)
+
+    Output:
+    item:       Input dict with the png file content in "png" and the output of the tool appended to "log"
+
+    """
+
+    job, p = item["job"], item["job"]["params"]
+    start = time.perf_counter()
+    out = io.StringIO()
+    # Changes of the rc parameters (e.g. font size set by CG_DIVA) are reverted after each figure, so that the
+    # figures do not depend on the jobs rendered before in the same process
+    import matplotlib
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out), matplotlib.rc_context():
+        try:
+            if job["tool"] == "CG_DIVA":
+                CG_DIVA = tool_module("CG_DIVA")
+                fig = CG_DIVA.CG_DIVA_plot(item["res"],**{k: p[k] for k in PLOT_PARAMS if k in p})
+                plt = CG_DIVA.plt
+            elif job["tool"] == "DGR_plot":
+                dgr_plt = tool_module("DGR_plot")
+                fig = dgr_plt.DGR_plot(item["data"],save_fig=False,show_fig=False,**p)
+                plt = dgr_plt.plt
+            elif job["tool"] == "CTCA":
+                ctca = tool_module("CTCA")
+                fig = ctca.CTCA(item["data"],save_fig=False,show_fig=False,**p)
+                plt = ctca.plt
+            buf = io.BytesIO()
+            fig.savefig(buf,format="png",dpi=600)
+            plt.close("all")
+            item["png"] = buf.getvalue()
+        except Exception as e:
+            traceback.print_exc()
+            item["status"], item["error"] = "failed", repr(e)
+    item["log"] += out.getvalue()
+    item["data"] = None
+    item["times"]["render"] = time.perf_counter() - start
+
+    return item
+
+
+def needs_figure(job):
+    """
+    Check whether a job creates a figure
+
+    """
+
+    return job["tool"] in ["DGR_plot","CTCA"] or (job["tool"] == "CG_DIVA" and job["params"].get("save_fig",True))
+
+
+def write_outputs(item):
+    """
+    Write results table, figure, log and hash file of a job (stage "write", run in a thread)
+    The files are the same as written by run_job of Batch.py
+
+    Output:
+    status:     Dict with "filename", "tool", "status" ("done" or "failed"), "time", "times" (processing time
+                of each stage) and "error"
+
+    """
+
+    job = item["job"]
+    start = time.perf_counter()
+    out = os.path.join(job["output"],job["filename"])
+    os.makedirs(job["output"],exist_ok=True)
+    if item["status"] == "done":
+        try:
+            if job["tool"] == "CI_calculation" or (job["tool"] == "CG_DIVA" and job["params"].get("save_res",True)):
+                item["res"].RES.to_csv(out+".csv",index=None)
+            if "png" in item:
+                with open(out+".png","wb") as f:
+                    f.write(item["png"])
+            with open(out+".hash","w") as h:
+                h.write(job_hash(job))
+        except Exception as e:
+            item["log"] += traceback.format_exc()
+            item["status"], item["error"] = "failed", repr(e)
+    item["times"]["write"] = time.perf_counter() - start
+
+    status = {"filename": job["filename"], "tool": job["tool"], "status": item["status"], "error": item["error"],
+              "time": sum(item["times"].values()), "times": item["times"]}
+    with open(out+".log","w") as f:
+        f.write("Job: "+json.dumps({k: job[k] for k in ["tool","input","output","filename","columns","params"]})+"\n")
+        f.write(item["log"])
+        f.write("Status: "+json.dumps(status)+"\n")
+
+    return status
+
+
+async def stage(inbox, outbox, n, fun):
+    """
+    Run n consumers that take items from inbox, process them with the coroutine fun and put the results in
+    outbox. None marks the end of the items and is passed on once all consumers are finished
+
+    """
+
+    async def consume():
+        while True:
+            item = await inbox.get()
+            if item is None:
+                await inbox.put(None)       # for the other consumers
+                return
+            await outbox.put(await fun(item))
+
+    await asyncio.gather(*[consume() for _ in range(n)])
+    await outbox.put(None)
+
+
+async def run_pipeline(jobs, workers=None, render_workers=1, prefetch=2, force=False):
+    """
+    Run jobs as a pipeline of the stages read, compute, render and write
+
+    Inputs:
+    jobs:           List of jobs (see load_jobs of Batch.py)
+    workers:        Number of worker processes for the calculations (default: number of CPUs)
+    render_workers: Number of worker processes for creating and rendering the figures
+    prefetch:       Maximum number of items waiting between two stages (e.g. inputs read ahead)
+    force:          True/False whether to rerun jobs that are up to date
+
+    Output:
+    res:            List of status dicts of all jobs (status "skipped" for up-to-date jobs) with processing
+                    times of the stages in "times"
+
+    """
+
+    loop = asyncio.get_running_loop()
+    res = []
+    todo = []
+    for job in jobs:
+        if not(force) and up_to_date(job):
+            res.append({"filename": job["filename"], "tool": job["tool"], "status": "skipped", "error": None, "time": 0})
+        else:
+            todo.append(job)
+    print("Jobs: {:d} total, {:d} up to date, {:d} to run".format(len(jobs),len(res),len(todo)))
+    if not(todo):
+        return res
+
+    workers = os.cpu_count() if workers is None else workers
+    parsed, computed, rendered, written = [asyncio.Queue(maxsize=prefetch) for _ in range(4)]
+
+    with ProcessPoolExecutor(max_workers=workers) as compute_pool, \
+         ProcessPoolExecutor(max_workers=render_workers) as render_pool:
+
+        async def read():
+            for job in todo:
+                await parsed.put(await asyncio.to_thread(read_input,job))
+            await parsed.put(None)
+
+        async def compute(item):
+            if item["status"] != "done" or not(item["job"]["tool"] in ["CG_DIVA","CI_calculation"]):
+                return item
+            return await loop.run_in_executor(compute_pool,compute_job,item)
+
+        async def render(item):
+            if item["status"] != "done" or not(needs_figure(item["job"])):
+                return item
+            return await loop.run_in_executor(render_pool,render_job,item)
+
+        async def write(item):
+            return await asyncio.to_thread(write_outputs,item)
+
+        async def collect():
+            while (st := await written.get()) is not None:
+                res.append(st)
+                print("{:<8} {:<15} {} ({:.1f} s)".format(st["status"],st["tool"],st["filename"],st["time"]))
+
+        await asyncio.gather(read(),
+                             stage(parsed,computed,workers,compute),
+                             stage(computed,rendered,render_workers,render),
+                             stage(rendered,written,1,write),
+                             collect())
+
+    return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipelined batch processing of the CGM performance assessment tools")
+    parser.add_argument("jobfile",help="Job specification file (json)")
+    parser.add_argument("--workers",type=int,default=None,help="Number of worker processes for the calculations")
+    parser.add_argument("--render_workers",type=int,default=1,help="Number of worker processes for the figures")
+    parser.add_argument("--prefetch",type=int,default=2,help="Maximum number of items waiting between two stages")
+    parser.add_argument("--force",action="store_true",help="Rerun jobs that are up to date")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    res = asyncio.run(run_pipeline(load_jobs(args.jobfile),workers=args.workers,render_workers=args.render_workers,
+                                   prefetch=args.prefetch,force=args.force))
+    print("Total time: {:.1f} s".format(time.perf_counter() - start))
+    failed = [r for r in res if r["status"] == "failed"]
+    for r in failed:
+        print("FAILED:",r["filename"],r["error"])
+    sys.exit(1 if failed else 0)
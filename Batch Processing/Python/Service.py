@@ -0,0 +1,638 @@
+"""
+Local analysis service for CG-DIVA and the confidence interval calculation (CI_calculation)
+
+Runs an HTTP server (on localhost or a Unix socket) that queues analysis jobs by priority and
+runs them on a pool of warm worker processes. Progress is streamed as json lines, results are
+returned as json and figures as png. Parsed input data are reused for requests with the same input.
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import sys
+import io
+import re
+import json
+import time
+import heapq
+import queue
+import hashlib
+import argparse
+import itertools
+import threading
+import traceback
+import contextlib
+import socketserver
+import multiprocessing as mp
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for folder in ["CG-DIVA","Confidence Intervals","Data Preparation"]:
+    sys.path.append(os.path.join(root,folder,"Python"))
+
+TOOLS = ["CG_DIVA","CI_calculation"]
+
+# Parameters of the compute functions and of the figure that may be set by a request
+PARAMS = {"CG_DIVA": ["N_BS","seed","conf_level","two_stage"],
+          "CI_calculation": ["N_BS","seed","alpha","two_stage"]}
+FIGURE = ["ylims","s_max","figsize","dpi"]
+
+
+def jsonable(x):
+    """
+    Convert results (dataframes, numpy arrays and numbers) to json compatible types, NaN to None
+
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(x, pd.DataFrame):
+        return jsonable(x.to_dict(orient="records"))
+    if isinstance(x, np.ndarray):
+        return jsonable(x.tolist())
+    if isinstance(x, dict):
+        return {str(k): jsonable(v) for k, v in x.items()}
+    if isinstance(x, (list,tuple)):
+        return [jsonable(v) for v in x]
+    if isinstance(x, (float,np.floating)):
+        return None if np.isnan(x) else float(x)
+    if isinstance(x, np.integer):
+        return int(x)
+    return x
+
+
+class Progress(io.TextIOBase):
+    """
+    Replacement of stdout in the workers, sends progress (percentage of progress bar) and log lines
+    of the tools to the service
+
+    """
+
+    def __init__(self, outbox, wid, job_id):
+        self.outbox, self.wid, self.job_id = outbox, wid, job_id
+        self.percent = None
+
+    def write(self, s):
+        for part in re.split(r"[\r\n]",s):
+            m = re.search(r"\| (\d+(?:\.\d+)?)%$",part)
+            if m:
+                if m.group(1) != self.percent:
+                    self.percent = m.group(1)
+                    self.outbox.put(("progress",self.wid,self.job_id,float(self.percent)))
+            elif part.strip():
+                self.outbox.put(("log",self.wid,self.job_id,part.strip()))
+        return len(s)
+
+
+def worker(wid, inbox, outbox, cache_size=8):
+    """
+    Worker process: imports the tools with all dependencies once and runs the jobs sent to inbox
+
+    Parsed input data are kept in a cache (last cache_size inputs) and reused for jobs with the same
+    input hash. Valid inputs are cached as preprocessed Dataset, which both tools use without copying. Messages to the service: (event, worker id, job id, payload)
+
+    """
+
+    os.environ.setdefault("MPLBACKEND","Agg")
+    import pandas as pd
+    import matplotlib
+    import CG_DIVA
+    import CI_calculation as CI_calc
+    from Dataset import Dataset
+
+    # Warm up: load scipy and matplotlib before the first job arrives
+    CG_DIVA.sts.norm.ppf(0.5)
+    CG_DIVA.plt.close(CG_DIVA.plt.figure())
+
+    cache = OrderedDict()
+    outbox.put(("ready",wid,None,[]))
+
+    while True:
+        task = inbox.get()
+        if task is None:
+            break
+        job_id = task["id"]
+        outbox.put(("running",wid,job_id,None))
+        try:
+            progress = Progress(outbox,wid,job_id)
+            # rc parameters changed by a job (e.g. the font size set by CG_DIVA_plot) are reverted afterwards,
+            # so that the figures do not depend on the jobs run before by the same worker
+            with contextlib.redirect_stdout(progress), contextlib.redirect_stderr(progress), matplotlib.rc_context():
+                # Input data
+                if task["hash"] in cache:
+                    cache.move_to_end(task["hash"])
+                    print("Using cached input data")
+                else:
+                    src = io.StringIO(task["data"]) if task.get("data") is not None else task["input"]
+                    df = pd.read_csv(src)
+                    missing = [c for c in task["columns"].values() if not(c in df.columns)]
+                    if missing:
+                        raise ValueError("Columns "+", ".join(missing)+" do not exist in input data")
+                    df = df.rename(columns={v: k for k, v in task["columns"].items()})
+                    # Invalid data are kept as dataframe, the tool reports the error
+                    try:
+                        df = Dataset(df)
+                    except ValueError:
+                        pass
+                    cache[task["hash"]] = df
+                    if len(cache) > cache_size:
+                        cache.popitem(last=False)
+                df = cache[task["hash"]]
+                df = df if isinstance(df,Dataset) else df.copy()
+
+                # Calculation
+                metrics = CG_DIVA.Metrics() if task["tool"] == "CG_DIVA" else CI_calc.Metrics()
+                if task["tool"] == "CG_DIVA":
+                    res = CG_DIVA.CG_DIVA_compute(df,metrics=metrics,**task["params"])
+                else:
+                    res = CI_calc.CI_compute(df,metrics=metrics,**task["params"])
+                result = {k: getattr(res,k) for k in res.__dataclass_fields__ if not(k in ["data","BS_TI","BS_AR"])}
+                result["metrics"] = metrics.stages
+                result = jsonable(result)
+
+                # Figure
+                png = None
+                if task["tool"] == "CG_DIVA" and task["figure"] is not None:
+                    fig_args = dict(task["figure"])
+                    dpi = fig_args.pop("dpi",600)
+                    with metrics.span("plotting"):
+                        fig = CG_DIVA.CG_DIVA_plot(res,**fig_args)
+                        buf = io.BytesIO()
+                        fig.savefig(buf,format="png",dpi=dpi)
+                        CG_DIVA.plt.close("all")
+                    png = buf.getvalue()
+
+            outbox.put(("done",wid,job_id,{"result": result, "figure": png, "cached": list(cache)}))
+        except Exception as e:
+            outbox.put(("failed",wid,job_id,{"error": repr(e), "traceback": traceback.format_exc(),
+                                              "cached": list(cache)}))
+
+
+class Service:
+    """
+    Job queue and pool of warm worker processes
+
+    Input:
+    workers:    Number of worker processes
+    max_queue:  Maximum number of queued jobs (further submissions are rejected)
+    cache_size: Number of parsed input datasets kept by each worker
+    job_ttl:    Time in s after which finished jobs (with results and figures) are removed
+    max_jobs:   Maximum number of finished jobs kept (the oldest are removed first)
+
+    Worker processes that exit (e.g. killed or crashed) are replaced, their running job fails.
+
+    Usage:
+    service = Service(workers=2).start()
+    job_id = service.submit({"tool": "CI_calculation", "input": "Test_Data.csv"})
+    for event in service.events(job_id): ...
+    service.stop()
+
+    """
+
+    def __init__(self, workers=2, max_queue=100, cache_size=8, job_ttl=3600, max_jobs=1000):
+        self.n_workers, self.max_queue, self.cache_size = workers, max_queue, cache_size
+        self.job_ttl, self.max_jobs = job_ttl, max_jobs
+        self.jobs = {}
+        self.queue = []                 # Heap of (-priority, submission number, job id)
+        self.idle = []                  # Ids of idle workers
+        self.cached = {}                # Worker id: hashes of cached input data
+        self.assigned = {}              # Worker id: id of the running job
+        self.procs, self.inboxes = {}, {}
+        self.cv = threading.Condition()
+        self.counter = itertools.count()
+        self.wids = itertools.count()
+        self.running = False
+
+    def _spawn(self):
+        # Worker ids are not reused, messages of replaced workers are ignored
+        wid = next(self.wids)
+        self.inboxes[wid] = self.ctx.Queue()
+        self.procs[wid] = self.ctx.Process(target=worker,args=(wid,self.inboxes[wid],self.outbox,self.cache_size),
+                                           daemon=True)
+        self.procs[wid].start()
+
+    def start(self):
+        self.ctx = mp.get_context("spawn")
+        self.outbox = self.ctx.Queue()
+        for _ in range(self.n_workers):
+            self._spawn()
+        self.running = True
+        self.threads = [threading.Thread(target=self._dispatch,daemon=True),
+                        threading.Thread(target=self._collect,daemon=True)]
+        for t in self.threads:
+            t.start()
+        return self
+
+    def stop(self):
+        with self.cv:
+            self.running = False
+            self.cv.notify_all()
+        for q in list(self.inboxes.values()):
+            q.put(None)
+        self.outbox.put(("stop",None,None,None))
+        for p in list(self.procs.values()):
+            p.join(timeout=10)
+
+    def submit(self, spec):
+        """
+        Queue a job
+
+        Input:
+        spec:       Dict with entries
+                    tool:       "CG_DIVA" or "CI_calculation"
+                    data:       Input data as csv text, or
+                    input:      Path of local csv file
+                    columns:    Mapping of tool columns to columns of the input data (optional)
+                    params:     Parameters of the compute function, e.g. {"N_BS": 10000, "seed": 1} (optional)
+                    figure:     Figure parameters (ylims, s_max, figsize, dpi) or true for defaults,
+                                CG_DIVA only (optional)
+                    priority:   Jobs with higher priority are run first (optional, default 0)
+
+        Output:
+        job_id:     Id of the job
+
+        """
+
+        tool = spec.get("tool")
+        if not(tool in TOOLS):
+            raise ValueError("tool must be one of "+", ".join(TOOLS))
+        if (spec.get("data") is None) == (spec.get("input") is None):
+            raise ValueError("Either data or input has to be provided")
+        params = spec.get("params",{})
+        unknown = [p for p in params if not(p in PARAMS[tool])]
+        figure = spec.get("figure")
+        figure = {} if figure is True else (figure or None)
+        if figure is not None:
+            unknown += [p for p in figure if not(p in FIGURE)]
+        if unknown:
+            raise ValueError("Unknown parameters: "+", ".join(unknown))
+        columns = spec.get("columns",{})
+
+        # Hash of input data and column mapping
+        h = hashlib.sha256()
+        if spec.get("data") is not None:
+            h.update(spec["data"].encode())
+        else:
+            if not(os.path.isfile(spec["input"])):
+                raise ValueError("Input file "+spec["input"]+" does not exist")
+            with open(spec["input"],"rb") as f:
+                for chunk in iter(lambda: f.read(1<<20), b""):
+                    h.update(chunk)
+        h.update(json.dumps(columns,sort_keys=True).encode())
+
+        job_id = hashlib.sha1(str(time.time()).encode()+os.urandom(8)).hexdigest()[:12]
+        job = {"id": job_id, "tool": tool, "status": "queued", "priority": spec.get("priority",0),
+               "progress": 0.0, "submitted": time.time(), "started": None, "finished": None,
+               "result": None, "figure": None, "error": None, "events": [],
+               "task": {"id": job_id, "tool": tool, "hash": h.hexdigest(), "data": spec.get("data"),
+                        "input": spec.get("input"), "columns": columns, "params": params, "figure": figure}}
+        with self.cv:
+            self._evict()
+            if sum(j["status"] == "queued" for j in self.jobs.values()) >= self.max_queue:
+                raise OverflowError("Job queue is full")
+            self.jobs[job_id] = job
+            heapq.heappush(self.queue,(-job["priority"],next(self.counter),job_id))
+            self._event(job,{"event": "queued"})
+            self.cv.notify_all()
+
+        return job_id
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued job or remove a finished job
+
+        """
+
+        with self.cv:
+            job = self.jobs[job_id]
+            if job["status"] == "running":
+                raise RuntimeError("Running jobs can not be cancelled")
+            if job["status"] == "queued":
+                job["status"] = "cancelled"
+                job["finished"] = time.time()
+                self._event(job,{"event": "cancelled"})
+            else:
+                del self.jobs[job_id]
+
+    def summary(self, job_id):
+        """
+        Status and results of a job
+
+        """
+
+        with self.cv:
+            job = self.jobs[job_id]
+            res = {k: job[k] for k in ["id","tool","status","priority","progress","submitted","started",
+                                       "finished","result","error"]}
+            res["figure"] = job["figure"] is not None
+            return res
+
+    def events(self, job_id, timeout=None):
+        """
+        Generator of the events of a job until the job is finished
+        (queued, running, progress, log, done, failed or cancelled)
+
+        """
+
+        i = 0
+        while True:
+            with self.cv:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    return
+                if i == len(job["events"]):
+                    if job["status"] in ["done","failed","cancelled"] or not(self.running):
+                        return
+                    if not(self.cv.wait(timeout)) and timeout is not None:
+                        return
+                new = job["events"][i:]
+            for ev in new:
+                yield ev
+            i += len(new)
+
+    def _event(self, job, ev):
+        ev["time"] = time.time()
+        job["events"].append(ev)
+        self.cv.notify_all()
+
+    def _evict(self):
+        """
+        Remove finished jobs older than job_ttl and the oldest finished jobs beyond max_jobs (called with lock)
+
+        """
+
+        now = time.time()
+        done = sorted((j["finished"],k) for k, j in self.jobs.items() if j["status"] in ["done","failed","cancelled"])
+        for i, (finished, k) in enumerate(done):
+            if now - finished > self.job_ttl or i < len(done) - self.max_jobs:
+                del self.jobs[k]
+
+    def _check_workers(self):
+        """
+        Replace worker processes that exited, the job running on such a worker fails (called with lock)
+
+        """
+
+        for wid, p in list(self.procs.items()):
+            if p.is_alive():
+                continue
+            del self.procs[wid], self.inboxes[wid]
+            self.cached.pop(wid,None)
+            if wid in self.idle:
+                self.idle.remove(wid)
+            job = self.jobs.get(self.assigned.pop(wid,None))
+            if job is not None and job["status"] == "running":
+                job["status"], job["finished"] = "failed", time.time()
+                job["task"]["data"] = None
+                job["error"] = "Worker process exited (exit code "+str(p.exitcode)+")"
+                self._event(job,{"event": "failed", "error": job["error"], "traceback": None})
+            self._spawn()
+
+    def _dispatch(self):
+        """
+        Send the queued job with highest priority to an idle worker, preferably to one that holds
+        the input data in its cache
+
+        """
+
+        while True:
+            with self.cv:
+                while self.running and not(self.queue and self.idle):
+                    self.cv.wait()
+                if not(self.running):
+                    return
+                _, _, job_id = heapq.heappop(self.queue)
+                job = self.jobs.get(job_id)
+                if job is None or job["status"] != "queued":
+                    continue
+                task = job["task"]
+                hit = [w for w in self.idle if task["hash"] in self.cached.get(w,[])]
+                wid = hit[0] if hit else self.idle[0]
+                self.idle.remove(wid)
+                self.assigned[wid] = job_id
+                job["status"] = "running"
+                job["started"] = time.time()
+                if hit:
+                    task = {**task, "data": None}
+                self.inboxes[wid].put(task)
+
+    def _collect(self):
+        """
+        Process the messages of the workers and check once per second that the workers are alive
+
+        """
+
+        checked = time.monotonic()
+        while True:
+            try:
+                event, wid, job_id, payload = self.outbox.get(timeout=1)
+            except queue.Empty:
+                event = None
+            if event == "stop":
+                return
+            with self.cv:
+                if self.running and time.monotonic() - checked >= 1:
+                    self._check_workers()
+                    self._evict()
+                    checked = time.monotonic()
+                if event is None or not(wid in self.procs):
+                    continue
+                if event == "ready":
+                    self.idle.append(wid)
+                    self.cv.notify_all()
+                    continue
+                job = self.jobs.get(job_id)
+                if event == "progress" and job is not None:
+                    job["progress"] = payload
+                    self._event(job,{"event": "progress", "percent": payload})
+                elif event == "log" and job is not None:
+                    self._event(job,{"event": "log", "message": payload})
+                elif event == "running" and job is not None:
+                    self._event(job,{"event": "running", "worker": wid})
+                elif event in ["done","failed"]:
+                    self.cached[wid] = payload["cached"]
+                    self.assigned.pop(wid,None)
+                    self.idle.append(wid)
+                    if job is not None:
+                        job["status"] = event
+                        job["finished"] = time.time()
+                        job["task"]["data"] = None
+                        if event == "done":
+                            job["progress"] = 100.0
+                            job["result"], job["figure"] = payload["result"], payload["figure"]
+                            self._event(job,{"event": "done"})
+                        else:
+                            job["error"] = payload["error"]
+                            self._event(job,{"event": "failed", "error": payload["error"],
+                                             "traceback": payload["traceback"]})
+                    self.cv.notify_all()
+
+
+def handle_errors(fun):
+    """
+    Send exceptions of request handlers as json error responses
+
+    """
+
+    def wrapped(self):
+        try:
+            fun(self)
+        except KeyError as e:
+            self.send_json({"error": str(e.args[0])},404)
+        except OverflowError as e:
+            self.send_json({"error": str(e)},503)
+        except RuntimeError as e:
+            self.send_json({"error": str(e)},409)
+        except (ValueError,json.JSONDecodeError) as e:
+            self.send_json({"error": str(e)},400)
+    return wrapped
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the service
+
+    POST   /jobs                Submit a job (json body, see Service.submit), returns {"id": ...}
+    GET    /jobs                List of all jobs
+    GET    /jobs/<id>           Status and results of a job
+    GET    /jobs/<id>/events    Stream of events (one json object per line) until the job is finished
+    GET    /jobs/<id>/figure    Figure of a finished CG_DIVA job (png)
+    DELETE /jobs/<id>           Cancel a queued job or remove a finished job
+    GET    /status              Number of workers and queued/running jobs
+
+    """
+
+    def send_json(self, obj, code=200):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self):
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if parts[:1] != ["jobs"] or len(parts) > 3:
+            return None, None
+        job_id = parts[1] if len(parts) > 1 else None
+        if job_id is not None and not(job_id in self.server.service.jobs):
+            raise KeyError("Job "+job_id+" does not exist")
+        return job_id, parts[2] if len(parts) > 2 else None
+
+    @handle_errors
+    def do_POST(self):
+        if self.route() != (None,None):
+            raise KeyError("Not found")
+        spec = json.loads(self.rfile.read(int(self.headers.get("Content-Length",0))) or b"{}")
+        self.send_json({"id": self.server.service.submit(spec)},202)
+
+    @handle_errors
+    def do_GET(self):
+        service = self.server.service
+        if self.path.rstrip("/") == "/status":
+            with service.cv:
+                status = [j["status"] for j in service.jobs.values()]
+            return self.send_json({"workers": service.n_workers, "idle": len(service.idle),
+                                   "queued": status.count("queued"), "running": status.count("running")})
+        job_id, sub = self.route()
+        if job_id is None and sub is None:
+            return self.send_json([{k: v for k, v in service.summary(j).items() if k != "result"}
+                                   for j in list(service.jobs)])
+        if sub is None:
+            return self.send_json(service.summary(job_id))
+        if sub == "figure":
+            png = service.jobs[job_id]["figure"]
+            if png is None:
+                raise KeyError("Job "+job_id+" has no figure")
+            self.send_response(200)
+            self.send_header("Content-Type","image/png")
+            self.send_header("Content-Length",str(len(png)))
+            self.end_headers()
+            return self.wfile.write(png)
+        if sub == "events":
+            self.send_response(200)
+            self.send_header("Content-Type","application/x-ndjson")
+            self.end_headers()
+            for ev in service.events(job_id):
+                self.wfile.write((json.dumps(ev)+"\n").encode())
+                self.wfile.flush()
+            return
+        raise KeyError("Not found")
+
+    @handle_errors
+    def do_DELETE(self):
+        job_id, sub = self.route()
+        if job_id is None or sub is not None:
+            raise KeyError("Not found")
+        self.server.service.cancel(job_id)
+        self.send_json({"id": job_id})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(host="127.0.0.1", port=8765, socket=None, workers=2, max_queue=100, cache_size=8, job_ttl=3600, max_jobs=1000):
+    """
+    Start the service and serve requests until interrupted
+
+    Inputs:
+    host, port: Address of the HTTP server (only local addresses are accepted)
+    socket:     Path of a Unix socket to serve on instead of host and port (optional)
+    workers:    Number of worker processes
+    max_queue:  Maximum number of queued jobs
+    cache_size: Number of parsed input datasets kept by each worker
+    job_ttl:    Time in s after which finished jobs are removed
+    max_jobs:   Maximum number of finished jobs kept
+
+    """
+
+    if socket is None and not(host in ["127.0.0.1","localhost","::1"]):
+        raise ValueError("The service only serves local addresses")
+
+    service = Service(workers=workers,max_queue=max_queue,cache_size=cache_size,job_ttl=job_ttl,max_jobs=max_jobs).start()
+    if socket is not None:
+        if os.path.exists(socket):
+            os.remove(socket)
+        server = UnixHTTPServer(socket,Handler)
+        print("Serving on unix socket",socket)
+    else:
+        server = ThreadingHTTPServer((host,port),Handler)
+        print("Serving on http://"+host+":"+str(port))
+    server.service = service
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        if socket is not None and os.path.exists(socket):
+            os.remove(socket)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local analysis service for CG_DIVA and CI_calculation")
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--port",type=int,default=8765)
+    parser.add_argument("--socket",default=None,help="Serve on a Unix socket instead of host and port")
+    parser.add_argument("--workers",type=int,default=2,help="Number of worker processes")
+    parser.add_argument("--max_queue",type=int,default=100,help="Maximum number of queued jobs")
+    parser.add_argument("--cache_size",type=int,default=8,help="Number of input datasets cached by each worker")
+    parser.add_argument("--job_ttl",type=float,default=3600,help="Time in s after which finished jobs are removed")
+    parser.add_argument("--max_jobs",type=int,default=1000,help="Maximum number of finished jobs kept")
+    args = parser.parse_args()
+
+    serve(host=args.host,port=args.port,socket=args.socket,workers=args.workers,
+          max_queue=args.max_queue,cache_size=args.cache_size,job_ttl=args.job_ttl,max_jobs=args.max_jobs)
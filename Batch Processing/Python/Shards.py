@@ -0,0 +1,73 @@
+"""
+Bootstrapping of CG-DIVA and the confidence interval calculation (CI_calculation) in shards
+
+Each shard can be run on a different machine and writes a file with its bootstrap samples. After
+copying all shard files to one machine, the merge step validates the shards and calculates the results.
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import sys
+import argparse
+import pandas as pd
+
+os.environ.setdefault("MPLBACKEND","Agg")
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for folder in ["CG-DIVA","Confidence Intervals"]:
+    sys.path.append(os.path.join(root,folder,"Python"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrapping of CG_DIVA and CI_calculation in shards")
+    sub = parser.add_subparsers(dest="step",required=True)
+
+    run = sub.add_parser("run",help="Run a single shard")
+    run.add_argument("tool",choices=["CG_DIVA","CI_calculation"])
+    run.add_argument("input",help="csv file with columns SensorID, Comp and CGM")
+    run.add_argument("--shard",type=int,required=True,help="Number of the shard (0 to shards-1)")
+    run.add_argument("--shards",type=int,required=True,help="Total number of shards")
+    run.add_argument("--N_BS",type=int,default=10000,help="Total number of bootstrap samples")
+    run.add_argument("--seed",type=int,default=1)
+    run.add_argument("--save_path",default=".")
+    run.add_argument("--filename",default=None,help="Filename of shard files (default: tool)")
+    run.add_argument("--two_stage",action="store_true",help="Resample patients (column PatientID) and then sensors")
+
+    merge = sub.add_parser("merge",help="Merge all shards and calculate the results")
+    merge.add_argument("tool",choices=["CG_DIVA","CI_calculation"])
+    merge.add_argument("input",help="csv file used for the shards")
+    merge.add_argument("files",nargs="+",help="Shard files")
+    merge.add_argument("--save_path",default=".")
+    merge.add_argument("--filename",default=None,help="Filename of results (default: tool)")
+    merge.add_argument("--figure",action="store_true",help="Save CG-DIVA figure")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input)
+    save_path = os.path.join(args.save_path,"")
+    filename = args.filename if args.filename else {"CG_DIVA": "CG-DIVA", "CI_calculation": "CI_Results"}[args.tool]
+
+    if args.tool == "CG_DIVA":
+        import CG_DIVA
+        if args.step == "run":
+            CG_DIVA.CG_DIVA_shard(df,args.shard,args.shards,N_BS=args.N_BS,seed=args.seed,
+                                  save_path=save_path,filename=filename,two_stage=args.two_stage)
+        else:
+            res = CG_DIVA.CG_DIVA_merge(df,args.files)
+            res.RES.to_csv(save_path+filename+".csv",index=None)
+            if args.figure:
+                CG_DIVA.CG_DIVA_plot(res).savefig(save_path+filename+".png",dpi=600)
+    else:
+        import CI_calculation as CI_calc
+        if args.step == "run":
+            CI_calc.CI_shard(df,args.shard,args.shards,N_BS=args.N_BS,seed=args.seed,
+                             save_path=save_path,filename=filename,two_stage=args.two_stage)
+        else:
+            res = CI_calc.CI_merge(df,args.files)
+            res.RES.to_csv(save_path+filename+".csv",index=None)
@@ -0,0 +1,320 @@
+"""
+Benchmark of the CGM performance assessment tools (CG_DIVA, CI_calculation, DGR_plot and CTCA)
+
+Runs the processing stages of all tools on synthetic studies of increasing size, records processing
+times and peak memory and writes the results to a json file that can be compared between versions
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import platform
+import argparse
+import contextlib
+import tracemalloc
+import warnings
+import numpy as np
+import pandas as pd
+
+# Make tools importable
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for folder in ["CG-DIVA","Confidence Intervals","Dynamic Glucose Region (DGR) Plot","Clinical Trend Concurrence Analysis"]:
+    sys.path.append(os.path.join(root,folder,"Python"))
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import CG_DIVA
+import CI_calculation as CI_calc
+import DGR_plot as dgr_plt
+import CTCA as ctca
+from Synthetic_Data import synthetic_study, tool_data
+
+
+def render(fig=None):
+    """
+    Render the current figure to png (dpi=600) in memory and close it
+
+    """
+
+    fig = plt.gcf() if fig is None else fig
+    fig.savefig(io.BytesIO(),format="png",dpi=600)
+    plt.close("all")
+
+
+def stages_CI_calculation(df, N_BS, seed):
+    """
+    Processing stages of CI_calculation
+
+    Output:
+    List of (stage name, function) that have to be called in order
+    Metrics object recording the processing stages within the functions
+
+    """
+
+    st = {}
+    metrics = CI_calc.Metrics()
+
+    def preprocessing():
+        st["df"] = CI_calc.data_processing(df.copy())
+
+    def intervals():
+        dfp = st["df"]
+        RES = pd.DataFrame()
+        RES["Range"] = ["<70","70-180",">180","Total"]
+        for WI in ["WI15","WI20","WI40"]:
+            RES["AR"+WI[2:4]] = (dfp.groupby("Range")[WI].mean()*100).to_numpy()
+        RES = CI_calc.CI_Clopper_Pearson(RES,dfp)
+        st["RES"] = CI_calc.CI_WilsonCC(RES,dfp)
+
+    def bootstrapping():
+        CI_calc.CI_Bootstrapping(st["RES"],st["df"],N_BS=N_BS,seed=seed,metrics=metrics)
+
+    return [("preprocessing",preprocessing),("clopper_pearson_wilson",intervals),("bootstrapping",bootstrapping)], metrics
+
+
+def stages_CG_DIVA(df, N_BS, seed):
+    """
+    Processing stages of CG_DIVA
+
+    Output:
+    List of (stage name, function) that have to be called in order
+    Metrics object recording the processing stages within the functions
+
+    """
+
+    st = {}
+    metrics = CG_DIVA.Metrics()
+
+    def preprocessing():
+        st["df"] = CG_DIVA.data_processing(df.copy())
+
+    def bootstrapping():
+        st["RES"] = CG_DIVA.boostrapping(st["df"],N_BS,seed,metrics=metrics)
+
+    def plotting():
+        CG_DIVA.plotting(st["df"],st["RES"],"",[-80,80],25,[16.5,8.5])
+
+    return [("preprocessing",preprocessing),("bootstrapping",bootstrapping),("plotting",plotting),("rendering",render)], metrics
+
+
+def stages_DGR_plot(df, N_BS, seed):
+    """
+    Processing stages of DGR_plot
+
+    Output:
+    List of (stage name, function) that have to be called in order
+    Metrics object recording the processing stages within the functions
+
+    """
+
+    st = {}
+    metrics = dgr_plt.Metrics()
+
+    def remove_data():
+        st["df"], _, _, _ = dgr_plt.remove_data(df)
+
+    def region_count():
+        dgr_plt.region_cnt(st["df"].copy())
+
+    def plotting():
+        dgr_plt.DGR_plot(st["df"],show_fig=False,remove_dat=False,metrics=metrics)
+
+    return [("remove_data",remove_data),("region_count",region_count),("plotting",plotting),("rendering",render)], metrics
+
+
+def stages_CTCA(df, N_BS, seed):
+    """
+    Processing stages of CTCA
+
+    Output:
+    List of (stage name, function) that have to be called in order
+    Metrics object recording the processing stages within the functions
+
+    """
+
+    metrics = ctca.Metrics()
+
+    def plotting():
+        ctca.CTCA(df,show_fig=False,metrics=metrics)
+
+    return [("plotting",plotting),("rendering",render)], metrics
+
+
+TOOLS = {"CI_calculation": stages_CI_calculation,
+         "CG_DIVA": stages_CG_DIVA,
+         "DGR_plot": stages_DGR_plot,
+         "CTCA": stages_CTCA}
+
+
+def run_stages(stages, memory=False):
+    """
+    Run processing stages and measure processing time and (optionally) peak memory of each stage
+
+    Input:
+    stages:     List of (stage name, function) and Metrics object as returned by the stages_ functions
+    memory:     True/False whether to trace memory allocations (slows down processing)
+
+    Output:
+    res:        Dict {stage name: (time in s, peak memory in MB or NaN)}, stages recorded within the
+                tools are included as "<tool stage>" with processing time only
+
+    """
+
+    stages, metrics = stages
+    res = {}
+    for name, fun in stages:
+        if memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fun()
+        dt = time.perf_counter() - start
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]/1e6
+            tracemalloc.stop()
+        else:
+            peak = np.nan
+        res[name] = (dt, peak)
+
+    for name, st in metrics.stages.items():
+        if not(name in res):
+            res["<"+name+">"] = (st["time"], np.nan)
+
+    return res
+
+
+def benchmark(n_sensors=[24,48,96], n_points=[150], tools=list(TOOLS),
+                N_BS=200, repeats=3, seed=1, memory=True,
+                save_path=None, filename="Benchmark", **study_args):
+    """
+    Benchmark the processing stages of the tools for a sweep of synthetic study sizes
+
+    Inputs:
+    n_sensors:      List of number of sensors
+    n_points:       List of number of datapoints per sensor
+    tools:          List of tools to benchmark
+    N_BS:           Number of bootstrap samples
+    repeats:        Number of repetitions, the minimum processing time is reported
+    seed:           Seed for data generation and bootstrapping
+    memory:         True/False whether to measure peak memory in an additional run
+    save_path:      Path for saving the json results file, None if results shall not be saved
+    filename:       Filename of results file
+    study_args:     Further parameters passed to synthetic_study (e.g. bias, noise_corr)
+
+    Output:
+    RES:            Pandas dataframe with columns "Tool", "Stage", "N_Sensors", "N_Points", "N_Rows",
+                    "N_BS", "Time", "Peak_MB"
+
+    """
+
+    rows = []
+    for ns in n_sensors:
+        for npts in n_points:
+            study = synthetic_study(n_sensors=ns,n_points=npts,seed=seed,**study_args)
+            for tool in tools:
+                dat = tool_data(study,tool)
+                times = []
+                for _ in range(repeats):
+                    times.append(run_stages(TOOLS[tool](dat,N_BS,seed)))
+                mem = run_stages(TOOLS[tool](dat,N_BS,seed),memory=True) if memory else None
+                for stage in times[0]:
+                    rows.append({"Tool": tool, "Stage": stage, "N_Sensors": ns, "N_Points": npts,
+                                 "N_Rows": dat.shape[0], "N_BS": N_BS,
+                                 "Time": min(t[stage][0] for t in times),
+                                 "Peak_MB": mem[stage][1] if memory and stage in mem else np.nan})
+                print(tool,"N_Sensors:",ns,"N_Points:",npts,"Time: {:.2f} s".format(sum(r["Time"] for r in rows if r["Tool"]==tool and r["N_Sensors"]==ns and r["N_Points"]==npts and r["Stage"][0]!="<")))
+
+    RES = pd.DataFrame(rows)
+
+    if save_path is not None:
+        meta = {"python": platform.python_version(),
+                "platform": platform.platform(),
+                "numpy": np.__version__,
+                "pandas": pd.__version__,
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "repeats": repeats,
+                "seed": seed,
+                "study_args": study_args}
+        with open(os.path.join(save_path,filename+".json"),"w") as f:
+            json.dump({"meta": meta, "results": RES.replace({np.nan: None}).to_dict(orient="records")},f,indent=1)
+
+    return RES
+
+
+def load_benchmark(file):
+    """
+    Load benchmark results from json file
+
+    Output:
+    RES:        Pandas dataframe with benchmark results
+    meta:       Dict with meta information
+
+    """
+
+    with open(file) as f:
+        dat = json.load(f)
+
+    return pd.DataFrame(dat["results"]), dat["meta"]
+
+
+def compare_benchmarks(file_ref, file_new, tol=0.2):
+    """
+    Compare two benchmark results files
+
+    Input:
+    file_ref:   Results file of reference version
+    file_new:   Results file of new version
+    tol:        Relative tolerance for flagging regressions (0.2: 20% slower)
+
+    Output:
+    CMP:        Pandas dataframe with processing times, time ratio (new/ref) and regression flag for
+                all stages contained in both files
+
+    """
+
+    ref, _ = load_benchmark(file_ref)
+    new, _ = load_benchmark(file_new)
+    keys = ["Tool","Stage","N_Sensors","N_Points","N_BS"]
+    CMP = ref.merge(new,on=keys,suffixes=("_Ref","_New"))[keys+["Time_Ref","Time_New","Peak_MB_Ref","Peak_MB_New"]]
+    CMP["Ratio"] = CMP["Time_New"] / CMP["Time_Ref"]
+    CMP["Regression"] = CMP["Ratio"] > 1 + tol
+
+    return CMP
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the CGM performance assessment tools")
+    parser.add_argument("--sensors",type=int,nargs="+",default=[24,48,96],help="Number of sensors")
+    parser.add_argument("--points",type=int,nargs="+",default=[150],help="Number of datapoints per sensor")
+    parser.add_argument("--tools",nargs="+",default=list(TOOLS),choices=list(TOOLS))
+    parser.add_argument("--N_BS",type=int,default=200,help="Number of bootstrap samples")
+    parser.add_argument("--repeats",type=int,default=3)
+    parser.add_argument("--seed",type=int,default=1)
+    parser.add_argument("--no-memory",action="store_true",help="Skip peak memory measurement")
+    parser.add_argument("--save_path",default=".")
+    parser.add_argument("--filename",default="Benchmark")
+    parser.add_argument("--compare",metavar="REF_FILE",help="Compare results with a reference results file")
+    args = parser.parse_args()
+
+    RES = benchmark(n_sensors=args.sensors,n_points=args.points,tools=args.tools,N_BS=args.N_BS,
+                    repeats=args.repeats,seed=args.seed,memory=not(args.no_memory),
+                    save_path=args.save_path,filename=args.filename)
+    print(RES.to_string(index=False))
+
+    if args.compare:
+        CMP = compare_benchmarks(args.compare,os.path.join(args.save_path,args.filename+".json"))
+        print(CMP.to_string(index=False))
+        if CMP["Regression"].any():
+            sys.exit(1)
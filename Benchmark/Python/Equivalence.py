@@ -0,0 +1,322 @@
+"""
+Equivalence and speed regression tests of the CGM performance assessment tools against the reference engine
+
+The current implementations of boostrapping (CG_DIVA), CI_WilsonCC and CI_Bootstrapping (CI_calculation),
+region_cnt (DGR_plot) and zone_count (CTCA) are run next to the frozen pandas implementations of version 1.0
+(Reference.py) on the test data of the tools and on synthetic studies. Every field of the results tables and
+all region/zone counts are compared and the speedup with respect to the reference engine is recorded
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import sys
+import io
+import json
+import tempfile
+import time
+import platform
+import argparse
+import contextlib
+import warnings
+import numpy as np
+import pandas as pd
+
+# Make tools importable
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FOLDERS = {"CG_DIVA": "CG-DIVA",
+           "CI_calculation": "Confidence Intervals",
+           "DGR_plot": "Dynamic Glucose Region (DGR) Plot",
+           "CTCA": "Clinical Trend Concurrence Analysis"}
+for folder in FOLDERS.values():
+    sys.path.append(os.path.join(root,folder,"Python"))
+
+import CG_DIVA
+import CI_calculation as CI_calc
+import DGR_plot as dgr_plt
+import CTCA as ctca
+import Reference as ref
+from Synthetic_Data import synthetic_study, tool_data
+from Kernels import timing
+
+
+def test_cases(n_sensors=[24,96], n_points=[150], seed=1, test_data=True):
+    """
+    Input data of the tools for the equivalence tests
+
+    Input:
+    n_sensors:  List of number of sensors of the synthetic studies
+    n_points:   List of number of datapoints per sensor of the synthetic studies
+    seed:       Seed for data generation
+    test_data:  True/False whether to include the Test_Data.csv files of the tools
+
+    Output:
+    cases:      Dictionary case name: {tool: Pandas dataframe with the input data of the tool}
+
+    """
+
+    cases = {}
+    if test_data:
+        cases["Test_Data"] = {tool: pd.read_csv(os.path.join(root,folder,"Test_Data.csv")) for tool, folder in FOLDERS.items()}
+    for ns in n_sensors:
+        for npts in n_points:
+            study = synthetic_study(n_sensors=ns,n_points=npts,seed=seed)
+            cases["Synthetic_{}x{}".format(ns,npts)] = {tool: tool_data(study,tool) for tool in FOLDERS}
+
+    return cases
+
+
+def stages(data, N_BS=200, seed=1):
+    """
+    Reference and current implementation of each stage for the input data of one case
+
+    Input:
+    data:       Dictionary {tool: Pandas dataframe} of test_cases
+    N_BS:       Number of bootstrap samples
+    seed:       Seed for bootstrapping
+
+    Output:
+    List of (stage name, number of rows, reference function, current function), the functions are
+    called without arguments and return the results table or counts
+
+    """
+
+    # Common inputs of both implementations (calculated with the current implementation)
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        df_cg = CG_DIVA.data_processing(data["CG_DIVA"].copy())
+        df_ci = CI_calc.data_processing(data["CI_calculation"].copy())
+        RES = pd.DataFrame()
+        RES["Range"] = ["<70","70-180",">180","Total"]
+        for WI in ["WI15","WI20","WI40"]:
+            RES["AR"+WI[2:4]] = (df_ci.groupby("Range")[WI].mean()*100).to_numpy()
+        RES = CI_calc.CI_Clopper_Pearson(RES,df_ci)
+        RES_WCC = CI_calc.CI_WilsonCC(RES.copy(),df_ci)
+        df_ct = data["CTCA"]
+        ncats = df_ct["Comp_ROC_Cat"].nunique()
+        _, CMcnt = ctca.concurrence_matrix(df_ct,ncats)
+
+    # The reference region_cnt adds a column to its input
+    df_dgr, df_dgr_ref = data["DGR_plot"], data["DGR_plot"].copy()
+
+    return [("boostrapping", len(df_cg),
+             lambda: ref.boostrapping(df_cg,N_BS,seed),
+             lambda: CG_DIVA.boostrapping(df_cg,N_BS,seed)),
+            ("CI_WilsonCC", len(df_ci),
+             lambda: ref.CI_WilsonCC(RES.copy(),df_ci),
+             lambda: CI_calc.CI_WilsonCC(RES.copy(),df_ci)),
+            ("CI_Bootstrapping", len(df_ci),
+             lambda: ref.CI_Bootstrapping(RES_WCC.copy(),df_ci,N_BS=N_BS,seed=seed),
+             lambda: CI_calc.CI_Bootstrapping(RES_WCC.copy(),df_ci,N_BS=N_BS,seed=seed)),
+            ("region_cnt", len(df_dgr),
+             lambda: ref.region_cnt(df_dgr_ref),
+             lambda: dgr_plt.region_cnt(df_dgr)),
+            ("zone_count", int(CMcnt.sum()),
+             lambda: np.array(ref.zone_count(CMcnt,ncats)),
+             lambda: np.array(ctca.zone_count(CMcnt,ncats)))]
+
+
+def compare_results(res_ref, res_new, rtol=0, atol=0):
+    """
+    Compare the results of the reference and the current implementation
+
+    Input:
+    res_ref:    Results table (Pandas dataframe) or counts of the reference implementation
+    res_new:    Results table (Pandas dataframe) or counts of the current implementation
+    rtol, atol: Relative and absolute tolerance for numbers (0: exact equality)
+
+    Output:
+    equal:      True/False whether all fields agree (NaN agrees with NaN, text fields have to be identical)
+    max_diff:   Maximum absolute difference of the numbers
+    fields:     List of the fields (column[row]) that do not agree
+
+    """
+
+    if isinstance(res_ref,pd.DataFrame):
+        fields = [(col+"["+str(r)+"]", res_ref.at[r,col], res_new.at[r,col] if col in res_new.columns else None)
+                  for col in res_ref.columns for r in res_ref.index]
+    else:
+        fields = [("["+str(i)+"]", x, y) for i, (x, y) in enumerate(zip(np.ravel(res_ref),np.ravel(res_new)))]
+        if np.size(res_ref) != np.size(res_new):
+            fields.append(("size", np.size(res_ref), np.size(res_new)))
+
+    number = lambda x: isinstance(x,(int,float,np.number)) and not(isinstance(x,bool))
+    max_diff, bad = 0.0, []
+    for name, x, y in fields:
+        if number(x) and number(y):
+            x, y = float(x), float(y)
+            if np.isnan(x) and np.isnan(y):
+                continue
+            if not(np.isnan(x) or np.isnan(y)):
+                max_diff = max(max_diff,abs(x - y))
+            if not(np.isclose(x,y,rtol=rtol,atol=atol)) and x != y:
+                bad.append(name)
+        elif pd.isna(x) and pd.isna(y):
+            continue
+        elif str(x) != str(y):
+            bad.append(name)
+
+    return len(bad) == 0, max_diff, bad
+
+
+def equivalence(n_sensors=[24,96], n_points=[150], N_BS=200, repeats=3, seed=1, test_data=True,
+                rtol=0, atol=0, save_path=None, filename="Equivalence"):
+    """
+    Run the reference and the current implementations of all stages on all cases
+
+    Inputs:
+    n_sensors:  List of number of sensors of the synthetic studies
+    n_points:   List of number of datapoints per sensor of the synthetic studies
+    N_BS:       Number of bootstrap samples
+    repeats:    Number of timed calls per stage and implementation, the minimum is reported
+    seed:       Seed for data generation and bootstrapping
+    test_data:  True/False whether to include the Test_Data.csv files of the tools
+    rtol, atol: Relative and absolute tolerance for numbers (0: exact equality)
+    save_path:  Path for saving the json results file (can be used as baseline), None if results shall not be saved
+    filename:   Filename of results file
+
+    Output:
+    RES:        Pandas dataframe with columns "Stage", "Case", "Rows", "N_BS", "Time_Ref", "Time_New" (processing
+                times in s), "Speedup" (Time_Ref/Time_New), "Equal", "Max_Diff" and "Fields" (fields that do not agree)
+
+    """
+
+    rows = []
+    for case, data in test_cases(n_sensors=n_sensors,n_points=n_points,seed=seed,test_data=test_data).items():
+        for stage, n, func_ref, func_new in stages(data,N_BS=N_BS,seed=seed):
+            with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                t_ref, res_ref = timing(func_ref,repeats)
+                t_new, res_new = timing(func_new,repeats)
+            equal, max_diff, bad = compare_results(res_ref,res_new,rtol=rtol,atol=atol)
+            rows.append({"Stage": stage, "Case": case, "Rows": n, "N_BS": N_BS, "Time_Ref": t_ref,
+                         "Time_New": t_new, "Speedup": t_ref/t_new, "Equal": equal, "Max_Diff": max_diff,
+                         "Fields": " ".join(bad)})
+            print(stage,case,"Speedup: {:.1f}".format(t_ref/t_new),"" if equal else "NOT EQUAL: "+" ".join(bad))
+
+    RES = pd.DataFrame(rows)
+
+    if save_path is not None:
+        meta = {"python": platform.python_version(),
+                "platform": platform.platform(),
+                "numpy": np.__version__,
+                "pandas": pd.__version__,
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "repeats": repeats,
+                "seed": seed,
+                "rtol": rtol,
+                "atol": atol}
+        with open(os.path.join(save_path,filename+".json"),"w") as f:
+            json.dump({"meta": meta, "results": RES.to_dict(orient="records")},f,indent=1)
+
+    return RES
+
+
+def compare_baseline(file_base, RES, tol=0.2, min_time=1e-3):
+    """
+    Compare the speedups of the current implementations with a stored baseline
+
+    The speedup with respect to the reference engine is compared instead of the processing time, so that the
+    baseline does not depend on the speed of the machine. Stages faster than min_time are not flagged, as their
+    timing is dominated by noise
+
+    Input:
+    file_base:  Results file of equivalence (json) of the baseline version
+    RES:        Results of equivalence of the current version
+    tol:        Relative tolerance for flagging regressions (0.2: 20% slower relative to the reference engine)
+    min_time:   Minimum processing time in s of the current version for flagging regressions
+
+    Output:
+    CMP:        Pandas dataframe with speedups of baseline and current version, relative time of the current
+                version (Speedup_Base/Speedup_New) and regression flag for all stages contained in both
+
+    """
+
+    with open(file_base) as f:
+        base = pd.DataFrame(json.load(f)["results"])
+    keys = ["Stage","Case","N_BS"]
+    CMP = base[keys+["Speedup"]].merge(RES[keys+["Time_New","Speedup"]],on=keys,suffixes=("_Base","_New"))
+    CMP["Ratio"] = CMP["Speedup_Base"] / CMP["Speedup_New"]
+    CMP["Regression"] = (CMP["Ratio"] > 1 + tol) & (CMP["Time_New"] >= min_time)
+
+    return CMP
+
+
+def online_roundtrip(data, N_BS=200, seed=1):
+    """
+    Check that CI_Online gives the same results when the state is saved and loaded between two batches
+    as when all data is added at once, with the SensorIDs of the data and with integer SensorIDs.
+    The datapoints are split alternately, so that all sensors have data in both batches
+
+    Input:
+    data:       Dictionary {tool: Pandas dataframe} of test_cases
+    N_BS:       Number of bootstrap replicates
+    seed:       Seed of the Poisson weights
+
+    Output:
+    List of (SensorID type, equal, fields that do not agree)
+
+    """
+
+    res = []
+    df = data["CI_calculation"][["SensorID","Comp","CGM"]]
+    ids = {s: i+101 for i, s in enumerate(df["SensorID"].unique())}
+    for name, dat in [("original", df), ("integer", df.assign(SensorID=df["SensorID"].map(ids)))]:
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings(), tempfile.TemporaryDirectory() as tmp:
+            warnings.simplefilter("ignore")
+            RES_all = CI_calc.CI_Online(N_BS=N_BS,seed=seed).update(dat).compute().RES
+            CI_calc.CI_Online(N_BS=N_BS,seed=seed).update(dat.iloc[0::2]).save(os.path.join(tmp,"online.npz"))
+            online = CI_calc.CI_Online.load(os.path.join(tmp,"online.npz")).update(dat.iloc[1::2])
+            RES_load = online.compute().RES
+        equal, _, bad = compare_results(RES_all,RES_load)
+        if len(online.sensors) != dat["SensorID"].nunique():
+            equal, bad = False, bad+["n_sensors"]
+        res.append((name,equal,bad))
+
+    return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Equivalence and speed regression tests against the reference engine")
+    parser.add_argument("--sensors",type=int,nargs="*",default=[24,96],help="Number of sensors of the synthetic studies")
+    parser.add_argument("--points",type=int,nargs="+",default=[150],help="Number of datapoints per sensor")
+    parser.add_argument("--N_BS",type=int,default=200,help="Number of bootstrap samples")
+    parser.add_argument("--repeats",type=int,default=3)
+    parser.add_argument("--seed",type=int,default=1)
+    parser.add_argument("--no-test-data",action="store_true",help="Skip the Test_Data.csv files")
+    parser.add_argument("--rtol",type=float,default=0)
+    parser.add_argument("--atol",type=float,default=0)
+    parser.add_argument("--backend",default="auto",choices=["auto","numba","numpy"],help="Backend of the compiled kernels")
+    parser.add_argument("--save_path",default=None)
+    parser.add_argument("--filename",default="Equivalence")
+    parser.add_argument("--baseline",metavar="BASE_FILE",help="Compare speedups with a baseline results file")
+    parser.add_argument("--tol",type=float,default=0.2,help="Relative tolerance for speed regressions")
+    parser.add_argument("--min_time",type=float,default=1e-3,help="Minimum processing time in s for speed regressions")
+    args = parser.parse_args()
+
+    CG_DIVA.set_backend(args.backend)      # backend is shared by all tools
+
+    RES = equivalence(n_sensors=args.sensors,n_points=args.points,N_BS=args.N_BS,repeats=args.repeats,
+                      seed=args.seed,test_data=not(args.no_test_data),rtol=args.rtol,atol=args.atol,
+                      save_path=args.save_path,filename=args.filename)
+    print(RES.drop(columns="Fields").to_string(index=False))
+    fail = not(RES["Equal"].all())
+
+    for case, data in test_cases(n_sensors=[],test_data=True).items():
+        for name, equal, bad in online_roundtrip(data,N_BS=args.N_BS,seed=args.seed):
+            print("CI_Online save/load",case,name+" SensorIDs:","equal" if equal else "NOT EQUAL: "+" ".join(bad))
+            fail = fail or not(equal)
+
+    if args.baseline:
+        CMP = compare_baseline(args.baseline,RES,tol=args.tol,min_time=args.min_time)
+        print(CMP.to_string(index=False))
+        fail = fail or CMP["Regression"].any()
+
+    if fail:
+        sys.exit(1)
@@ -0,0 +1,108 @@
+"""
+Import time benchmark of the CGM performance assessment tools
+
+Measures the time for importing each tool in a fresh Python process and checks that heavy packages
+(scipy, matplotlib, sklearn) are not loaded at import
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import pandas as pd
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODULES = {"CG_DIVA": "CG-DIVA",
+           "CI_calculation": "Confidence Intervals",
+           "DGR_plot": "Dynamic Glucose Region (DGR) Plot",
+           "CTCA": "Clinical Trend Concurrence Analysis"}
+
+# Packages that must not be loaded when importing a tool
+HEAVY = ["scipy","matplotlib","sklearn"]
+
+# Code run in the fresh process: import time of the tool on top of its base dependencies
+CODE = """
+import sys, time, json
+import numpy, pandas
+t = time.perf_counter()
+import {module}
+dt = time.perf_counter() - t
+print(json.dumps({{"time": dt, "loaded": [m for m in {heavy} if m in sys.modules]}}))
+"""
+
+
+def import_time(module, repeats=5):
+    """
+    Measure the import time of a tool in fresh Python processes
+
+    Input:
+    module:     Name of tool module (key of MODULES)
+    repeats:    Number of measurements, the minimum is reported
+
+    Output:
+    t:          Import time in s (without numpy and pandas)
+    loaded:     List of heavy packages loaded by the import
+
+    """
+
+    path = os.path.join(root,MODULES[module],"Python")
+    times = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable,"-c",CODE.format(module=module,heavy=HEAVY)],
+                             cwd=path,capture_output=True,text=True,check=True).stdout
+        res = json.loads(out.strip().splitlines()[-1])
+        times.append(res["time"])
+
+    return min(times), res["loaded"]
+
+
+def import_benchmark(modules=list(MODULES), repeats=5, budget=0.1, save_path=None, filename="Import_Time"):
+    """
+    Import time benchmark of the tools
+
+    Inputs:
+    modules:    List of tool modules
+    repeats:    Number of measurements per module
+    budget:     Maximum accepted import time in s
+    save_path:  Path for saving the json results file, None if results shall not be saved
+    filename:   Filename of results file
+
+    Output:
+    RES:        Pandas dataframe with columns "Module", "Time", "Loaded" and "Pass"
+
+    """
+
+    rows = []
+    for module in modules:
+        t, loaded = import_time(module,repeats=repeats)
+        rows.append({"Module": module, "Time": t, "Loaded": loaded, "Pass": t <= budget and not loaded})
+    RES = pd.DataFrame(rows)
+
+    if save_path is not None:
+        with open(os.path.join(save_path,filename+".json"),"w") as f:
+            json.dump({"budget": budget, "results": RES.to_dict(orient="records")},f,indent=1)
+
+    return RES
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time benchmark of the CGM performance assessment tools")
+    parser.add_argument("--repeats",type=int,default=5)
+    parser.add_argument("--budget",type=float,default=0.1,help="Maximum accepted import time in s")
+    parser.add_argument("--save_path",default=None)
+    args = parser.parse_args()
+
+    RES = import_benchmark(repeats=args.repeats,budget=args.budget,save_path=args.save_path)
+    print(RES.to_string(index=False))
+    if not RES["Pass"].all():
+        sys.exit(1)
@@ -0,0 +1,152 @@
+"""
+Benchmark of the inner kernels of the CGM performance assessment tools with the NumPy and the numba backend
+
+The kernels (weighted quantiles of the bootstrap samples of CG_DIVA, preparation of the BCa limits of
+CG_DIVA and CI_calculation, region classification of DGR_plot) are timed on a synthetic study with both
+backends (see set_backend of the tools) and the results of both backends are checked for identity
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import sys
+import io
+import time
+import argparse
+import contextlib
+import numpy as np
+import pandas as pd
+
+# Make tools importable
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for folder in ["CG-DIVA","Confidence Intervals","Dynamic Glucose Region (DGR) Plot"]:
+    sys.path.append(os.path.join(root,folder,"Python"))
+
+import CG_DIVA
+import CI_calculation as CI_calc
+import DGR_plot as dgr_plt
+from Synthetic_Data import synthetic_study, tool_data
+
+
+def kernel_cases(study, N_BS=20, seed=1):
+    """
+    Kernel calls on a synthetic study
+
+    Input:
+    study:      Pandas dataframe created by synthetic_study
+    N_BS:       Number of bootstrap samples of the weighted quantiles
+    seed:       Seed of the bootstrap samples
+
+    Output:
+    cases:      Dictionary kernel name: (tool module, function without arguments)
+
+    """
+
+    # Sorted deviations of the total range of CG_DIVA and bootstrap counts of the sensors
+    with contextlib.redirect_stdout(io.StringIO()):
+        df = CG_DIVA.data_processing(tool_data(study,"CG_DIVA"))
+    df = df[(df["Range"] == 4) & df["Diff"].notna()].sort_values("Diff",kind="stable")
+    code, sens = pd.factorize(df["SensorID"])
+    v = df["Diff"].to_numpy(dtype=float)
+    C = CG_DIVA.cluster_counts(N_BS,len(sens),rng=CG_DIVA.random_state(seed))
+    qtl = CG_DIVA.interval_quantiles()[3]
+
+    # Bootstrap distribution with one replicate per row of the study
+    rng = np.random.default_rng(seed)
+    BS = 0.05 + rng.standard_normal(len(study))
+    BS_AR = np.minimum(0.9 + 0.03*rng.standard_normal(len(study)),1)
+
+    dgr = tool_data(study,"DGR_plot")
+
+    return {"weighted_quantile": (CG_DIVA, lambda: CG_DIVA.weighted_quantile(v,code,C,qtl)),
+            "BCa (CG_DIVA)": (CG_DIVA, lambda: np.array([CG_DIVA.BCa(BS,0.05,0.01,q) for q in [0.025,0.975]])),
+            "BCa (CI_calculation)": (CI_calc, lambda: CI_calc.BCa(BS_AR,0.9,0.01,alpha=0.05)),
+            "region_cnt": (dgr_plt, lambda: dgr_plt.region_cnt(dgr))}
+
+
+def timing(func, repeats=5):
+    """
+    Minimum processing time of repeated calls and result of the last call
+
+    """
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        res = func()
+        times.append(time.perf_counter() - start)
+
+    return min(times), res
+
+
+def kernel_benchmark(n_sensors=1000, n_points=1000, N_BS=20, repeats=5, seed=1, save_path=None, filename="Kernels"):
+    """
+    Benchmark of the inner kernels with the NumPy and the numba backend
+
+    Inputs:
+    n_sensors:  Number of sensors of the synthetic study
+    n_points:   Number of datapoints per sensor
+    N_BS:       Number of bootstrap samples of the weighted quantiles
+    repeats:    Number of timed calls per kernel and backend, the minimum is reported
+    seed:       Seed for data generation and bootstrapping
+    save_path:  Path for saving the csv results file, None if results shall not be saved
+    filename:   Filename of results file
+
+    Output:
+    RES:        Pandas dataframe with columns "Kernel", "Rows", "NumPy", "Numba" (processing times in s),
+                "Compile" (time of the first call with numba in s), "Speedup" and "Identical"
+                (numba results identical to NumPy results), NaN if numba is not installed
+
+    """
+
+    study = synthetic_study(n_sensors=n_sensors,n_points=n_points,seed=seed)
+    numba = CG_DIVA.JIT.available()
+
+    rows = []
+    for name, (module, func) in kernel_cases(study,N_BS=N_BS,seed=seed).items():
+        row = {"Kernel": name, "Rows": len(study)}
+        with contextlib.redirect_stdout(io.StringIO()):
+            module.set_backend("numpy")
+            row["NumPy"], ref = timing(func,repeats)
+            if numba:
+                module.set_backend("numba")
+                start = time.perf_counter()
+                func()
+                row["Compile"] = time.perf_counter() - start
+                row["Numba"], res = timing(func,repeats)
+                row["Speedup"] = row["NumPy"] / row["Numba"]
+                row["Identical"] = bool(np.array_equal(np.asarray(ref),np.asarray(res),equal_nan=True))
+            module.set_backend("auto")
+        rows.append(row)
+        print(name,"NumPy: {:.4f} s".format(row["NumPy"]),
+              "Numba: {:.4f} s".format(row["Numba"]) if numba else "(numba not installed)")
+    RES = pd.DataFrame(rows,columns=["Kernel","Rows","NumPy","Numba","Compile","Speedup","Identical"])
+
+    if save_path is not None:
+        RES.to_csv(os.path.join(save_path,filename+".csv"),index=None)
+
+    return RES
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the inner kernels with the NumPy and the numba backend")
+    parser.add_argument("--sensors",type=int,default=1000,help="Number of sensors")
+    parser.add_argument("--points",type=int,default=1000,help="Number of datapoints per sensor")
+    parser.add_argument("--N_BS",type=int,default=20,help="Number of bootstrap samples of the weighted quantiles")
+    parser.add_argument("--repeats",type=int,default=5)
+    parser.add_argument("--seed",type=int,default=1)
+    parser.add_argument("--save_path",default=None)
+    parser.add_argument("--filename",default="Kernels")
+    args = parser.parse_args()
+
+    RES = kernel_benchmark(n_sensors=args.sensors,n_points=args.points,N_BS=args.N_BS,repeats=args.repeats,
+                           seed=args.seed,save_path=args.save_path,filename=args.filename)
+    print(RES.to_string(index=False))
+    if (RES["Identical"] == False).any():
+        sys.exit(1)
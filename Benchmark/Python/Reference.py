@@ -0,0 +1,550 @@
+"""
+Frozen reference engine of the CGM performance assessment tools
+
+Pandas implementations of boostrapping (CG_DIVA), CI_Clopper_Pearson, CI_WilsonCC and CI_Bootstrapping
+(CI_calculation), region_cnt (DGR_plot) and zone_count (CTCA) as published in version 1.0 of the tools.
+The functions are kept unchanged (only np.NaN is written as np.nan) and serve as reference for the
+equivalence and speed regression tests in Equivalence.py. Do not optimize or modify this file.
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.stats as sts
+import warnings
+
+def boostrapping(df,N,seed,conf_level=0.95):
+
+    def BCa(dat,theta_h,a,qtl):
+        """
+        Function to calculate bias-corrected and accelerated bootstrap quantiles according to 
+        DiCiccio TJ, Efron B. Bootstrap confidence intervals. Stat Sci. 1996;11(3):189-228
+        Implementation is based on R package "bootstrap" (function bcanon)
+        In case of failure of the BCa method, the percentile method is used
+
+        Input:
+        dat:        Numpy array of bootstrapped samples
+        theta_h:    Estimator of original sample
+        a:          Acceleration
+        qtl:        Quantile of boostrap sample to be calculated (0 to 1)
+
+        Output:
+        res:    Calculated quantile
+        
+        """
+        
+        import scipy.stats as sts
+
+        # Remove NaNs
+        dat = dat[~np.isnan(dat)]
+
+        # Check if BCa can be applied
+        if (np.min(dat) >= theta_h) or (np.max(dat) <= theta_h) or (np.isnan(a)):
+            # Switch to percentile method
+            res = np.quantile(dat,qtl)
+            print("BCa method could not be applied, using percentile method instead")
+            return res
+
+        # BCa method
+        sims = len(dat)
+        z_inv = np.sum((dat < theta_h)*1)/sims
+        z = sts.norm.ppf(z_inv)
+
+        if np.isinf(z):
+            return np.nan
+
+        bca_q = sts.norm.cdf(z + (z + sts.norm.ppf(qtl))/(1 - a * (z + sts.norm.ppf(qtl))))
+        
+        res = np.quantile(dat,bca_q)
+
+        return res
+
+
+    def calc_acc(df,qtl=[]):
+        """
+        Function to calculate the acceleration for BCa using a jackknife estimate with respect to the sensors
+        DiCiccio TJ, Efron B. Bootstrap confidence intervals. Stat Sci. 1996;11(3):189-228
+        Implementation is based on R package "bootstrap" (function bcanon)
+
+        Input:
+        df:         Dataframe with data, reduced to a certain glucose range
+        qtl:        List of quantiles for TIs  
+
+        Output:
+        a:      Numpy of acceleration for TI for provided quantiles
+        
+
+        """
+        
+        # Extract list of sensors
+        sens = df["SensorID"].unique()
+        sens.sort()
+        n = len(sens)
+
+        # Array with jackknife estimate
+        u = np.zeros((n,4))    
+        for i in range(n):
+            # Remove single sensor and re-estimate 
+            df_tmp = df[df["SensorID"] != sens[i]]
+            u[i,:] = (df_tmp["Diff"].quantile(qtl)).to_numpy()
+        
+        # Remove mean
+        uu = np.add(np.mean(u,axis=0),-u)
+        # Estimate acceleration
+        a = np.sum(uu**3,axis=0) / (6*(np.sum(uu**2,axis=0)**(3/2)))
+        
+        return a
+
+    
+    ## Bootstrapping
+    import time
+
+    if N<10000:
+        print("WARNING: Bootstrapping with less than 10 000 samples is not recommended")
+
+    RES = pd.DataFrame(columns=["Range","Median","DI1_Upper","DI1_Lower","DI1_Range","DI2_Upper","DI2_Lower","DI2_Range"])
+    
+    if seed:      # Seed is provided, if not reset
+        np.random.seed(seed)       # For reproducibility
+    else:
+        np.random.seed()
+    
+    # Interval Sizes according to FDA
+    Int_size1 = [0.85,0.7,0.8,0.87]
+    Int_size2 = [0.98,0.99,0.99,0.87]
+
+    # Loop over Ranges and calculate quantiles of intervals
+    # Rows: Ranges
+    # Columns: L1, U1, L2, U2
+    DI = np.zeros((4,4))
+    for r in range(4):
+        DI[r,:] = (df[df["Range"]==r+1]["Diff"].quantile([(1-Int_size1[r])/2,(1+Int_size1[r])/2,(1-Int_size2[r])/2,(1+Int_size2[r])/2])).to_numpy()
+
+    # Extract list of sensors
+    sens = df["SensorID"].unique()
+    sens.sort()
+    
+    # Empty Matrices containing bootstrap samples
+    # Rows: Ranges, Columns: Interval limits/AR15,AR20,AR40, Depth: bootstrap samples 
+    BS_TI = np.zeros((4,4,N))
+    
+    # Start time for timing
+    start = time.time()
+    print("Bootstrapping (N = "+str(N)+") ... ")
+    # Loop over number of bootstap sample
+    for i in range(N):
+        # Get clustered-bootstrap sample
+        df_bs = pd.DataFrame({'SensorID':np.random.choice(sens, size=len(sens),replace=True)}).merge(df,how='left')
+        
+        # Loop over Ranges and calculate quantiles of intervals
+        for r in range(4):
+            BS_TI[r,:,i] = (df_bs[df_bs["Range"]==r+1]["Diff"].quantile([(1-Int_size1[r])/2,(1+Int_size1[r])/2,(1-Int_size2[r])/2,(1+Int_size2[r])/2])).to_numpy()
+            
+        # Print status
+        percent = int(np.round((i+1)/N*100))
+        bar = '+' * percent + "-" * (100-percent)
+        print(f"\r|{bar}| {percent:.1f}%",end="\r")
+    
+    print()
+    
+    ## Collect Results
+    RES["Range"] = ["<70","70-180",">180","Total"]
+
+    # Median
+    RES["Median"] = (df.groupby("Range")["Diff"].median()).to_numpy()
+
+    # TI confidence intervals, AR lower confidence bound
+    # Loop over Ranges
+    for r in range(4):
+        # TIs
+        a = calc_acc(df[df["Range"]==r+1],qtl=[(1-Int_size1[r])/2,(1+Int_size1[r])/2,(1-Int_size2[r])/2,(1+Int_size2[r])/2])        
+        RES.at[r,"DI1_Lower"] = BCa(BS_TI[r,0,:],DI[r,0],a[0],(1-conf_level)/2)
+        RES.at[r,"DI1_Upper"] = BCa(BS_TI[r,1,:],DI[r,1],a[1],(1+conf_level)/2)
+        RES.at[r,"DI2_Lower"] = BCa(BS_TI[r,2,:],DI[r,2],a[2],(1-conf_level)/2)
+        RES.at[r,"DI2_Upper"] = BCa(BS_TI[r,3,:],DI[r,3],a[3],(1+conf_level)/2)
+        RES.at[r,"DI1_Range"] = RES.at[r,"DI1_Upper"] - RES.at[r,"DI1_Lower"]
+        RES.at[r,"DI2_Range"] = RES.at[r,"DI2_Upper"] - RES.at[r,"DI2_Lower"] 
+
+    # Delete results for Total range
+    RES.at[3,"DI2_Lower"] = "-"
+    RES.at[3,"DI2_Upper"] = "-"
+    RES.at[3,"DI2_Range"] = "-"
+
+    ## Sensor-to-sensor variability parameters
+    sens = df["SensorID"].unique()
+    ns = len(sens)
+
+    # Loop over Ranges
+    for r in range(4):
+        med = np.empty(ns)*np.nan   # Medians
+        r90 = np.empty(ns)*np.nan   # 90% ranges
+        # Loop over Sensors
+        for i,s in enumerate(sens):
+            # Get deviations of sensor in Range
+            dev = (df[(df["SensorID"]==s) & (df["Range"]==r+1)]["Diff"]).to_numpy()
+            if len(dev)>=3:         # Check if dev has 3 or more datapoints
+                med[i] = np.median(dev)
+                if len(dev)>=10:
+                    r90[i] = np.quantile(dev,0.95) - np.quantile(dev,0.05)
+                else:
+                    r90[i] = np.nan
+            else:
+                med[i] = np.nan
+                r90[i] = np.nan
+            
+        RES.at[r,"BSV_Min_Max"] = "[{:.2f} - {:.2f}]".format(np.nanmin(med),np.nanmax(med))
+        RES.at[r,"BSV_Range"] = np.nanmax(med) - np.nanmin(med)
+        RES.at[r,"WSV_90%Range"] = np.nanmedian(r90)
+        
+    
+    # Print Timing    
+    print("DONE","Processing Time: "+str(np.round(time.time()-start,2))+" seconds")
+
+    # Info
+    RES.at[1,"Info"] = "N_BS: "+str(N)+" Seed: "+str(seed)
+    RES.at[2,"Info"] = "Conf_Level: "+str(conf_level)
+    
+    return RES
+
+
+def CI_Clopper_Pearson(RES, df, alpha=0.05):
+
+    # Calculate the Clopper-Pearson interval
+    
+    print("Calculate Clopper-Pearson Intervals ...")
+
+    n_k = df.groupby("Range")[["WI15","WI20","WI40"]].sum().reset_index()
+    n_k["n"] = df.groupby("Range")["WI15"].count().to_numpy()
+
+    # Loop over ranges
+    for r in range(4):
+        if n_k.at[r,"WI15"] == 0:
+            RES.at[r,"CP_CI15"] = 0
+        else:
+            RES.at[r,"CP_CI15"] = sts.beta.ppf(alpha,n_k.at[r,"WI15"],
+                                    n_k.at[r,"n"]-n_k.at[r,"WI15"]+1)*100
+        if n_k.at[r,"WI20"] == 0:
+            RES.at[r,"CP_CI20"] = 0
+        else:
+            RES.at[r,"CP_CI20"] = sts.beta.ppf(alpha,n_k.at[r,"WI20"],
+                                    n_k.at[r,"n"]-n_k.at[r,"WI20"]+1)*100
+        if n_k.at[r,"WI40"] == 0:
+            RES.at[r,"CP_CI40"] = 0
+        else:
+            RES.at[r,"CP_CI40"] = sts.beta.ppf(alpha,n_k.at[r,"WI40"],
+                                    n_k.at[r,"n"]-n_k.at[r,"WI40"]+1)*100
+
+    return RES
+
+
+def CI_WilsonCC(RES, df, alpha=0.05):
+
+    # Calculate continuity corrected Wilson interval according to 
+    # Short et al. "A novel confidence interval for a single proportion in the presence of clustered binary outcome data"
+    # Statistical Methods in Medical Research 2020, Vol. 29(1) 111-121
+
+    print("Calculate Wilson Intervals ...")
+  
+    # Loop over Ranges
+    for r in range(4):
+        datr = df[df["Range"] == r+1]
+        # Loop over Limits
+        for WI in ["WI15","WI20","WI40"]:
+            
+            statr = datr.groupby("SensorID")[WI].agg(["sum","count"]).reset_index()
+            
+            m = statr["count"].to_numpy()
+            x = statr["sum"].to_numpy()            
+      
+            n = statr["SensorID"].nunique()
+            M1 = np.sum(m)
+            M2 = np.sum(m**2)
+            
+            # Estimated AR
+            pih = np.sum(x) / M1
+            
+            # Between cluster mean square
+            BMS = (np.sum(x**2/m) - np.sum(x)**2 / M1) / (n - 1)
+            
+            # Within cluster mean square
+            WMS = (np.sum(x) - np.sum(x**2/m)) / np.sum(m-1)
+            
+            # n*
+            n_star = (M1**2 - M2) / ((n-1)*M1)
+            
+            # ICC
+            if pih == 0 or pih == 1:
+                rhoh = 1
+            else:
+                if BMS-WMS < 0:
+                    rhoh = 0
+                    warnings.warn("ICC set to 0 due to negative correlation during Wilson interval calculation")
+                else:
+                    rhoh = (BMS - WMS) / (BMS + (n_star - 1) * WMS)           
+            
+            # VIF
+            xih = 1 + rhoh * (M2 - M1) / M1
+            
+            # WCC (lower one-sided confidence interval)
+            z_a = sts.norm.ppf(1-alpha)
+            WCC_CI = (2 * M1 * pih + xih * z_a**2 - 1 - np.sqrt(xih) * z_a * np.sqrt(xih * z_a**2 - 2 - 1 / M1 + 4 * pih * (M1 * (1 - pih) + 1))) / (2 * (M1 + xih * z_a**2))
+            
+            # Collect Results
+            RES.at[r,"WCC_CI"+WI[2:4]] = WCC_CI*100
+            RES.at[r,"WCC_ICC"+WI[2:4]] = rhoh
+            
+    return RES
+
+
+def CI_Bootstrapping(RES, df, alpha=0.05, N_BS=10000, seed=1):
+
+    def calc_acc(df):
+        """
+        Function to calculate the acceleration for BCa using a jackknife estimate with respect to the sensors
+        DiCiccio TJ, Efron B. Bootstrap confidence intervals. Stat Sci. 1996;11(3):189-228
+        Implementation is based on R package "bootstrap" (function bcanon)
+
+        Input:
+        df:         Dataframe with data, reduced to a certain glucose range
+        qtl:        List of quantiles for TIs  
+
+        Output:
+        a:      Numpy of acceleration for TI for provided quantiles
+        
+
+        """
+        
+        # Extract list of sensors
+        sens = df["SensorID"].unique()
+        sens.sort()
+        n = len(sens)
+
+        # Array with jackknife estimate
+        u = np.zeros((n,3))    
+        for i in range(n):
+            # Remove single sensor and re-estimate 
+            df_tmp = df[df["SensorID"] != sens[i]]
+            u[i,:] = (df_tmp[["WI15","WI20","WI40"]].mean() * 100).to_numpy()
+        
+        # Remove mean
+        uu = np.add(np.mean(u,axis=0),-u)
+        # Replace 0 with nan
+        uu[uu == 0] = np.nan
+        # Estimate acceleration
+        a = np.sum(uu**3,axis=0) / (6*(np.sum(uu**2,axis=0)**(3/2)))
+        
+        return a    
+        
+    def BCa(dat,theta_h,a,alpha=0.05):
+        """
+        Function to calculate bias-corrected and accelerated bootstrap quantiles according to 
+        DiCiccio TJ, Efron B. Bootstrap confidence intervals. Stat Sci. 1996;11(3):189-228
+        Implementation is based on R package "bootstrap" (function bcanon)
+        In case of failure of the BCa method, the percentile method is used
+
+        Input:
+        dat:        Numpy array of bootstrapped samples
+        theta_h:    Estimator of original sample
+        a:          Acceleration
+        alpha:      Quantile of boostrap sample to be calculated (0 to 1)
+
+        Output:
+        res:    Calculated quantile
+        
+        """
+
+        # BCa method
+        sims = len(dat)
+        z_inv = np.sum((dat < theta_h)*1)/sims
+        z = sts.norm.ppf(z_inv)
+
+        prctl_inv = sts.norm.cdf(z + (z + sts.norm.ppf(alpha))/(1 - a * (z + sts.norm.ppf(alpha))))
+        
+        res = np.quantile(dat,prctl_inv)
+
+        return res
+
+    import time
+
+    ## Bootstrapping
+    if seed:      # Seed is provided, if not reset
+        np.random.seed(seed)       # For reproducibility
+    else:
+        np.random.seed()
+    
+    # Extract list of sensors
+    sens = df["SensorID"].unique()
+    sens.sort()
+    
+    # Empty Matrices containing bootstrap samples
+    # Rows: Ranges, Columns: Interval limits/AR15,AR20,AR40, Depth: bootstrap samples 
+    BS_AR = np.zeros((4,3,N_BS))
+    
+    # Define empty DataFrame for ARs so that missing values result in NaN instead of missing rows
+    # This DataFrame has to have the same shape as what is intended to be converted to numpy
+    df_emptyAR = pd.DataFrame(0, index=[0,1,2,3], columns=["WI15","WI20","WI40"])
+    df_emptyAR["Range"] = [1,2,3,4]
+    df_emptyAR.set_index("Range",inplace=True)
+
+    # Start time for timing
+    start = time.time()
+    print("Bootstrapping (N = "+str(N_BS)+") ... ")
+    # Loop over number of bootstap sample
+    for i in range(N_BS):
+        # Get clustered-bootstrap sample
+        df_bs = pd.DataFrame({'SensorID':np.random.choice(sens, size=len(sens),replace=True)}).merge(df,how='left')
+        
+        # Agreement Rates
+        # DataFrames are added to account for the case that a Range has no data (entry is NaN)
+        BS_AR[:,:,i] = (df_emptyAR.add(df_bs.groupby("Range")[["WI15","WI20","WI40"]].mean()*100)).to_numpy()
+
+        # Print status
+        percent = int(np.round((i+1)/N_BS*100))
+        bar = '+' * percent + "-" * (100-percent)
+        print(f"\r|{bar}| {percent:.1f}%",end="\r")
+    
+    print()
+
+    ## Collect Results
+    # AR lower confidence bound
+    # Loop over ranges
+    for r in range(4):
+        # ARs
+        a = calc_acc(df[df["Range"]==r+1])
+        # +/- 15
+        if (RES.at[r,"AR15"] == 0) | (RES.at[r,"AR15"] == 100):
+            RES.at[r,"BCa_CI15"] = RES.at[r,"CP_CI15"]
+        else:
+            RES.at[r,"BCa_CI15"] = BCa(BS_AR[r,0,:],RES.at[r,"AR15"],a[0],alpha=alpha)
+        # +/- 20
+        if (RES.at[r,"AR20"] == 0) | (RES.at[r,"AR20"] == 100):
+            RES.at[r,"BCa_CI20"] = RES.at[r,"CP_CI20"]
+        else:    
+            RES.at[r,"BCa_CI20"] = BCa(BS_AR[r,1,:],RES.at[r,"AR20"],a[1],alpha=alpha)
+        # +/- 40
+        if (RES.at[r,"AR40"] == 0) | (RES.at[r,"AR40"] == 100):
+            RES.at[r,"BCa_CI40"] = RES.at[r,"CP_CI40"]
+        else:
+            RES.at[r,"BCa_CI40"] = BCa(BS_AR[r,2,:],RES.at[r,"AR40"],a[2],alpha=alpha)
+
+    # Print Timing    
+    print("Processing Time: "+str(np.round(time.time()-start,2))+" seconds")
+
+    # Provide Info
+    RES.at[0,"Info"] = "Seed: "+str(seed)
+    RES.at[1,"Info"] = "N_BS: "+str(N_BS)
+    RES.at[2,"Info"] = "Conf_Level: "+str(alpha)
+
+    return RES
+
+
+# Define the parameters of the DGR plot
+BGLow, BGHigh = 70, 300                     # Lower and upper BG limits
+AlertLowBG, AlertHighBG = 80, 200           # Lower and upper BG limts for alert regions
+AlertLowROC, AlertHighROC = -1, 1.5         # Lower and upper ROC limts for alert regions
+pred_h = 30                                 # Prediction horizon for alert regions
+ROC_lim = [-5,5]                            # Limits of ROC axis
+BG_lim = [0,400]                            # Limits of BG axis
+req = 7.5                                   # Minimum requirement for percentages in critical regions
+pad = 0.2                                   # Padding between regions and bar plot (in units mg/dL/min)
+bspace = 3.5                                # width of bar plot (in units mg/dl/min)
+
+
+def region_cnt(df):
+    """
+    Count the number of RoC-BG pairs in each DGR plot region
+
+    Input:
+    df:     Dataframe with columns "BG" and "ROC"
+
+    Output:
+    cnt:    Array with number of pairs in each DGR region
+            [BG low, BG high, Alert low, Alert high, Neutral, Total]
+
+    Version History:
+
+    """
+
+    cnt = [0]*6
+    n = df["BG"].count()
+
+    # Predicted BG 30 min into the future
+    df["BGP"] = df["BG"] + df["ROC"]*pred_h
+
+    # BG low
+    cnt[0] = (((df["BG"] < BGLow))*1).sum()
+    # BG high
+    cnt[1] = (((df["BG"] > BGHigh))*1).sum()
+    # Alert low
+    cnt[2] = (((df["BG"] >= BGLow) & (df["BGP"] < AlertLowBG) & (df["ROC"] < AlertLowROC))*1).sum()
+    # Alert high
+    cnt[3] = (((df["BG"] <= BGHigh) & (df["BGP"] > AlertHighBG) & (df["ROC"] > AlertHighROC))*1).sum()
+    # Stable
+    cnt[4] = (((df["BG"] <= 180) & (df["BG"] >= 70) & (df["ROC"] >= -1) & (df["ROC"] <= 1))*1).sum()
+    # Total
+    cnt[5] = n
+
+    return np.array(cnt)
+
+
+def zone_count(CMcnt,ncats):
+    """
+    Count the number of pairs in each zone
+
+    Input:
+    CMcnt:              Confusion matrix containing counts
+    ncats:              Number of CGM RoC categories
+
+    Output:
+    Acnt:               Number of pairs in zone A
+    Bcnt:               Number of pairs in zone B
+    Ccnt:               Number of pairs in zone C
+    Dcnt:               Number of pairs in zone D
+    n:                  Total number of pairs
+
+    Created:                ME 11.Dec 2023
+    Checked/Versioned:      SP 11.Jan 2024
+
+    Version History:
+
+    """
+    # The code sums of the respective cells for every zone row by row
+
+    if ncats == 7:
+        Acnt = 0
+        for i,cols in enumerate([[0,1],[0,1,2],[1,2],[3],[4,5],[4,5,6],[5,6]]):
+            Acnt = Acnt + CMcnt[i,cols].sum()
+        Bcnt = 0
+        for i,cols in enumerate([[2],[],[0,3],[2,4],[3,6],[],[4]]):
+            Bcnt = Bcnt + CMcnt[i,cols].sum()
+        Ccnt = 0
+        for i,cols in enumerate([[3],[3],[4],[1,5,6],[2],[3],[3]]):
+            Ccnt = Ccnt + CMcnt[i,cols].sum()
+        Dcnt = 0
+        for i,cols in enumerate([[4,5,6],[4,5,6],[5,6],[0],[0,1],[0,1,2],[0,1,2]]):
+            Dcnt = Dcnt + CMcnt[i,cols].sum()
+        n = np.sum(CMcnt)
+
+    if ncats == 5:
+        Acnt = 0
+        for i,cols in enumerate([[0,1,2],[1,2],[3],[4,5],[4,5,6]]):
+            Acnt = Acnt + CMcnt[i,cols].sum()
+        Bcnt = 0
+        for i,cols in enumerate([[],[0,3],[2,4],[3,6],[]]):
+            Bcnt = Bcnt + CMcnt[i,cols].sum()
+        Ccnt = 0
+        for i,cols in enumerate([[3],[4],[1,5,6],[2],[3]]):
+            Ccnt = Ccnt + CMcnt[i,cols].sum()
+        Dcnt = 0
+        for i,cols in enumerate([[4,5,6],[5,6],[0],[0,1],[0,1,2]]):
+            Dcnt = Dcnt + CMcnt[i,cols].sum()
+        n = np.sum(CMcnt)
+
+    return Acnt, Bcnt, Ccnt, Dcnt, n
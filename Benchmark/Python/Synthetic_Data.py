@@ -0,0 +1,146 @@
+"""
+Generator of synthetic CGM performance study data
+
+Creates reproducible datasets with a configurable number of sensors, number of datapoints per sensor,
+glucose distribution, CGM bias and within-sensor correlation of the CGM deviations for benchmarking
+the CGM performance assessment tools
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+
+
+def AR1(n_rows, n_cols, phi, rng):
+    """
+    Stationary first-order autoregressive processes with unit variance
+
+    Input:
+    n_rows:     Number of independent processes (e.g. sensors)
+    n_cols:     Length of processes
+    phi:        Lag-1 autocorrelation (0 to <1)
+    rng:        numpy random Generator
+
+    Output:
+    z:          Numpy array (n_rows x n_cols)
+
+    """
+
+    eps = rng.standard_normal((n_rows,n_cols))
+    z0 = rng.standard_normal((n_rows,1))
+    z, _ = lfilter([np.sqrt(1-phi**2)], [1,-phi], eps, axis=1, zi=phi*z0)
+
+    return z
+
+
+def ROC_category(roc):
+    """
+    Categorize rates of change (mg/dL/min) into -3 (<-3), -2 (-3 to <-2), -1 (-2 to <-1), 0 (-1 to +1),
+    1 (>+1 to +2), 2 (>+2 to +3) and 3 (>+3)
+
+    """
+
+    cat = np.digitize(roc,[-3,-2,-1]) - 3 + np.digitize(roc,[1,2,3],right=True)
+    return np.where(np.isnan(roc), np.nan, cat)
+
+
+def synthetic_study(n_sensors=24, n_points=150, interval=15,
+                    glucose_mean=150, glucose_sd=60, glucose_corr=0.97,
+                    bias=0, sensor_sd=5, noise_sd=8, noise_corr=0.7,
+                    comp_sd=2, sensors_per_patient=1, seed=1):
+    """
+    Create a synthetic CGM performance study
+
+    The true glucose of each sensor is a log-normally distributed autoregressive process sampled every
+    interval minutes. Comparator measurements scatter around the true glucose with a relative standard
+    deviation of comp_sd. CGM deviations consist of a systematic bias, a sensor-specific offset and an
+    autoregressive (within-sensor correlated) error. Sensors worn by the same patient share the true glucose
+
+    Input:
+    n_sensors:      Number of sensors
+    n_points:       Number of paired datapoints per sensor
+    interval:       Time between datapoints in minutes
+    glucose_mean:   Mean of true glucose in mg/dL
+    glucose_sd:     Standard deviation of true glucose in mg/dL
+    glucose_corr:   Lag-1 autocorrelation of true glucose
+    bias:           Systematic relative CGM bias in %
+    sensor_sd:      Standard deviation of sensor-specific relative offsets in %
+    noise_sd:       Standard deviation of relative CGM error in %
+    noise_corr:     Lag-1 autocorrelation of CGM error (within-sensor correlation)
+    comp_sd:        Relative standard deviation of comparator measurements in %
+    sensors_per_patient: Number of sensors worn at the same time by each patient
+    seed:           Seed for random number generator
+
+    Output:
+    df:             Pandas dataframe with columns "SensorID", "PatientID", "Time" (min), "Comp", "CGM", "BG", "ROC",
+                    "Comp_ROC", "Comp_ROC_Cat", "CGM_ROC" and "CGM_ROC_Cat"
+
+    """
+
+    rng = np.random.default_rng(seed)
+    patient = np.arange(n_sensors)//sensors_per_patient
+
+    # True glucose of each patient (log-normal with given mean and standard deviation)
+    s2 = np.log(1 + (glucose_sd/glucose_mean)**2)
+    mu = np.log(glucose_mean) - s2/2
+    glc = np.exp(mu + np.sqrt(s2)*AR1(patient[-1]+1,n_points,glucose_corr,rng))
+    glc = np.clip(glc,20,500)[patient,:]
+
+    # Comparator
+    comp = glc * (1 + comp_sd/100*rng.standard_normal((n_sensors,n_points)))
+
+    # CGM
+    offset = sensor_sd*rng.standard_normal((n_sensors,1))
+    err = noise_sd*AR1(n_sensors,n_points,noise_corr,rng)
+    cgm = np.clip(glc * (1 + (bias + offset + err)/100),40,400)
+
+    # Rates of change (mg/dL/min), not defined for first datapoint of each sensor
+    comp_roc = np.full((n_sensors,n_points),np.nan)
+    comp_roc[:,1:] = np.diff(comp,axis=1)/interval
+    cgm_roc = np.full((n_sensors,n_points),np.nan)
+    cgm_roc[:,1:] = np.diff(cgm,axis=1)/interval
+
+    df = pd.DataFrame({"SensorID": np.repeat(["S"+str(i+1) for i in range(n_sensors)],n_points),
+                       "PatientID": np.repeat(["P"+str(p+1) for p in patient],n_points),
+                       "Time": np.tile(np.arange(n_points)*interval,n_sensors),
+                       "Comp": comp.ravel(),
+                       "CGM": cgm.ravel()})
+    df["BG"] = df["Comp"]
+    df["ROC"] = comp_roc.ravel()
+    df["Comp_ROC"] = df["ROC"]
+    df["Comp_ROC_Cat"] = ROC_category(df["Comp_ROC"].to_numpy())
+    df["CGM_ROC"] = cgm_roc.ravel()
+    df["CGM_ROC_Cat"] = ROC_category(df["CGM_ROC"].to_numpy())
+
+    return df
+
+
+def tool_data(df, tool):
+    """
+    Extract the input data of a tool from a synthetic study
+
+    Input:
+    df:         Pandas dataframe created by synthetic_study
+    tool:       "CG_DIVA", "CI_calculation", "DGR_plot" or "CTCA"
+
+    Output:
+    df:         Pandas dataframe with the columns required by the tool
+
+    """
+
+    if tool in ["CG_DIVA","CI_calculation"]:
+        return df[["SensorID","PatientID","Comp","CGM"]].copy()
+    elif tool == "DGR_plot":
+        return df[["BG","ROC"]].dropna().reset_index(drop=True)
+    elif tool == "CTCA":
+        return df[["BG","CGM","Comp_ROC","Comp_ROC_Cat","CGM_ROC_Cat"]].dropna().reset_index(drop=True)
+    else:
+        raise ValueError("Unknown tool "+str(tool))
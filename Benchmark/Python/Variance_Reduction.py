@@ -0,0 +1,124 @@
+"""
+Monte-Carlo precision of the bootstrap confidence limits of CG_DIVA and CI_calculation for different
+resampling schemes (independent, balanced and antithetic resampling)
+
+The bootstrapping is repeated with different seeds on the same synthetic study. The standard deviation
+of the confidence limits over the repetitions is the Monte-Carlo standard error (MCSE). The efficiency
+of a scheme is the ratio of the mean variances (iid / scheme), i.e. the factor by which the number of
+bootstrap samples can be reduced for the same precision
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import sys
+import io
+import time
+import argparse
+import contextlib
+import warnings
+import numpy as np
+import pandas as pd
+
+# Make tools importable
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for folder in ["CG-DIVA","Confidence Intervals"]:
+    sys.path.append(os.path.join(root,folder,"Python"))
+
+import CG_DIVA
+import CI_calculation as CI_calc
+from Synthetic_Data import synthetic_study, tool_data
+
+SCHEMES = ["iid","balanced","antithetic"]
+
+
+def limits(tool, df, N_BS, seed, scheme):
+    """
+    Bootstrapped confidence limits of a tool (BCa_CI of CI_calculation, DI_CI of CG_DIVA) as flat array
+
+    """
+
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if tool == "CI_calculation":
+            return CI_calc.CI_compute(df.copy(),N_BS=N_BS,seed=seed,scheme=scheme).BCa_CI.ravel()
+        return CG_DIVA.CG_DIVA_compute(df.copy(),N_BS=N_BS,seed=seed,scheme=scheme).DI_CI.ravel()
+
+
+def variance_reduction(n_sensors=48, n_points=150, N_BS=[500,1000,2000], schemes=SCHEMES,
+                        tools=["CI_calculation","CG_DIVA"], repeats=20, seed=1,
+                        save_path=None, filename="Variance_Reduction", **study_args):
+    """
+    Monte-Carlo standard errors of the bootstrapped confidence limits for different resampling schemes
+
+    Inputs:
+    n_sensors:      Number of sensors of the synthetic study
+    n_points:       Number of datapoints per sensor
+    N_BS:           List of numbers of bootstrap samples
+    schemes:        List of resampling schemes ("iid", "balanced", "antithetic")
+    tools:          List of tools ("CI_calculation", "CG_DIVA")
+    repeats:        Number of repetitions with different seeds
+    seed:           Seed for data generation, the bootstrap seeds are seed+1 ... seed+repeats
+    save_path:      Path for saving the csv results file, None if results shall not be saved
+    filename:       Filename of results file
+    study_args:     Further parameters passed to synthetic_study
+
+    Output:
+    RES:            Pandas dataframe with columns "Tool", "Scheme", "N_BS", "MCSE" (mean MCSE of all
+                    confidence limits), "MCSE_Max", "Efficiency" (ratio of mean variances iid/scheme
+                    for the same N_BS) and "Time" (mean processing time per repetition)
+
+    """
+
+    study = synthetic_study(n_sensors=n_sensors,n_points=n_points,seed=seed,**study_args)
+
+    rows = []
+    for tool in tools:
+        df = tool_data(study,tool)
+        var = {}
+        for N in N_BS:
+            for scheme in schemes:
+                start = time.perf_counter()
+                X = np.array([limits(tool,df,N,seed+1+k,scheme) for k in range(repeats)])
+                dt = (time.perf_counter() - start) / repeats
+                var[scheme,N] = np.nanvar(X,axis=0,ddof=1)
+                mcse = np.sqrt(var[scheme,N])
+                rows.append({"Tool": tool, "Scheme": scheme, "N_BS": N,
+                             "MCSE": np.nanmean(mcse), "MCSE_Max": np.nanmax(mcse), "Time": dt})
+                print(tool,scheme,"N_BS:",N,"MCSE: {:.4f}".format(rows[-1]["MCSE"]))
+        # Efficiency relative to independent resampling
+        for row in rows:
+            if row["Tool"] == tool and ("iid",row["N_BS"]) in var:
+                row["Efficiency"] = np.nanmean(var["iid",row["N_BS"]]) / np.nanmean(var[row["Scheme"],row["N_BS"]])
+
+    RES = pd.DataFrame(rows)
+
+    if save_path is not None:
+        RES.to_csv(os.path.join(save_path,filename+".csv"),index=None)
+
+    return RES
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte-Carlo precision of bootstrap resampling schemes")
+    parser.add_argument("--sensors",type=int,default=48,help="Number of sensors")
+    parser.add_argument("--points",type=int,default=150,help="Number of datapoints per sensor")
+    parser.add_argument("--N_BS",type=int,nargs="+",default=[500,1000,2000],help="Numbers of bootstrap samples")
+    parser.add_argument("--schemes",nargs="+",default=SCHEMES,choices=SCHEMES)
+    parser.add_argument("--tools",nargs="+",default=["CI_calculation","CG_DIVA"],choices=["CI_calculation","CG_DIVA"])
+    parser.add_argument("--repeats",type=int,default=20)
+    parser.add_argument("--seed",type=int,default=1)
+    parser.add_argument("--save_path",default=".")
+    parser.add_argument("--filename",default="Variance_Reduction")
+    args = parser.parse_args()
+
+    RES = variance_reduction(n_sensors=args.sensors,n_points=args.points,N_BS=args.N_BS,schemes=args.schemes,
+                             tools=args.tools,repeats=args.repeats,seed=args.seed,
+                             save_path=args.save_path,filename=args.filename)
+    print(RES.to_string(index=False))
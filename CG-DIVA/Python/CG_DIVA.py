@@ -13,56 +13,395 @@ This is a free software and comes with ABSOLUTELY NO WARRANTY
 import numpy as np
 import pandas as pd
 import os
-import matplotlib.pyplot as plt
+import sys
+import time
+import json
+import copy
+from dataclasses import dataclass, field
 
-def boostrapping(df,N,seed,conf_level=0.95):
+# Helpers shared by all tools (folder Common of the repository)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),"Common","Python"))
+from CGM_common import LazyImport, JIT, set_backend, Metrics
+from CGM_resampling import (cluster_index, random_integers, cluster_counts, cluster_samples, random_state,
+                            shard_seed, data_hash, merge_shards, influence_table, stream_summary, histogram,
+                            stream_quantiles)
 
-    def BCa(dat,theta_h,a,qtl):
-        """
-        Function to calculate bias-corrected and accelerated bootstrap quantiles according to 
-        DiCiccio TJ, Efron B. Bootstrap confidence intervals. Stat Sci. 1996;11(3):189-228
-        Implementation is based on R package "bootstrap" (function bcanon)
-        In case of failure of the BCa method, the percentile method is used
+# Heavy packages are loaded on first use
+sts = LazyImport("scipy.stats")
+plt = LazyImport("matplotlib.pyplot")
+patches = LazyImport("matplotlib.patches")
 
-        Input:
-        dat:        Numpy array of bootstrapped samples
-        theta_h:    Estimator of original sample
-        a:          Acceleration
-        qtl:        Quantile of boostrap sample to be calculated (0 to 1)
 
-        Output:
-        res:    Calculated quantile
-        
-        """
-        
-        import scipy.stats as sts
+# Interval Sizes according to FDA
+Int_size1 = [0.85,0.7,0.8,0.87]
+Int_size2 = [0.98,0.99,0.99,0.87]
+
+
+def weighted_quantile(v,lab,C,q):
+    """
+    Quantiles of resampled data from the counts of the clusters without creating the resampled data
+    Results are identical to pandas/numpy quantiles (linear interpolation) of the resampled data
+
+    Input:
+    v:          Numpy array of sorted values (without NaN)
+    lab:        Numpy array with the cluster index of each value
+    C:          Numpy array (N x n_clusters) of counts of each cluster in N bootstrap samples
+    q:          List of quantiles (0 to 1)
+
+    Output:
+    res:        Numpy array (N x len(q)) of quantiles
+
+    """
+
+    N = C.shape[0]
+    if len(v) == 0:
+        return np.full((N,len(q)),np.nan)
+    qp = np.true_divide(np.asarray(q)*100,100)
+    if JIT.active() and C.dtype.kind in "biu":
+        res = wq_kernel(v,np.asarray(lab,dtype=np.int64),C,np.asarray(qp,dtype=float))
+        if res is not None:     # None if the kernel failed, NumPy implementation below
+            return res
+
+    # Cumulative number of datapoints up to each sorted value in each bootstrap sample
+    cum = np.cumsum(C[:,lab],axis=1)
+    n = cum[:,-1]
+    off = (np.arange(N)*(n.max()+1))[:,None]
+
+    # Virtual index as in numpy (quantiles are passed in % by pandas)
+    vi = (n[:,None]-1)*qp[None,:]
+    prev = np.floor(vi)
+    gamma = vi - prev
+    prev = np.minimum(prev,n[:,None]-1).astype(np.int64)
+    nxt = np.minimum(prev+1,n[:,None]-1)
+
+    # Value at position k of each sorted bootstrap sample
+    pos = lambda k: np.minimum(np.searchsorted((cum+off).ravel(),(k+off).ravel(),side="right").reshape(k.shape) - len(v)*np.arange(N)[:,None],len(v)-1)
+    a = v[pos(np.maximum(prev,0))]
+    b = v[pos(np.maximum(nxt,0))]
+
+    # Linear interpolation as in numpy
+    diff = b - a
+    res = np.where(gamma >= 0.5, b - diff*(1-gamma), a + diff*gamma)
+    res[n == 0,:] = np.nan
+
+    return res
+
+
+@JIT
+def wq_kernel(v,lab,C,qp):
+    """
+    Loop implementation of weighted_quantile (one pass over the sorted values per bootstrap sample,
+    without the cumulative counts of all bootstrap samples)
+
+    """
+
+    N, m = C.shape[0], len(v)
+    res = np.empty((N,len(qp)))
+    cum = np.empty(m,dtype=np.int64)
+    val = np.empty(2)
+    for i in range(N):
+        n = 0
+        for j in range(m):
+            n += np.int64(C[i,lab[j]])
+            cum[j] = n
+        if n == 0:
+            res[i,:] = np.nan
+            continue
+        for k in range(len(qp)):
+            vi = (n-1)*qp[k]
+            prev = np.floor(vi)
+            gamma = vi - prev
+            for l in range(2):
+                # First sorted value with more than pos datapoints up to it
+                pos = min(int(prev)+l,n-1)
+                lo, hi = 0, m
+                while lo < hi:
+                    mid = (lo+hi)//2
+                    if cum[mid] <= pos:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                val[l] = v[min(lo,m-1)]
+            diff = val[1] - val[0]
+            res[i,k] = val[1] - diff*(1-gamma) if gamma >= 0.5 else val[0] + diff*gamma
+
+    return res
+
+
+def interval_sizes(int_sizes=None):
+    """
+    Interval sizes (0 to 1) of each range as numpy array (4xK)
+
+    Input:
+    int_sizes:  Interval sizes, single size or list (same for all ranges) or array (4xK) with the sizes of
+                each range (default: FDA interval sizes Int_size1, Int_size2)
+
+    """
+
+    if int_sizes is None:
+        return np.array([Int_size1,Int_size2]).T
+    sizes = np.atleast_1d(np.asarray(int_sizes,dtype=float))
+    if sizes.ndim > 2 or (sizes.ndim == 2 and sizes.shape[0] not in [1,4]) or sizes.shape[-1] == 0:
+        raise ValueError("int_sizes must be a number, a list or an array with 4 rows (one per range)")
+    if ((sizes <= 0) | (sizes >= 1)).any():
+        raise ValueError("Interval sizes must be between 0 and 1")
+    return np.broadcast_to(sizes,(4,sizes.shape[-1]))
+
+
+def interval_quantiles(int_sizes=None):
+    """
+    Quantiles of the lower and upper limits of deviation intervals in each range
+
+    Input:
+    int_sizes:  Interval sizes, see interval_sizes
+
+    Output:
+    qtl:        List of quantile lists of each range [lower 1, upper 1, lower 2, upper 2, ...]
+
+    """
+
+    sizes = interval_sizes(int_sizes)
+    return [[q for s in sizes[r] for q in [(1-s)/2,(1+s)/2]] for r in range(4)]
 
-        # Remove NaNs
+
+def bootstrap_TI(df,N,metrics=None,two_stage=False,batch=None,int_sizes=None,scheme="iid",rng=None):
+    """
+    Clustered bootstrap (with respect to the sensors) of the deviation interval limits
+    Random numbers are drawn from rng (global numpy random state seeded by the caller if None)
+    The bootstrap samples are represented by the number of times each sensor is drawn
+
+    Input:
+    df:         Processed dataframe (see data_processing) or list of processed dataframes of several devices
+                with the same rows (paired comparison), all devices are evaluated on the same bootstrap samples
+    N:          Number of bootstrap samples
+    metrics:    Metrics object (optional)
+    two_stage:  True/False whether patients (column "PatientID") and then sensors within patients are resampled
+    batch:      Number of bootstrap samples processed at once (default: depending on size of data)
+    int_sizes:  Interval sizes, see interval_quantiles (default: FDA interval sizes)
+    scheme:     Resampling scheme ("iid", "balanced" or "antithetic", see cluster_samples),
+                sensors are ranked by their mean relative deviation for antithetic resampling
+    rng:        Numpy random Generator or RandomState (optional)
+
+    Output:
+    BS_TI:      Numpy array (4x4xN) of bootstrap samples
+                Rows: Ranges, Columns: DI1 lower, DI1 upper, DI2 lower, DI2 upper, Depth: bootstrap samples
+                For a list of dataframes: Numpy array (n_devices x 4x4xN)
+                For K interval sizes: 2K columns (lower and upper limit of each interval)
+
+    """
+
+    metrics = Metrics() if metrics is None else metrics
+    dfs = [df] if isinstance(df,pd.DataFrame) else list(df)
+    qtl = interval_quantiles(int_sizes)
+
+    # Empty Matrices containing bootstrap samples
+    # Devices, Rows: Ranges, Columns: Interval limits, Depth: bootstrap samples 
+    BS_TI = np.zeros((len(dfs),4,len(qtl[0]),N))
+    
+    print("Bootstrapping (N = "+str(N)+") ... ")
+    with metrics.span("bootstrap"):
+        # Loop over batches of clustered-bootstrap samples
+        for i, BS in bootstrap_TI_batches(dfs,N,two_stage=two_stage,batch=batch,int_sizes=int_sizes,scheme=scheme,rng=rng):
+            BS_TI[:,:,:,i:i+BS.shape[3]] = BS
+            
+            # Print status
+            percent = int(np.round((i+BS.shape[3])/N*100))
+            bar = '+' * percent + "-" * (100-percent)
+            print(f"\r|{bar}| {percent:.1f}%",end="\r")
+    
+    print()
+
+    return BS_TI[0] if isinstance(df,pd.DataFrame) else BS_TI
+
+
+def bootstrap_TI_batches(df,N,two_stage=False,batch=None,int_sizes=None,scheme="iid",rng=None):
+    """
+    Batches of clustered bootstrap samples of the deviation interval limits (see bootstrap_TI)
+    The same random numbers give the same batches, e.g. for several passes over the bootstrap samples
+    with a copy of the random state (see BCa_stream)
+
+    Input:
+    df:         Processed dataframe or list of processed dataframes of several devices (see bootstrap_TI)
+    N, two_stage, batch, int_sizes, scheme, rng:   See bootstrap_TI
+
+    Output:
+    Generator of (index of first sample of the batch, numpy array (n_devices x 4x4 x batch size))
+
+    """
+
+    dfs = [df] if isinstance(df,pd.DataFrame) else list(df)
+    qtl = interval_quantiles(int_sizes)
+
+    # Sensor of each datapoint, sorted deviations of each range (of each device)
+    code, n_sens, groups = cluster_index(dfs[0],two_stage=two_stage)
+    dat = []
+    for d in dfs:
+        ranges = d["Range"].to_numpy()
+        diff = d["Diff"].to_numpy(dtype=float)
+        for r in range(4):
+            sel = (ranges == r+1) & ~np.isnan(diff)
+            order = np.argsort(diff[sel],kind="stable")
+            dat.append((diff[sel][order],code[sel][order]))
+    batch = max(1,min(N,2**22//max(len(diff)*len(dfs),1))) if batch is None else batch
+    score = None
+    if scheme == "antithetic":
+        sel = (dfs[0]["Range"] == 4).to_numpy()
+        score = np.bincount(code[sel],weights=dfs[0]["Diff"].to_numpy(dtype=float)[sel],minlength=n_sens) / np.maximum(np.bincount(code[sel],minlength=n_sens),1)
+
+    for i, C in cluster_samples(N,n_sens,groups,batch=batch,scheme=scheme,score=score,rng=rng):
+        # Loop over devices and Ranges and calculate quantiles of intervals
+        BS = np.empty((len(dfs),4,len(qtl[0]),C.shape[0]))
+        for k in range(len(dfs)):
+            for r in range(4):
+                BS[k,r,:,:] = weighted_quantile(*dat[4*k+r],C,qtl[r]).T
+        yield i, BS
+
+
+def BCa(dat,theta_h,a,qtl):
+    """
+    Function to calculate bias-corrected and accelerated bootstrap quantiles according to 
+    DiCiccio TJ, Efron B. Bootstrap confidence intervals. Stat Sci. 1996;11(3):189-228
+    Implementation is based on R package "bootstrap" (function bcanon)
+    In case of failure of the BCa method, the percentile method is used
+
+    Input:
+    dat:        Numpy array of bootstrapped samples
+    theta_h:    Estimator of original sample
+    a:          Acceleration
+    qtl:        Quantile of boostrap sample to be calculated (0 to 1)
+
+    Output:
+    res:    Calculated quantile
+    
+    """
+
+    # Remove NaNs
+    res = bca_kernel(np.asarray(dat,dtype=float),theta_h) if JIT.active() else None
+    if res is not None:
+        dat, lo, hi, below = res
+    else:
         dat = dat[~np.isnan(dat)]
+        lo, hi = np.min(dat), np.max(dat)
+        below = np.sum((dat < theta_h)*1)
+
+    # Check if BCa can be applied
+    if (lo >= theta_h) or (hi <= theta_h) or (np.isnan(a)):
+        # Switch to percentile method
+        res = np.quantile(dat,qtl)
+        print("BCa method could not be applied, using percentile method instead")
+        return res
+
+    # BCa method
+    sims = len(dat)
+    z_inv = below/sims
+    z = sts.norm.ppf(z_inv)
+
+    if np.isinf(z):
+        return np.NaN
+
+    bca_q = sts.norm.cdf(z + (z + sts.norm.ppf(qtl))/(1 - a * (z + sts.norm.ppf(qtl))))
+    
+    res = np.quantile(dat,bca_q)
+
+    return res
+
+
+@JIT
+def bca_kernel(dat,theta_h):
+    """
+    Loop implementation of the preparation of BCa (one pass): bootstrap samples without NaN,
+    minimum, maximum and number of samples below theta_h
+
+    """
+
+    res = np.empty(len(dat))
+    m, below = 0, 0
+    lo, hi = np.inf, -np.inf
+    for x in dat:
+        if np.isnan(x):
+            continue
+        res[m] = x
+        m += 1
+        lo = min(lo,x)
+        hi = max(hi,x)
+        below += x < theta_h
+
+    return res[:m], lo, hi, below
+
 
+def BCa_stream(replay,theta_h,a,qtl,bins=1024,cap=2**16):
+    """
+    BCa quantiles (see BCa) of each row of bootstrap samples that are generated in batches, without keeping
+    the bootstrap samples. The memory does not depend on the number of bootstrap samples and the results
+    are identical to BCa of the complete rows (exact selection in several passes, see stream_quantiles)
+
+    Input:
+    replay:     Function returning a new generator of the same batches of bootstrap samples (see stream_summary)
+    theta_h:    Numpy array (M) of estimators of the original sample
+    a:          Numpy array (M) of accelerations
+    qtl:        Numpy array (M) of quantiles to be calculated (0 to 1)
+    bins, cap:  See stream_quantiles
+
+    Output:
+    res:        Numpy array (M) of calculated quantiles
+
+    """
+
+    summ = stream_summary(replay,theta_h,bins=bins)
+    q = np.full(len(theta_h),np.nan)
+    for m in range(len(theta_h)):
         # Check if BCa can be applied
-        if (np.min(dat) >= theta_h) or (np.max(dat) <= theta_h) or (np.isnan(a)):
+        if (summ["lo"][m] >= theta_h[m]) or (summ["hi"][m] <= theta_h[m]) or (np.isnan(a[m])):
             # Switch to percentile method
-            res = np.quantile(dat,qtl)
+            q[m] = qtl[m]
             print("BCa method could not be applied, using percentile method instead")
-            return res
+            continue
+        z = sts.norm.ppf(summ["below"][m]/summ["n"][m])
+        if not(np.isinf(z)):
+            q[m] = sts.norm.cdf(z + (z + sts.norm.ppf(qtl[m]))/(1 - a[m] * (z + sts.norm.ppf(qtl[m]))))
 
-        # BCa method
-        sims = len(dat)
-        z_inv = np.sum((dat < theta_h)*1)/sims
-        z = sts.norm.ppf(z_inv)
+    return stream_quantiles(replay,summ,q,bins=bins,cap=cap)
 
-        if np.isinf(z):
-            return np.NaN
 
-        bca_q = sts.norm.cdf(z + (z + sts.norm.ppf(qtl))/(1 - a * (z + sts.norm.ppf(qtl))))
-        
-        res = np.quantile(dat,bca_q)
+def jackknife_TI(df,qtl,col="SensorID",batch=None):
+    """
+    Jackknife estimates of quantiles of the deviations, leaving out one sensor (or patient) at a time
+    The quantiles are calculated with weighted_quantile (identical to pandas quantiles of the reduced data)
 
-        return res
+    Input:
+    df:         Processed dataframe, reduced to a certain glucose range
+    qtl:        List of quantiles (0 to 1)
+    col:        Column of the clusters left out ("SensorID" or "PatientID")
+    batch:      Number of clusters processed at once (default: depending on size of data)
 
+    Output:
+    u:          Numpy array (n_clusters x len(qtl)) of jackknife estimates (clusters in sorted order)
 
-    def calc_acc(df,qtl=[]):
+    """
+
+    clus = df[col].unique()
+    clus.sort()
+    n = len(clus)
+    lab = pd.Categorical(df[col],categories=clus).codes.astype(np.int64)
+    diff = df["Diff"].to_numpy(dtype=float)
+    sel = ~np.isnan(diff)
+    order = np.argsort(diff[sel],kind="stable")
+    v, lab = diff[sel][order], lab[sel][order]
+    batch = max(1,min(n,2**22//max(len(v),1))) if batch is None else batch
+
+    u = np.zeros((n,len(qtl)))
+    for i in range(0,n,batch):
+        C = np.ones((min(batch,n-i),n),dtype=np.int64)
+        C[np.arange(C.shape[0]),i+np.arange(C.shape[0])] = 0
+        u[i:i+C.shape[0],:] = weighted_quantile(v,lab,C,qtl)
+
+    return u
+
+
+def boostrapping(df,N,seed,conf_level=0.95,metrics=None,full_output=False,BS_TI=None,two_stage=False,scheme="iid",rng=None,
+                 low_memory=False):
+
+    def calc_acc(df,qtl=[],col="SensorID"):
         """
         Function to calculate the acceleration for BCa using a jackknife estimate with respect to the sensors
         DiCiccio TJ, Efron B. Bootstrap confidence intervals. Stat Sci. 1996;11(3):189-228
@@ -71,49 +410,41 @@ def boostrapping(df,N,seed,conf_level=0.95):
         Input:
         df:         Dataframe with data, reduced to a certain glucose range
         qtl:        List of quantiles for TIs  
+        col:        Column of the clusters left out ("SensorID" or "PatientID")
 
         Output:
         a:      Numpy of acceleration for TI for provided quantiles
+        u:      Numpy array (n_clusters x 4) of jackknife estimates (kept for the influence table)
+        sens:   Sorted IDs of the clusters
         
 
         """
         
         # Extract list of sensors
-        sens = df["SensorID"].unique()
+        sens = df[col].unique()
         sens.sort()
-        n = len(sens)
-
-        # Array with jackknife estimate
-        u = np.zeros((n,4))    
-        for i in range(n):
-            # Remove single sensor and re-estimate 
-            df_tmp = df[df["SensorID"] != sens[i]]
-            u[i,:] = (df_tmp["Diff"].quantile(qtl)).to_numpy()
+
+        # Array with jackknife estimate (see jackknife_TI)
+        u = jackknife_TI(df,qtl,col=col)
         
         # Remove mean
         uu = np.add(np.mean(u,axis=0),-u)
         # Estimate acceleration
         a = np.sum(uu**3,axis=0) / (6*(np.sum(uu**2,axis=0)**(3/2)))
         
-        return a
+        return a, u, sens
 
     
     ## Bootstrapping
-    import time
+    metrics = Metrics() if metrics is None else metrics
+
+    if BS_TI is not None:     # Precomputed bootstrap samples (e.g. merged shards)
+        N = BS_TI.shape[2]
 
     if N<10000:
         print("WARNING: Bootstrapping with less than 10 000 samples is not recommended")
 
     RES = pd.DataFrame(columns=["Range","Median","DI1_Upper","DI1_Lower","DI1_Range","DI2_Upper","DI2_Lower","DI2_Range"])
-    
-    if seed:      # Seed is provided, if not reset
-        np.random.seed(seed)       # For reproducibility
-    else:
-        np.random.seed()
-    
-    # Interval Sizes according to FDA
-    Int_size1 = [0.85,0.7,0.8,0.87]
-    Int_size2 = [0.98,0.99,0.99,0.87]
 
     # Loop over Ranges and calculate quantiles of intervals
     # Rows: Ranges
@@ -122,32 +453,18 @@ def boostrapping(df,N,seed,conf_level=0.95):
     for r in range(4):
         DI[r,:] = (df[df["Range"]==r+1]["Diff"].quantile([(1-Int_size1[r])/2,(1+Int_size1[r])/2,(1-Int_size2[r])/2,(1+Int_size2[r])/2])).to_numpy()
 
-    # Extract list of sensors
-    sens = df["SensorID"].unique()
-    sens.sort()
-    
-    # Empty Matrices containing bootstrap samples
-    # Rows: Ranges, Columns: Interval limits/AR15,AR20,AR40, Depth: bootstrap samples 
-    BS_TI = np.zeros((4,4,N))
-    
     # Start time for timing
     start = time.time()
-    print("Bootstrapping (N = "+str(N)+") ... ")
-    # Loop over number of bootstap sample
-    for i in range(N):
-        # Get clustered-bootstrap sample
-        df_bs = pd.DataFrame({'SensorID':np.random.choice(sens, size=len(sens),replace=True)}).merge(df,how='left')
-        
-        # Loop over Ranges and calculate quantiles of intervals
-        for r in range(4):
-            BS_TI[r,:,i] = (df_bs[df_bs["Range"]==r+1]["Diff"].quantile([(1-Int_size1[r])/2,(1+Int_size1[r])/2,(1-Int_size2[r])/2,(1+Int_size2[r])/2])).to_numpy()
-            
-        # Print status
-        percent = int(np.round((i+1)/N*100))
-        bar = '+' * percent + "-" * (100-percent)
-        print(f"\r|{bar}| {percent:.1f}%",end="\r")
-    
-    print()
+    replay = None
+    if BS_TI is None:
+        rng = random_state(seed) if rng is None else rng      # Seed is provided for reproducibility, if not random
+        if low_memory:
+            # Bootstrap samples are regenerated in each pass of BCa_stream with a copy of the random state
+            rng0 = copy.deepcopy(rng)
+            replay = lambda: (BS[0].reshape(16,-1) for i, BS in bootstrap_TI_batches(df,N,two_stage=two_stage,scheme=scheme,
+                                                                                     rng=copy.deepcopy(rng0)))
+        else:
+            BS_TI = bootstrap_TI(df,N,metrics=metrics,two_stage=two_stage,scheme=scheme,rng=rng)
     
     ## Collect Results
     RES["Range"] = ["<70","70-180",">180","Total"]
@@ -157,13 +474,22 @@ def boostrapping(df,N,seed,conf_level=0.95):
 
     # TI confidence intervals, AR lower confidence bound
     # Loop over Ranges
+    jack = []
+    A = np.zeros((4,4))
     for r in range(4):
         # TIs
-        a = calc_acc(df[df["Range"]==r+1],qtl=[(1-Int_size1[r])/2,(1+Int_size1[r])/2,(1-Int_size2[r])/2,(1+Int_size2[r])/2])        
-        RES.at[r,"DI1_Lower"] = BCa(BS_TI[r,0,:],DI[r,0],a[0],(1-conf_level)/2)
-        RES.at[r,"DI1_Upper"] = BCa(BS_TI[r,1,:],DI[r,1],a[1],(1+conf_level)/2)
-        RES.at[r,"DI2_Lower"] = BCa(BS_TI[r,2,:],DI[r,2],a[2],(1-conf_level)/2)
-        RES.at[r,"DI2_Upper"] = BCa(BS_TI[r,3,:],DI[r,3],a[3],(1+conf_level)/2)
+        with metrics.span("calc_acc"):
+            A[r,:], u, sens = calc_acc(df[df["Range"]==r+1],qtl=[(1-Int_size1[r])/2,(1+Int_size1[r])/2,(1-Int_size2[r])/2,(1+Int_size2[r])/2],
+                                       col="PatientID" if two_stage else "SensorID")
+            jack.append((u[:,:2+2*(r<3)],DI[r,:2+2*(r<3)],sens))
+    lev = [(1-conf_level)/2,(1+conf_level)/2]*2
+    if replay is not None:
+        with metrics.span("bootstrap"):
+            DI_CI = BCa_stream(replay,DI.ravel(),A.ravel(),np.tile(lev,4)).reshape(4,4)
+    for r in range(4):
+        with metrics.span("BCa"):
+            for j, col in enumerate(["DI1_Lower","DI1_Upper","DI2_Lower","DI2_Upper"]):
+                RES.at[r,col] = DI_CI[r,j] if replay is not None else BCa(BS_TI[r,j,:],DI[r,j],A[r,j],lev[j])
         RES.at[r,"DI1_Range"] = RES.at[r,"DI1_Upper"] - RES.at[r,"DI1_Lower"]
         RES.at[r,"DI2_Range"] = RES.at[r,"DI2_Upper"] - RES.at[r,"DI2_Lower"] 
 
@@ -176,36 +502,43 @@ def boostrapping(df,N,seed,conf_level=0.95):
     sens = df["SensorID"].unique()
     ns = len(sens)
 
-    # Loop over Ranges
-    for r in range(4):
-        med = np.empty(ns)*np.NaN   # Medians
-        r90 = np.empty(ns)*np.NaN   # 90% ranges
-        # Loop over Sensors
-        for i,s in enumerate(sens):
-            # Get deviations of sensor in Range
-            dev = (df[(df["SensorID"]==s) & (df["Range"]==r+1)]["Diff"]).to_numpy()
-            if len(dev)>=3:         # Check if dev has 3 or more datapoints
-                med[i] = np.median(dev)
-                if len(dev)>=10:
-                    r90[i] = np.quantile(dev,0.95) - np.quantile(dev,0.05)
+    with metrics.span("variability"):
+        # Loop over Ranges
+        for r in range(4):
+            med = np.empty(ns)*np.NaN   # Medians
+            r90 = np.empty(ns)*np.NaN   # 90% ranges
+            # Loop over Sensors
+            for i,s in enumerate(sens):
+                # Get deviations of sensor in Range
+                dev = (df[(df["SensorID"]==s) & (df["Range"]==r+1)]["Diff"]).to_numpy()
+                if len(dev)>=3:         # Check if dev has 3 or more datapoints
+                    med[i] = np.median(dev)
+                    if len(dev)>=10:
+                        r90[i] = np.quantile(dev,0.95) - np.quantile(dev,0.05)
+                    else:
+                        r90[i] = np.NaN
                 else:
+                    med[i] = np.NaN
                     r90[i] = np.NaN
-            else:
-                med[i] = np.NaN
-                r90[i] = np.NaN
             
-        RES.at[r,"BSV_Min_Max"] = "[{:.2f} - {:.2f}]".format(np.nanmin(med),np.nanmax(med))
-        RES.at[r,"BSV_Range"] = np.nanmax(med) - np.nanmin(med)
-        RES.at[r,"WSV_90%Range"] = np.nanmedian(r90)
-        
-    
+            RES.at[r,"BSV_Min_Max"] = "[{:.2f} - {:.2f}]".format(np.nanmin(med),np.nanmax(med))
+            RES.at[r,"BSV_Range"] = np.nanmax(med) - np.nanmin(med)
+            RES.at[r,"WSV_90%Range"] = np.nanmedian(r90)
+
     # Print Timing    
     print("DONE","Processing Time: "+str(np.round(time.time()-start,2))+" seconds")
 
     # Info
-    RES.at[1,"Info"] = "N_BS: "+str(N)+" Seed: "+str(seed)
+    RES.at[1,"Info"] = "N_BS: "+str(N)+" Seed: "+str(seed) + (" ("+scheme+")")*(scheme != "iid")
     RES.at[2,"Info"] = "Conf_Level: "+str(conf_level)
+    if two_stage:
+        RES.at[3,"Info"] = "Two-stage: patients, sensors"
     
+    if full_output:
+        names = ["DI1_Lower","DI1_Upper","DI2_Lower","DI2_Upper"]
+        influence = influence_table(*zip(*jack),names=[names]*4,ranges=["<70","70-180",">180","Total"],
+                                    col="PatientID" if two_stage else "SensorID")
+        return RES, DI, BS_TI, influence
     return RES
 
 
@@ -222,7 +555,7 @@ def plotting(df,RES,version,ylims,s_max,figsize):
         
         """
 
-        from matplotlib.patches import Rectangle as rect
+        rect = patches.Rectangle
 
         # Define Colors
         colors = [(94/255,156/255,32/255),      # Green    
@@ -380,53 +713,23 @@ def plotting(df,RES,version,ylims,s_max,figsize):
     # Print CG-DIVA info on plot
     ax_a[0].text(-0.2,-0.23,"CG-DIVA "+version,fontsize=6,
             transform=ax_a[0].transAxes)
+
+    return fig
     
 
-def CG_DIVA(df,save_path,filename="CG-DIVA",
-                N_BS=10000,seed=1,
-                ylims=[-80,80],s_max=25,figsize=[16.5,8.5],
-                save_fig=True,save_res=True,show_fig=True):
+def data_processing(df):
     """
-    Perform CG-DIVA
+    Calculation of deviations and assignment of glucose ranges (according to comparator)
 
-    Inputs:
+    Input:
     df:         Pandas dataframe with columns "SensorID", "Comp" and "CGM"
-    save_path:  Path for saving figure and results tables
-    filename:   Filename of figure and results tables
-    N_BS:       Number of samples for bootstrapping
-    seed:       Seed for random number generator, provide [] when random seed shall be used
-    ylims:      Limits of y-axis in CG-DIVA plot
-    s_max:      Maximun number of sensor to display in sensor-to-sensor variability plot
-    figsize:    [Width,Height] of figure
-    save_fig:   True/False whether to save the figure
-    save_res:   True/False whether to save the results in csv file
-    show_plot:  True/False whether to show the figure 
 
-    
-    """
-    version = "v1.0"
-    print("\n\nCG_DIVA "+version)
-    
-    ## Check inputs
-    # Dataframe columns
-    for col in ["SensorID","Comp","CGM"]:
-        if not(col in df.columns):
-            raise ValueError("Column "+col+" does not exist")
+    Output:
+    df:         Pandas dataframe with additional columns "AbsDiff", "RelDiff", "Range" and "Diff".
+                Data of Range 4 (Total) is appended
 
-    # Data Format
-    if (pd.isna(df["SensorID"])).any():
-        raise ValueError("Column SensorID contains NA entries")
-    if df["Comp"].dtype != "float64" and df["Comp"].dtype != "int64":
-        raise ValueError("Column Comp contains non-number entries")
-    if df["CGM"].dtype != "float64" and df["CGM"].dtype != "int64":
-        raise ValueError("Column CGM contains non-number entries")
-
-    # Save path
-    if not(os.path.isdir(save_path)):
-        raise ValueError("Provided save_path does not exist")
+    """
 
-    
-    ## Data Processing
     df["AbsDiff"] = df["CGM"] - df["Comp"]                    # Absolute Difference
     df["RelDiff"] = df["AbsDiff"] / df["Comp"] * 100          # Relative Difference
 
@@ -444,6 +747,100 @@ def CG_DIVA(df,save_path,filename="CG-DIVA",
     dfn["Diff"] = df["RelDiff"]
     df = pd.concat([df,dfn])
 
+    return df
+
+
+@dataclass
+class CG_DIVA_Results:
+    """
+    Results of CG-DIVA
+
+    RES:        Pandas dataframe with results table (as saved in csv file)
+    DI:         Numpy array (4x4) of the deviation interval limits of the original sample
+                Rows: Ranges (<70, 70-180, >180, Total), Columns: DI1 lower, DI1 upper, DI2 lower, DI2 upper
+    DI_CI:      Numpy array (4x4) of the bootstrapped (BCa) deviation interval limits, same layout as DI
+                (NaN for DI2 of Total range)
+    Median:     Numpy array (4) of median deviations in each range
+    BS_TI:      Numpy array (4x4xN_BS) of bootstrap samples of the DI limits (only if return_replicates=True)
+    data:       Processed data (Pandas dataframe) as required for the sensor-to-sensor variability plot
+    info:       Dict with meta information
+    influence:  Pandas dataframe with the influence of each sensor (patient for two_stage) on the DI limits
+                from the jackknife estimates of BCa, see influence_table
+
+    """
+
+    RES: pd.DataFrame
+    DI: np.ndarray
+    DI_CI: np.ndarray
+    Median: np.ndarray
+    BS_TI: np.ndarray = None
+    data: pd.DataFrame = None
+    info: dict = field(default_factory=dict)
+    influence: pd.DataFrame = None
+
+
+def CG_DIVA_compute(df,N_BS=10000,seed=1,conf_level=0.95,
+                        return_replicates=False,metrics=None,replicates=None,two_stage=False,scheme="iid",rng=None,
+                        low_memory=False):
+    """
+    Perform the calculations of CG-DIVA without creating the figure or saving results
+
+    Inputs:
+    df:                 Pandas dataframe with columns "SensorID", "Comp" and "CGM" or Dataset (see folder Data Preparation)
+    N_BS:               Number of samples for bootstrapping
+    seed:               Seed for random number generator, provide [] when random seed shall be used
+    conf_level:         Confidence level of bootstrapped deviation interval limits
+    return_replicates:  True/False whether to include the bootstrap samples in the results
+    metrics:            Metrics object for recording processing times of the processing stages (optional)
+    replicates:         Precomputed bootstrap samples (4x4xN), e.g. merged shards, N_BS and seed are then
+                        only used as information (optional)
+    two_stage:          True/False whether patients (column "PatientID") and then sensors within patients
+                        are resampled instead of sensors
+    scheme:             Resampling scheme: "iid" (independent), "balanced" or "antithetic" (see cluster_samples)
+    rng:                Numpy random Generator or RandomState used instead of seed (optional)
+    low_memory:         True/False whether the bootstrap samples are not kept but regenerated in several passes
+                        for an exact selection of the BCa limits (see BCa_stream), memory does not grow with N_BS
+                        (no replicates returned)
+
+    Output:
+    res:                CG_DIVA_Results object
+
+    """
+    version = "v1.0"
+    print("\n\nCG_DIVA "+version)
+    
+    ## Check inputs
+    # Preprocessed Dataset (see folder Data Preparation), checked on creation
+    if hasattr(df,"cg_data"):
+        if two_stage and not(df.has_patients):
+            raise ValueError("Column PatientID does not exist")
+    else:
+        # Dataframe columns
+        for col in ["SensorID","Comp","CGM"]:
+            if not(col in df.columns):
+                raise ValueError("Column "+col+" does not exist")
+
+        # Data Format
+        if (pd.isna(df["SensorID"])).any():
+            raise ValueError("Column SensorID contains NA entries")
+        if df["Comp"].dtype != "float64" and df["Comp"].dtype != "int64":
+            raise ValueError("Column Comp contains non-number entries")
+        if df["CGM"].dtype != "float64" and df["CGM"].dtype != "int64":
+            raise ValueError("Column CGM contains non-number entries")
+        if two_stage:
+            if not("PatientID" in df.columns):
+                raise ValueError("Column PatientID does not exist")
+            if (pd.isna(df["PatientID"])).any():
+                raise ValueError("Column PatientID contains NA entries")
+
+    metrics = Metrics() if metrics is None else metrics
+
+    ## Data Processing
+    # The data of a Dataset is copied for the results, as its arrays are read-only and shared by all calls
+    dataset = hasattr(df,"cg_data")
+    with metrics.span("preprocessing"):
+        df = df.cg_data if dataset else data_processing(df.copy())
+
     # Check data
     for r in range(4):
         n_r = df[df["Range"] == r+1]["Range"].count()
@@ -453,21 +850,447 @@ def CG_DIVA(df,save_path,filename="CG-DIVA",
     # Print dataset information
     print("Number of Datapoints:",int(df["Diff"].count()/2))
     print("Number of Sensors:",df["SensorID"].nunique())
+    N_BS = N_BS if replicates is None else replicates.shape[2]
+    info = {"tool": "CG_DIVA", "version": version, "n_datapoints": int(df["Diff"].count()/2),
+            "n_sensors": int(df["SensorID"].nunique()), "N_BS": N_BS, "seed": seed, "conf_level": conf_level,
+            "two_stage": two_stage, "scheme": scheme}
+    metrics.info.update(info)
 
     # Bootstrapping
-    RES = boostrapping(df,N_BS,seed)
+    RES, DI, BS_TI, influence = boostrapping(df,N_BS,seed,conf_level=conf_level,metrics=metrics,full_output=True,
+                                             BS_TI=replicates,two_stage=two_stage,scheme=scheme,rng=rng,
+                                             low_memory=low_memory)
     RES.at[0,"Info"] = "CG-DIVA "+ version
+
+    DI_CI = RES[["DI1_Lower","DI1_Upper","DI2_Lower","DI2_Upper"]].apply(pd.to_numeric,errors="coerce").to_numpy(dtype=float)
+
+    return CG_DIVA_Results(RES=RES,DI=DI,DI_CI=DI_CI,Median=RES["Median"].to_numpy(dtype=float),
+                           BS_TI=BS_TI if return_replicates else None,data=df.copy() if dataset else df,info=info,
+                           influence=influence)
+
+
+def CG_DIVA_plot(res,ylims=[-80,80],s_max=25,figsize=[16.5,8.5]):
+    """
+    Create the CG-DIVA figure from the results of CG_DIVA_compute
+
+    Inputs:
+    res:        CG_DIVA_Results object
+    ylims:      Limits of y-axis in CG-DIVA plot
+    s_max:      Maximun number of sensor to display in sensor-to-sensor variability plot
+    figsize:    [Width,Height] of figure
+
+    Output:
+    fig:        Handle to figure
+
+    """
+
+    return plotting(res.data,res.RES,res.info["version"],ylims,s_max,figsize)
+
+
+def CG_DIVA(df,save_path,filename="CG-DIVA",
+                N_BS=10000,seed=1,
+                ylims=[-80,80],s_max=25,figsize=[16.5,8.5],
+                save_fig=True,save_res=True,show_fig=True,metrics=None,two_stage=False,scheme="iid",rng=None,
+                low_memory=False):
+    """
+    Perform CG-DIVA
+
+    Inputs:
+    df:         Pandas dataframe with columns "SensorID", "Comp" and "CGM" or Dataset (see folder Data Preparation)
+    save_path:  Path for saving figure and results tables
+    filename:   Filename of figure and results tables
+    N_BS:       Number of samples for bootstrapping
+    seed:       Seed for random number generator, provide [] when random seed shall be used
+    ylims:      Limits of y-axis in CG-DIVA plot
+    s_max:      Maximun number of sensor to display in sensor-to-sensor variability plot
+    figsize:    [Width,Height] of figure
+    save_fig:   True/False whether to save the figure
+    save_res:   True/False whether to save the results in csv file
+    show_plot:  True/False whether to show the figure 
+    metrics:    Metrics object for recording processing times of the processing stages (optional)
+    two_stage:  True/False whether patients (column "PatientID") and then sensors within patients are resampled
+    scheme:     Resampling scheme: "iid" (independent), "balanced" or "antithetic" (see cluster_samples)
+    rng:        Numpy random Generator or RandomState used instead of seed (optional)
+    low_memory: True/False whether the bootstrap samples are not kept (see CG_DIVA_compute)
+
+    Output:
+    res:        CG_DIVA_Results object
+
+    """
+
+    # Save path
+    if (save_fig or save_res) and not(os.path.isdir(save_path)):
+        raise ValueError("Provided save_path does not exist")
+
+    metrics = Metrics() if metrics is None else metrics
+
+    res = CG_DIVA_compute(df,N_BS=N_BS,seed=seed,metrics=metrics,two_stage=two_stage,scheme=scheme,rng=rng,
+                          low_memory=low_memory)
     if save_res:
-        RES.to_csv(save_path+filename+".csv",index=None)
-    
-    # Plotting
+        with metrics.span("saving"):
+            res.RES.to_csv(save_path+filename+".csv",index=None)
     
-    plotting(df,RES,version,ylims,s_max,figsize)
-    # Save and show plot
-    if save_fig:
-        plt.savefig(save_path+filename+".png",dpi=600)
-    
-    if show_fig:
-        plt.show()
+    # Plotting (only if the figure is needed)
+    if save_fig or show_fig:
+        with metrics.span("plotting"):
+            fig = CG_DIVA_plot(res,ylims=ylims,s_max=s_max,figsize=figsize)
+        # Save and show plot
+        if save_fig:
+            with metrics.span("saving"):
+                fig.savefig(save_path+filename+".png",dpi=600)
+        
+        if show_fig:
+            plt.show()
+    print("\n\n")
+
+    return res
+
+
+def CG_DIVA_shard(df,shard,n_shards,N_BS=10000,seed=1,save_path=None,filename="CG-DIVA",metrics=None,two_stage=False):
+    """
+    Perform shard number shard (0 to n_shards-1) of the bootstrapping of CG-DIVA
+    The N_BS bootstrap samples are split evenly between the shards. Shards can be run independently
+    (e.g. on different machines) and are combined with CG_DIVA_merge
+
+    Inputs:
+    df:         Pandas dataframe with columns "SensorID", "Comp" and "CGM"
+    shard:      Number of the shard (0 to n_shards-1)
+    n_shards:   Total number of shards
+    N_BS:       Total number of samples for bootstrapping (of all shards)
+    seed:       Seed for random number generator (has to be identical for all shards)
+    save_path:  Path for saving the shard file (filename_shard_k_of_K.npz), None if it shall not be saved
+    filename:   Filename of shard file
+    metrics:    Metrics object for recording processing times of the processing stages (optional)
+    two_stage:  True/False whether patients (column "PatientID") and then sensors within patients are resampled
+
+    Output:
+    BS_TI:      Numpy array (4x4xN) of bootstrap samples of the shard
+    meta:       Dict with meta information of the shard
+
+    """
+
+    if not(seed):
+        raise ValueError("A seed has to be provided for bootstrapping in shards")
+    if not(0 <= shard < n_shards):
+        raise ValueError("shard has to be between 0 and n_shards-1")
+    for col in ["SensorID","Comp","CGM"]:
+        if not(col in df.columns):
+            raise ValueError("Column "+col+" does not exist")
+    if save_path is not None and not(os.path.isdir(save_path)):
+        raise ValueError("Provided save_path does not exist")
+
+    meta = {"tool": "CG_DIVA", "shard": shard, "n_shards": n_shards, "N_BS": N_BS,
+            "N": N_BS//n_shards + (shard < N_BS % n_shards), "seed": seed, "two_stage": two_stage,
+            "data_hash": data_hash(df)}
+
+    df = data_processing(df.copy())
+    BS_TI = bootstrap_TI(df,meta["N"],metrics=metrics,two_stage=two_stage,rng=np.random.RandomState(shard_seed(seed,shard,n_shards)))
+
+    if save_path is not None:
+        np.savez_compressed(save_path+filename+"_shard_{}_of_{}.npz".format(shard,n_shards),BS=BS_TI,meta=json.dumps(meta))
+
+    return BS_TI, meta
+
+
+def CG_DIVA_merge(df,files,conf_level=0.95,return_replicates=False,metrics=None):
+    """
+    Combine the bootstrap shards of CG_DIVA_shard and perform the calculations of CG-DIVA
+
+    Inputs:
+    df:                 Pandas dataframe with columns "SensorID", "Comp" and "CGM" (as used for the shards)
+    files:              List of shard files (all shards 0 to n_shards-1)
+    conf_level:         Confidence level of bootstrapped deviation interval limits
+    return_replicates:  True/False whether to include the bootstrap samples in the results
+    metrics:            Metrics object for recording processing times of the processing stages (optional)
+
+    Output:
+    res:                CG_DIVA_Results object (as CG_DIVA_compute)
+
+    """
+
+    BS_TI, meta = merge_shards(files,"CG_DIVA",data_hash(df))
+
+    return CG_DIVA_compute(df,N_BS=meta["N_BS"],seed=meta["seed"],conf_level=conf_level,
+                           return_replicates=return_replicates,metrics=metrics,replicates=BS_TI,
+                           two_stage=meta["two_stage"])
+
+
+@dataclass
+class CG_DIVA_Paired_Results:
+    """
+    Results of the paired comparison of two devices with CG-DIVA
+
+    RES:        Pandas dataframe with results table (as saved in csv file)
+    DI:         Numpy array (2x4x4) of the deviation interval limits of both devices
+                Rows: Ranges (<70, 70-180, >180, Total), Columns: DI1 lower, DI1 upper, DI2 lower, DI2 upper
+    Diff:       Numpy array (4x4) of the differences of the limits (second - first device), same layout as DI
+    Diff_CI:    Numpy array (4x4x2) of the lower and upper BCa confidence limits of the differences
+                (NaN for DI2 of Total range)
+    BS_Diff:    Numpy array (4x4xN_BS) of bootstrap samples of the differences (only if return_replicates=True)
+    info:       Dict with meta information
+
+    """
+
+    RES: pd.DataFrame
+    DI: np.ndarray
+    Diff: np.ndarray
+    Diff_CI: np.ndarray
+    BS_Diff: np.ndarray = None
+    info: dict = field(default_factory=dict)
+
+
+def CG_DIVA_paired(df,devices,save_path=None,filename="CG-DIVA_Paired",
+                       N_BS=10000,seed=1,conf_level=0.95,return_replicates=False,metrics=None,two_stage=False,
+                       scheme="iid",rng=None):
+    """
+    Paired comparison of the deviation intervals of two devices worn on the same sensors/patients
+    Both devices are evaluated on the same bootstrap samples (same resampled sensors) and BCa confidence
+    intervals are calculated for the differences of the deviation interval limits (second - first device)
+
+    Inputs:
+    df:                 Pandas dataframe with columns "SensorID", "Comp" and the columns of both devices
+    devices:            List with the two column names of the devices, e.g. ["CGM_A","CGM_B"]
+    save_path:          Path for saving the results table, None if results shall not be saved
+    filename:           Filename of results table
+    N_BS:               Number of samples for bootstrapping
+    seed:               Seed for random number generator, provide [] when random seed shall be used
+    conf_level:         Confidence level of the intervals of the differences
+    return_replicates:  True/False whether to include the bootstrap samples in the results
+    metrics:            Metrics object for recording processing times of the processing stages (optional)
+    two_stage:          True/False whether patients (column "PatientID") and then sensors within patients
+                        are resampled
+    scheme:             Resampling scheme: "iid" (independent), "balanced" or "antithetic" (see cluster_samples)
+    rng:                Numpy random Generator or RandomState used instead of seed (optional)
+
+    Output:
+    res:                CG_DIVA_Paired_Results object
+
+    """
+    version = "v1.0"
+    print("\n\nCG_DIVA "+version+" paired comparison")
+
+    ## Check inputs
+    if len(devices) != 2 or devices[0] == devices[1]:
+        raise ValueError("Two different device columns have to be provided")
+    cols = ["SensorID","Comp"] + ["PatientID"]*two_stage
+    for col in cols + list(devices):
+        if not(col in df.columns):
+            raise ValueError("Column "+col+" does not exist")
+    for col in cols + list(devices):
+        if (pd.isna(df[col])).any():
+            raise ValueError("Column "+col+" contains NA entries")
+    for col in ["Comp"] + list(devices):
+        if df[col].dtype != "float64" and df[col].dtype != "int64":
+            raise ValueError("Column "+col+" contains non-number entries")
+    if save_path is not None and not(os.path.isdir(save_path)):
+        raise ValueError("Provided save_path does not exist")
+
+    metrics = Metrics() if metrics is None else metrics
+
+    ## Data Processing (ranges according to comparator are identical for both devices)
+    with metrics.span("preprocessing"):
+        dfs = [data_processing(df[cols].assign(CGM=df[d])) for d in devices]
+
+    for r in range(4):
+        n_r = (dfs[0]["Range"] == r+1).sum()
+        if n_r<100:
+            raise ValueError("Range "+str(r+1)+" contains an insufficient number of datapoints (<100)")
+
+    print("Number of Datapoints:",int(df.shape[0]))
+    print("Number of Sensors:",df["SensorID"].nunique())
+    info = {"tool": "CG_DIVA_paired", "version": version, "devices": list(devices),
+            "n_datapoints": int(df.shape[0]), "n_sensors": int(df["SensorID"].nunique()),
+            "N_BS": N_BS, "seed": seed, "conf_level": conf_level, "two_stage": two_stage, "scheme": scheme}
+    metrics.info.update(info)
+
+    # Deviation interval limits of both devices
+    qtl = [[(1-Int_size1[r])/2,(1+Int_size1[r])/2,(1-Int_size2[r])/2,(1+Int_size2[r])/2] for r in range(4)]
+    DI = np.zeros((2,4,4))
+    for k in range(2):
+        for r in range(4):
+            DI[k,r,:] = (dfs[k][dfs[k]["Range"]==r+1]["Diff"].quantile(qtl[r])).to_numpy()
+    Diff = DI[1] - DI[0]
+
+    # Bootstrapping of both devices with the same samples
+    start = time.time()
+    rng = random_state(seed) if rng is None else rng      # Seed is provided for reproducibility, if not random
+    BS_Diff = np.diff(bootstrap_TI(dfs,N_BS,metrics=metrics,two_stage=two_stage,scheme=scheme,rng=rng),axis=0)[0]
+
+    # BCa intervals of the differences, acceleration from the jackknife of the differences
+    Diff_CI = np.full((4,4,2),np.nan)
+    for r in range(4):
+        with metrics.span("calc_acc"):
+            u = [jackknife_TI(d[d["Range"]==r+1],qtl[r],col="PatientID" if two_stage else "SensorID") for d in dfs]
+            uu = np.mean(u[1]-u[0],axis=0) - (u[1]-u[0])
+            with np.errstate(divide="ignore",invalid="ignore"):
+                a = np.sum(uu**3,axis=0) / (6*(np.sum(uu**2,axis=0)**(3/2)))
+        with metrics.span("BCa"):
+            for l in range(4 if r<3 else 2):
+                Diff_CI[r,l,0] = BCa(BS_Diff[r,l,:],Diff[r,l],a[l],(1-conf_level)/2)
+                Diff_CI[r,l,1] = BCa(BS_Diff[r,l,:],Diff[r,l],a[l],(1+conf_level)/2)
+
+    print("DONE","Processing Time: "+str(np.round(time.time()-start,2))+" seconds")
+
+    ## Collect Results (DI2 is not evaluated for Total range)
+    RES = pd.DataFrame([(rng,lim,DI[0,r,l],DI[1,r,l],Diff[r,l],Diff_CI[r,l,0],Diff_CI[r,l,1])
+                        for r, rng in enumerate(["<70","70-180",">180","Total"])
+                        for l, lim in enumerate(["DI1_Lower","DI1_Upper","DI2_Lower","DI2_Upper"]) if r<3 or l<2],
+                       columns=["Range","Limit",devices[0],devices[1],"Difference","CI_Lower","CI_Upper"])
+    RES["Info"] = ""
+    RES.at[0,"Info"] = "CG-DIVA "+version+" paired"
+    RES.at[1,"Info"] = "N_BS: "+str(N_BS)+" Seed: "+str(seed)
+    RES.at[2,"Info"] = "Conf_Level: "+str(conf_level)
+    RES.at[3,"Info"] = "Difference: "+str(devices[1])+" - "+str(devices[0])
+    if two_stage:
+        RES.at[4,"Info"] = "Two-stage: patients, sensors"
+
+    if save_path is not None:
+        with metrics.span("saving"):
+            RES.to_csv(save_path+filename+".csv",index=None)
     print("\n\n")
-    
\ No newline at end of file
+
+    return CG_DIVA_Paired_Results(RES=RES,DI=DI,Diff=Diff,Diff_CI=Diff_CI,
+                                  BS_Diff=BS_Diff if return_replicates else None,info=info)
+
+
+@dataclass
+class CG_DIVA_Sensitivity_Results:
+    """
+    Results of the deviation intervals for several interval sizes and confidence levels
+
+    RES:        Pandas dataframe with results table (as saved in csv file), one row per range, interval size
+                and confidence level
+    int_sizes:  Numpy array (4xK) of interval sizes of each range
+    conf_level: List of confidence levels
+    DI:         Numpy array (4xKx2) of the lower and upper deviation interval limits of the original sample
+    DI_CI:      Numpy array (4xKx2xC) of the bootstrapped (BCa) limits: lower confidence limit of the lower
+                interval limit and upper confidence limit of the upper interval limit for each confidence level
+    BS_TI:      Numpy array (4x2KxN_BS) of bootstrap samples of the limits (only if return_replicates=True)
+    info:       Dict with meta information
+
+    """
+
+    RES: pd.DataFrame
+    int_sizes: np.ndarray
+    conf_level: list
+    DI: np.ndarray
+    DI_CI: np.ndarray
+    BS_TI: np.ndarray = None
+    info: dict = field(default_factory=dict)
+
+
+def CG_DIVA_sensitivity(df,int_sizes=None,conf_level=[0.95],save_path=None,filename="CG-DIVA_Sensitivity",
+                            N_BS=10000,seed=1,return_replicates=False,metrics=None,two_stage=False,scheme="iid",
+                            rng=None):
+    """
+    Calculate the deviation intervals and their bootstrapped limits for several interval sizes and confidence levels
+    All limits are bootstrapped with one set of bootstrap samples and all confidence levels are calculated
+    from the same samples, i.e. the computation time hardly depends on the number of sizes and levels
+
+    Inputs:
+    df:                 Pandas dataframe with columns "SensorID", "Comp" and "CGM" or Dataset (see folder Data Preparation)
+    int_sizes:          Interval sizes (0 to 1), single size or list (same for all ranges) or array (4xK) with
+                        the sizes of each range (default: FDA interval sizes Int_size1, Int_size2)
+    conf_level:         List of confidence levels of bootstrapped deviation interval limits
+    save_path:          Path for saving the results table, None if results shall not be saved
+    filename:           Filename of results table
+    N_BS:               Number of samples for bootstrapping
+    seed:               Seed for random number generator, provide [] when random seed shall be used
+    return_replicates:  True/False whether to include the bootstrap samples in the results
+    metrics:            Metrics object for recording processing times of the processing stages (optional)
+    two_stage:          True/False whether patients (column "PatientID") and then sensors within patients
+                        are resampled
+    scheme:             Resampling scheme: "iid" (independent), "balanced" or "antithetic" (see cluster_samples)
+    rng:                Numpy random Generator or RandomState used instead of seed (optional)
+
+    Output:
+    res:                CG_DIVA_Sensitivity_Results object
+
+    """
+    version = "v1.0"
+    print("\n\nCG_DIVA "+version+" sensitivity")
+
+    ## Check inputs
+    if hasattr(df,"cg_data"):
+        if two_stage and not(df.has_patients):
+            raise ValueError("Column PatientID does not exist")
+    else:
+        for col in ["SensorID","Comp","CGM"] + ["PatientID"]*two_stage:
+            if not(col in df.columns):
+                raise ValueError("Column "+col+" does not exist")
+            if (pd.isna(df[col])).any():
+                raise ValueError("Column "+col+" contains NA entries")
+        for col in ["Comp","CGM"]:
+            if df[col].dtype != "float64" and df[col].dtype != "int64":
+                raise ValueError("Column "+col+" contains non-number entries")
+    sizes = interval_sizes(int_sizes)
+    if sizes.shape[1] == 0 or len(conf_level) == 0:
+        raise ValueError("At least one interval size and one confidence level have to be provided")
+    if ((sizes <= 0) | (sizes >= 1)).any():
+        raise ValueError("Interval sizes have to be between 0 and 1")
+    if save_path is not None and not(os.path.isdir(save_path)):
+        raise ValueError("Provided save_path does not exist")
+
+    metrics = Metrics() if metrics is None else metrics
+    conf_level = list(conf_level)
+    K = sizes.shape[1]
+
+    ## Data Processing
+    with metrics.span("preprocessing"):
+        df = df.cg_data if hasattr(df,"cg_data") else data_processing(df.copy())
+
+    for r in range(4):
+        n_r = (df["Range"] == r+1).sum()
+        if n_r<100:
+            raise ValueError("Range "+str(r+1)+" contains an insufficient number of datapoints (<100)")
+
+    info = {"tool": "CG_DIVA_sensitivity", "version": version, "n_datapoints": int(df["Diff"].count()/2),
+            "n_sensors": int(df["SensorID"].nunique()), "N_BS": N_BS, "seed": seed,
+            "int_sizes": sizes.tolist(), "conf_level": conf_level, "two_stage": two_stage, "scheme": scheme}
+    metrics.info.update(info)
+
+    # Deviation interval limits of the original sample
+    qtl = interval_quantiles(sizes)
+    DI = np.zeros((4,2*K))
+    for r in range(4):
+        DI[r,:] = (df[df["Range"]==r+1]["Diff"].quantile(qtl[r])).to_numpy()
+
+    # Bootstrapping of all limits with the same samples
+    start = time.time()
+    rng = random_state(seed) if rng is None else rng      # Seed is provided for reproducibility, if not random
+    BS_TI = bootstrap_TI(df,N_BS,metrics=metrics,two_stage=two_stage,int_sizes=sizes,scheme=scheme,rng=rng)
+
+    # BCa limits of all confidence levels
+    DI_CI = np.zeros((4,K,2,len(conf_level)))
+    for r in range(4):
+        with metrics.span("calc_acc"):
+            u = jackknife_TI(df[df["Range"]==r+1],qtl[r],col="PatientID" if two_stage else "SensorID")
+            uu = np.add(np.mean(u,axis=0),-u)
+            a = np.sum(uu**3,axis=0) / (6*(np.sum(uu**2,axis=0)**(3/2)))
+        with metrics.span("BCa"):
+            for k in range(K):
+                for j, c in enumerate(conf_level):
+                    DI_CI[r,k,0,j] = BCa(BS_TI[r,2*k,:],DI[r,2*k],a[2*k],(1-c)/2)
+                    DI_CI[r,k,1,j] = BCa(BS_TI[r,2*k+1,:],DI[r,2*k+1],a[2*k+1],(1+c)/2)
+
+    print("DONE","Processing Time: "+str(np.round(time.time()-start,2))+" seconds")
+
+    ## Collect Results
+    DI = DI.reshape(4,K,2)
+    RES = pd.DataFrame([(rng,sizes[r,k],c,DI[r,k,0],DI[r,k,1],DI_CI[r,k,0,j],DI_CI[r,k,1,j])
+                        for r, rng in enumerate(["<70","70-180",">180","Total"])
+                        for k in range(K) for j, c in enumerate(conf_level)],
+                       columns=["Range","Int_Size","Conf_Level","DI_Lower","DI_Upper","CI_Lower","CI_Upper"])
+    RES["Info"] = ""
+    RES.at[0,"Info"] = "CG-DIVA "+version+" sensitivity"
+    RES.at[1,"Info"] = "N_BS: "+str(N_BS)+" Seed: "+str(seed)
+    if two_stage:
+        RES.at[2,"Info"] = "Two-stage: patients, sensors"
+
+    if save_path is not None:
+        with metrics.span("saving"):
+            RES.to_csv(save_path+filename+".csv",index=None)
+    print("\n\n")
+
+    return CG_DIVA_Sensitivity_Results(RES=RES,int_sizes=np.array(sizes),conf_level=conf_level,DI=DI,DI_CI=DI_CI,
+                                       BS_TI=BS_TI if return_replicates else None,info=info)
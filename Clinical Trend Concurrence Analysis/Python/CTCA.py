@@ -11,19 +11,51 @@ This is a free software and comes with ABSOLUTELY NO WARRANTY
 """
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import sklearn.metrics as sklmetr
-from matplotlib.gridspec import GridSpec
-from matplotlib.patches import Rectangle as rect
 import os
+import sys
+from dataclasses import dataclass
 
+# Helpers shared by all tools (folder Common of the repository)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),"Common","Python"))
+from CGM_common import LazyImport, Metrics
+
+# Heavy packages are loaded on first use
+plt = LazyImport("matplotlib.pyplot")
+gridspec = LazyImport("matplotlib.gridspec")
+patches = LazyImport("matplotlib.patches")
+sklmetr = LazyImport("sklearn.metrics")
+
+
+
+@dataclass(frozen=True)
+class CTCA_Config:
+    """
+    Parameters of the CTCA display (immutable, passed explicitly to the functions)
+
+    ncats:              Number of CGM RoC categories (5 or 7), None: number of comparator categories in the data
+    colors:             RGB colors of zones A to D
+    alpha:              alpha of colors
+    fontsize:           Font size of the percentages in the cells
 
-def get_params(ncats):
+    """
+
+    ncats: int = None
+    colors: tuple = ((121/255,169/255,81/255),(240/255,235/255,73/255),(237/255,172/255,9/255),(238/255,43/255,43/255))
+    alpha: float = 0.8
+    fontsize: float = 8
+
+    def __post_init__(self):
+        if not(self.ncats is None or self.ncats in [5,7]):
+            raise ValueError("ncats must be 5, 7 or None, got "+str(self.ncats))
+
+
+def get_params(ncats,config=None):
     """
     Define basic parameters of the CTCA display
 
     Input:
     ncats:              Number of CGM RoC categories
+    config:             CTCA_Config object (default: CTCA_Config())
 
     Output:
     ticklbls_comp:      xtick labels for comparator axis
@@ -39,12 +71,10 @@ def get_params(ncats):
 
     """
 
-    alpha = 0.8
+    config = CTCA_Config() if config is None else config
+    alpha = config.alpha
 
-    colA = (121/255,169/255,81/255)
-    colB = (240/255,235/255,73/255)
-    colC = (237/255,172/255,9/255)
-    colD = (238/255,43/255,43/255)
+    colA, colB, colC, colD = config.colors
 
     ticklbls_comp = ["<-3",
                      "-3 to <-2",
@@ -143,8 +173,58 @@ def zone_count(CMcnt,ncats):
     return Acnt, Bcnt, Ccnt, Dcnt, n
 
 
+def check_categories(df,ncats):
+    """
+    Check that the RoC categories in the data agree with the number of CGM RoC categories of the display
+
+    Input:
+    df:                 Dataframe with columns "Comp_ROC_Cat" and "CGM_ROC_Cat"
+    ncats:              Number of CGM RoC categories
+
+    """
+
+    if not(ncats in [5,7]):
+        raise ValueError("The data contain "+str(ncats)+" comparator RoC categories, 5 or 7 are supported (set ncats)")
+    tmp = df[["Comp_ROC_Cat","CGM_ROC_Cat"]].dropna()
+    # The display has seven columns (comparator categories), the confusion matrices use the union of the categories
+    cats = np.union1d(tmp["Comp_ROC_Cat"].unique(),tmp["CGM_ROC_Cat"].unique())
+    if len(cats) != 7:
+        raise ValueError("The data contain "+str(len(cats))+" RoC categories, 7 are required")
+    # For five-arrow systems the outermost categories must not contain CGM data
+    if ncats == 5 and tmp["CGM_ROC_Cat"].isin([cats[0],cats[-1]]).any():
+        raise ValueError("Column CGM_ROC_Cat contains 7 categories, but ncats is 5")
+
+
+def concurrence_matrix(df,ncats):
+    """
+    Concurrence matrix of comparator and CGM RoC categories (layout of the CTCA display)
+
+    Input:
+    df:                 Dataframe with columns "Comp_ROC_Cat" and "CGM_ROC_Cat"
+    ncats:              Number of CGM RoC categories
+
+    Output:
+    CM:                 Concurrence matrix in % of the pairs of each comparator category (rows CGM, columns comparator)
+    CMcnt:              Concurrence matrix containing counts
+
+    """
+
+    tmp = df[["Comp_ROC_Cat","CGM_ROC_Cat"]].dropna()
+    # Confusion matrices need to be transposed to agree with the POCT layout (columns comparator, rows CGM)
+    # Confusion matrix normalized over columns ("true" categories)
+    CM = sklmetr.confusion_matrix(tmp["Comp_ROC_Cat"],tmp["CGM_ROC_Cat"],normalize="true").transpose()*100
+    # Confusion matrix not normalized (just counts)
+    CMcnt = sklmetr.confusion_matrix(tmp["Comp_ROC_Cat"],tmp["CGM_ROC_Cat"],normalize=None).transpose()
+    # Remove top and bottom row for five-arrow system as they contain only zeros
+    if ncats == 5:
+        CM = CM[1:6,:]
+        CMcnt = CMcnt[1:6,:]
+
+    return CM, CMcnt
+
+
 def CTCA(df,save_path=None,filename="CTCA",figsize=[16,6],fig=None,
-             save_fig=False,show_fig=True):
+             save_fig=False,show_fig=True,metrics=None,config=None):
     """
     Create the Dynamic Glucose Region plot based on BG-RoC pairs
 
@@ -153,9 +233,15 @@ def CTCA(df,save_path=None,filename="CTCA",figsize=[16,6],fig=None,
     save_path:      Path for saving figure and results
     filename:       Filename of figure and results
     figsize:        [Width,Height] of figure in cm
-    fig:            Handle to existing figure object
+    fig:            Handle to existing figure object, e.g. matplotlib.figure.Figure() for creating figures in
+                    several threads (pyplot is not thread-safe)
     save_fig:       True/False whether to save the figure
     show_plot:      True/False whether to show the figure
+    metrics:        Metrics object for recording processing times of the processing stages (optional)
+    config:         CTCA_Config object with the parameters of the display (default: CTCA_Config())
+
+    Output:
+    fig:            Figure object
 
     """
 
@@ -166,11 +252,11 @@ def CTCA(df,save_path=None,filename="CTCA",figsize=[16,6],fig=None,
             raise ValueError("Column "+col+" does not exist")
 
     # Data Format
-    if df["Comp_ROC"].dtype != "float64" and df["BG"].dtype != "int64":
+    if df["Comp_ROC"].dtype != "float64" and df["Comp_ROC"].dtype != "int64":
         raise ValueError("Column Comp_ROC contains non-number entries")
-    if df["Comp_ROC_Cat"].dtype != "float64" and df["BG"].dtype != "int64":
+    if df["Comp_ROC_Cat"].dtype != "float64" and df["Comp_ROC_Cat"].dtype != "int64":
         raise ValueError("Column Comp_ROC_Cat contains non-number entries")
-    if df["CGM_ROC_Cat"].dtype != "float64" and df["ROC"].dtype != "int64":
+    if df["CGM_ROC_Cat"].dtype != "float64" and df["CGM_ROC_Cat"].dtype != "int64":
         raise ValueError("Column CGM_ROC_Cat contains non-number entries")
 
     # Save path
@@ -181,109 +267,109 @@ def CTCA(df,save_path=None,filename="CTCA",figsize=[16,6],fig=None,
             if not(os.path.isdir(save_path)):
                 raise ValueError("Provided save_path does not exist")
 
-    ncats = df["Comp_ROC_Cat"].nunique()
+    config = CTCA_Config() if config is None else config
+    ncats = df["Comp_ROC_Cat"].nunique() if config.ncats is None else config.ncats
+    check_categories(df,ncats)
 
     # Get parametes
-    ticklbls_comp, ticklbls_cgm, colors, colors2, al = get_params(ncats)
-
-    # Calculate Concurrence Matrix
-    maroc = df["Comp_ROC"].abs().mean()
-    tmp = df[["Comp_ROC_Cat","CGM_ROC_Cat"]].dropna()
-    n = tmp.shape[0]
-    # Confusion matrices need to be transposed to agree with the POCT layout (columns comparator, rows CGM)
-    # Confusion matrix normalized over columns ("true" categories)
-    CM = sklmetr.confusion_matrix(tmp["Comp_ROC_Cat"],tmp["CGM_ROC_Cat"],normalize="true").transpose()*100
-    # Confusion matrix not normalized (just counts)
-    CMcnt = sklmetr.confusion_matrix(tmp["Comp_ROC_Cat"],tmp["CGM_ROC_Cat"],normalize=None).transpose()
-    # Remove top and bottom row for five-arrow system as they contain only zeros
-    if ncats == 5:
-        CM = CM[1:6,:]
-        CMcnt = CMcnt[1:6,:]
-
-    #################
-    # Setup the figure
-    if fig is None:
-        fig = plt.figure(figsize=[figsize[0]/2.5,figsize[1]/2.5],tight_layout=True)
-
-    gs = GridSpec(1,5,figure=fig)
-    ax_a = [fig.add_subplot(gs[0,:4]),fig.add_subplot(gs[0,4])]
-
-    # Setup axis
-    ax = ax_a[0]
-    ax.set(ylim=[-ncats-0.5,-0.5],xlim=[0.5,7.5],yticks=range(-ncats,0),
-                yticklabels=reversed(ticklbls_cgm),xticks=[],xticklabels=[],
-                ylabel="CGM RoC [mg/dl/min]")
-    ax2 = ax.secondary_xaxis("top")
-    ax2.set(xlim=[0.5,7.5],xticks=range(1,8),
-            xticklabels=ticklbls_comp,xlabel="Comparator RoC [mg/dl/min]")
-
-    # Plot lines
-    yp = np.arange(-1,-ncats-1,-1)
-    xp = np.arange(1,8,1)
-    lw, col = 0.8, "black"
-    for x in xp:
-        ax.plot([x-0.5]*2,ax.get_ylim(),"-",linewidth=lw,color=col)
-    for y in yp:
-        ax.plot(ax.get_xlim(),[y+0.5]*2,"-",linewidth=lw,color=col)
-
-    # Total
-    txt_off = 0.03*(ax.get_ylim()[1]-ax.get_ylim()[0])
-    ax.text(xp[0]-1,ax.get_ylim()[0]-txt_off,"Total",va="top",ha="center")
-
-    # Plot colors and numbers in cells
-    fs2 = 8
-    off = 0.07
-    # Loop over rows
-    for i in range(ncats):
-        # Loop over columns
-        for j in range(7):
-            # Column Total
-            if i==0:
-                ax.text(xp[j],ax.get_ylim()[0]-txt_off,"{:d}".format(CMcnt[:,j].sum()),
-                            va="top",ha="center")
-            # Color
-            ax.add_patch(rect((xp[j]-0.5,yp[i]-0.5),1,1,
-                        facecolor=colors[i][j],alpha=al,edgecolor=None))
-            # Percentage number
-            f_al = 1
-            if CM[i,j] != 0:
-                ax.text(xp[j],yp[i]-off,"{:.1f}%".format(CM[i,j]),color="k",
-                        va="center",ha="center",fontsize=fs2,alpha=f_al)
-            else:
-                ax.text(xp[j],yp[i]-off,"-",
-                        va="center",ha="center",fontsize=fs2,alpha=f_al)
-
-    # Count Regions
-    Acnt, Bcnt, Ccnt, Dcnt, n = zone_count(CMcnt,ncats)
-
-    # Bar display on the right
-    ax = ax_a[1]
-    ax.axis("off")
-    ax.set(ylim=[0,100],xlim=[0,1])
-    bottom = 0
-    xp = 0.25
-    for cnt,col in zip([Acnt,Bcnt,Ccnt,Dcnt],colors2):
-        ax.bar(xp,cnt/n*100,bottom=bottom,width=0.4,color=col,alpha=al)
-        bottom = bottom + cnt/n*100
-
-    # Percentages
-    off = 0.25
-    ax.text(xp+off,Acnt/n*100/2,"A: {:.1f}%".format(Acnt/n*100),va="center")
-    ax.text(xp+off,(Acnt+Bcnt/2)/n*100,"B: {:.1f}%".format(Bcnt/n*100),va="center")
-    ax.text(xp+off,(Acnt+Bcnt+Ccnt)/n*100,"C: {:.1f}%".format(Ccnt/n*100),va="top")
-    ax.text(xp+off,100,"D: {:.1f}%".format(Dcnt/n*100),va="bottom")
-
-    # MARoC
-    ax.text(xp+off,0,"MARoC\n{:.2f}".format(maroc),va="bottom")
-
-    # Total
-    txt_off = 0.03*(ax.get_ylim()[1]-ax.get_ylim()[0])
-    ax.text(xp,ax.get_ylim()[0]-txt_off,"{:d}".format(n),va="top",ha="center")
-
+    ticklbls_comp, ticklbls_cgm, colors, colors2, al = get_params(ncats,config)
+
+    metrics = Metrics() if metrics is None else metrics
+    metrics.info.update({"tool": "CTCA", "n_datapoints": int(df.shape[0]), "ncats": int(ncats)})
+
+    with metrics.span("confusion_matrix"):
+        # Calculate Concurrence Matrix
+        maroc = df["Comp_ROC"].abs().mean()
+        CM, CMcnt = concurrence_matrix(df,ncats)
+
+    with metrics.span("plotting"):
+        #################
+        # Setup the figure
+        if fig is None:
+            fig = plt.figure(figsize=[figsize[0]/2.5,figsize[1]/2.5],tight_layout=True)
+
+        gs = gridspec.GridSpec(1,5,figure=fig)
+        ax_a = [fig.add_subplot(gs[0,:4]),fig.add_subplot(gs[0,4])]
+
+        # Setup axis
+        ax = ax_a[0]
+        ax.set(ylim=[-ncats-0.5,-0.5],xlim=[0.5,7.5],yticks=range(-ncats,0),
+                    yticklabels=reversed(ticklbls_cgm),xticks=[],xticklabels=[],
+                    ylabel="CGM RoC [mg/dl/min]")
+        ax2 = ax.secondary_xaxis("top")
+        ax2.set(xlim=[0.5,7.5],xticks=range(1,8),
+                xticklabels=ticklbls_comp,xlabel="Comparator RoC [mg/dl/min]")
+
+        # Plot lines
+        yp = np.arange(-1,-ncats-1,-1)
+        xp = np.arange(1,8,1)
+        lw, col = 0.8, "black"
+        for x in xp:
+            ax.plot([x-0.5]*2,ax.get_ylim(),"-",linewidth=lw,color=col)
+        for y in yp:
+            ax.plot(ax.get_xlim(),[y+0.5]*2,"-",linewidth=lw,color=col)
+
+        # Total
+        txt_off = 0.03*(ax.get_ylim()[1]-ax.get_ylim()[0])
+        ax.text(xp[0]-1,ax.get_ylim()[0]-txt_off,"Total",va="top",ha="center")
+
+        # Plot colors and numbers in cells
+        fs2 = config.fontsize
+        off = 0.07
+        # Loop over rows
+        for i in range(ncats):
+            # Loop over columns
+            for j in range(7):
+                # Column Total
+                if i==0:
+                    ax.text(xp[j],ax.get_ylim()[0]-txt_off,"{:d}".format(CMcnt[:,j].sum()),
+                                va="top",ha="center")
+                # Color
+                ax.add_patch(patches.Rectangle((xp[j]-0.5,yp[i]-0.5),1,1,
+                            facecolor=colors[i][j],alpha=al,edgecolor=None))
+                # Percentage number
+                f_al = 1
+                if CM[i,j] != 0:
+                    ax.text(xp[j],yp[i]-off,"{:.1f}%".format(CM[i,j]),color="k",
+                            va="center",ha="center",fontsize=fs2,alpha=f_al)
+                else:
+                    ax.text(xp[j],yp[i]-off,"-",
+                            va="center",ha="center",fontsize=fs2,alpha=f_al)
+
+        # Count Regions
+        with metrics.span("zone_count"):
+            Acnt, Bcnt, Ccnt, Dcnt, n = zone_count(CMcnt,ncats)
+
+        # Bar display on the right
+        ax = ax_a[1]
+        ax.axis("off")
+        ax.set(ylim=[0,100],xlim=[0,1])
+        bottom = 0
+        xp = 0.25
+        for cnt,col in zip([Acnt,Bcnt,Ccnt,Dcnt],colors2):
+            ax.bar(xp,cnt/n*100,bottom=bottom,width=0.4,color=col,alpha=al)
+            bottom = bottom + cnt/n*100
+
+        # Percentages
+        off = 0.25
+        ax.text(xp+off,Acnt/n*100/2,"A: {:.1f}%".format(Acnt/n*100),va="center")
+        ax.text(xp+off,(Acnt+Bcnt/2)/n*100,"B: {:.1f}%".format(Bcnt/n*100),va="center")
+        ax.text(xp+off,(Acnt+Bcnt+Ccnt)/n*100,"C: {:.1f}%".format(Ccnt/n*100),va="top")
+        ax.text(xp+off,100,"D: {:.1f}%".format(Dcnt/n*100),va="bottom")
+
+        # MARoC
+        ax.text(xp+off,0,"MARoC\n{:.2f}".format(maroc),va="bottom")
+
+        # Total
+        txt_off = 0.03*(ax.get_ylim()[1]-ax.get_ylim()[0])
+        ax.text(xp,ax.get_ylim()[0]-txt_off,"{:d}".format(n),va="top",ha="center")
 
     if save_fig:
-        plt.savefig(save_path+filename+".png",dpi=600)
+        with metrics.span("saving"):
+            fig.savefig(save_path+filename+".png",dpi=600)
 
     if show_fig:
         plt.show()
 
+    return fig
+
@@ -0,0 +1,199 @@
+"""
+Helpers shared by the CGM performance assessment tools (CG_DIVA, CI_calculation, DGR_plot and CTCA)
+
+The tools add this folder to the module search path and import the helpers from here, e.g.
+from CGM_common import LazyImport, JIT, set_backend, Metrics
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import time
+import json
+import contextlib
+import warnings
+import importlib
+
+
+class LazyImport:
+    """
+    Module that is imported on first attribute access, e.g. sts = LazyImport("scipy.stats")
+    Heavy packages (scipy, matplotlib) are thereby only loaded when a statistic or figure is calculated
+
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+class JIT:
+    """
+    Loop kernel that is compiled with numba on first use, e.g. kernel = JIT(loop_function)
+    The kernels are only used if numba can be imported and is selected (see set_backend), otherwise the
+    calling function uses its NumPy implementation. Both implementations give identical results
+    If the compilation or the call of a kernel fails, the backend is switched to "numpy" with a warning and
+    the kernel returns None, so that the calling function uses its NumPy implementation
+
+    """
+
+    backend = "auto"
+    installed = None
+    error = None
+
+    def __init__(self, func):
+        self.func = func
+        self.compiled = None
+
+    @classmethod
+    def available(cls):
+        """
+        Check once whether numba can be imported (an installed numba that fails to import, e.g. because of
+        an incompatible NumPy version, counts as not installed)
+
+        """
+        if cls.installed is None:
+            try:
+                importlib.import_module("numba")
+                cls.installed = True
+            except Exception as e:
+                cls.installed, cls.error = False, e
+                if not(isinstance(e,ModuleNotFoundError) and e.name == "numba"):
+                    warnings.warn("numba cannot be imported ("+repr(e)+"), using the NumPy implementation")
+        return cls.installed
+
+    @classmethod
+    def active(cls):
+        return cls.backend != "numpy" and cls.available()
+
+    def __call__(self, *args):
+        try:
+            if self.compiled is None:
+                self.compiled = importlib.import_module("numba").njit(cache=True,nogil=True)(self.func)
+            return self.compiled(*args)
+        except Exception as e:
+            JIT.backend = "numpy"
+            warnings.warn("numba kernel "+self.func.__name__+" failed ("+repr(e)+"), using the NumPy implementation")
+            return None
+
+
+def set_backend(backend="auto"):
+    """
+    Select the implementation of the inner kernels of all tools (weighted_quantile and BCa of CG_DIVA and
+    CI_calculation, region_cnt of DGR_plot). The backend is shared, set_backend of any tool selects it for all
+
+    Input:
+    backend:    "auto" (numba if it can be imported), "numba" or "numpy"
+
+    """
+
+    if not(backend in ["auto","numba","numpy"]):
+        raise ValueError("Unknown backend "+str(backend))
+    if backend == "numba" and not(JIT.available()):
+        raise ImportError("numba cannot be imported ("+repr(JIT.error)+")")
+    JIT.backend = backend
+
+
+class Metrics:
+    """
+    Recording of processing times of the processing stages (spans) of a run
+
+    Input:
+    mode:       None: processing times only
+                "memory": additionally peak memory of each stage (tracemalloc)
+                "profile": additionally cProfile statistics of the whole run
+
+    Usage:
+    metrics = Metrics(mode="memory")
+    with metrics.span("bootstrap"):
+        ...
+    metrics.to_dict() / metrics.log(file)
+
+    Nested spans are recorded separately, times of nested stages are included in the parent stage.
+    Repeated spans with the same name are accumulated.
+    In mode "memory", tracemalloc is started and stopped again only if it is not already tracing. If the caller traces
+    memory itself, each span resets its peak (tracemalloc.reset_peak()).
+
+    """
+
+    def __init__(self, mode=None):
+        if mode not in [None,"memory","profile"]:
+            raise ValueError("mode must be None, 'memory' or 'profile'")
+        self.mode = mode
+        self.stages = {}
+        self.info = {}
+        self.profiler = None
+        self._stack = []
+        self._tracing = False           # True if tracemalloc was started by this object
+
+    @contextlib.contextmanager
+    def span(self, name):
+        if self.mode == "memory":
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracing = True
+            if self._stack:     # Keep peak of parent stage before resetting
+                self._stack[-1] = max(self._stack[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if self.mode == "profile" and not self._stack:
+            import cProfile
+            self.profiler = cProfile.Profile() if self.profiler is None else self.profiler
+            self.profiler.enable()
+        self._stack.append(0)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            dt = time.perf_counter() - start
+            peak = self._stack.pop()
+            st = self.stages.setdefault(name, {"time": 0.0, "calls": 0})
+            st["time"] += dt
+            st["calls"] += 1
+            if self.mode == "memory":
+                import tracemalloc
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                st["peak_MB"] = max(st.get("peak_MB",0), peak/1e6)
+                if self._stack:
+                    self._stack[-1] = max(self._stack[-1], peak)
+                elif self._tracing:
+                    tracemalloc.stop()
+                    self._tracing = False
+            if self.mode == "profile" and not self._stack:
+                self.profiler.disable()
+
+    def to_dict(self, n_profile=20):
+        """
+        Metrics as dict with stages and info (and the n_profile functions with largest cumulative time)
+
+        """
+        res = {"stages": self.stages, "info": self.info}
+        if self.profiler is not None:
+            import pstats
+            stats = pstats.Stats(self.profiler)
+            res["profile"] = [{"function": "{}:{}({})".format(*f), "calls": s[1], "tottime": s[2], "cumtime": s[3]}
+                              for f, s in sorted(stats.stats.items(), key=lambda x: -x[1][3])[:n_profile]]
+        return res
+
+    def log(self, file=None):
+        """
+        Write metrics as one json line to file (appended) or stdout if file is None
+
+        """
+        line = json.dumps(self.to_dict(), default=str)
+        if file is None:
+            print(line)
+        else:
+            with open(file,"a") as f:
+                f.write(line+"\n")
+        return line
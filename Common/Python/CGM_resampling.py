@@ -0,0 +1,439 @@
+"""
+Resampling and statistics helpers shared by CG_DIVA and CI_calculation
+
+Clustered bootstrap samples (counts of the sensors in each sample), random number generators of a run,
+bootstrap shards, jackknife influence of the sensors and exact quantiles of bootstrap samples that are
+generated in batches. The tools import the helpers from here (see Common/README.md).
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+def cluster_index(df,two_stage=False):
+    """
+    Sensor code of each datapoint and (for two-stage resampling) the sensors of each patient
+
+    Input:
+    df:         Dataframe with column "SensorID" (and "PatientID" for two-stage resampling)
+    two_stage:  True/False whether patients and then sensors within patients are resampled
+
+    Output:
+    code:       Numpy array with the index of the sensor of each datapoint (in sorted list of sensors)
+    n_sens:     Number of sensors
+    groups:     List of numpy arrays with the sensor indices of each patient (None if not two_stage)
+
+    """
+
+    sens = df["SensorID"].unique()
+    sens.sort()
+    code = pd.Categorical(df["SensorID"],categories=sens).codes.astype(np.int64)
+
+    groups = None
+    if two_stage:
+        pat = df.groupby("SensorID")["PatientID"].agg(["first","nunique"]).reindex(sens)
+        if (pat["nunique"] > 1).any():
+            raise ValueError("Sensors must belong to a single patient (PatientID)")
+        groups = [np.flatnonzero(pat["first"].to_numpy() == p) for p in pd.unique(pat["first"])]
+
+    return code, len(sens), groups
+
+
+def random_integers(rng,high,size=None):
+    """
+    Random integers from 0 to high-1 of a numpy Generator (integers) or RandomState (randint)
+    """
+
+    return rng.integers(0,high,size=size) if hasattr(rng,"integers") else rng.randint(0,high,size=size)
+
+
+def cluster_counts(N,n_sens,groups=None,P=None,rng=None):
+    """
+    Number of times each sensor is contained in N clustered bootstrap samples
+    Random numbers are drawn from rng (global numpy random state if None). Sensors are drawn in the same
+    way as with np.random.choice(sens,size=len(sens),replace=True) for each sample.
+    For two-stage resampling, patients are drawn with replacement and then the same number of sensors
+    as the patient has with replacement from the sensors of each drawn patient.
+
+    Input:
+    N:          Number of bootstrap samples
+    n_sens:     Number of sensors
+    groups:     List of sensor indices of each patient for two-stage resampling (optional)
+    P:          Numpy array (N x n_sens or N x n_patients) of the sensors (patients) of the first stage,
+                e.g. of a balanced bootstrap (optional, drawn with replacement if None)
+    rng:        Numpy random Generator or RandomState (optional)
+
+    Output:
+    C:          Numpy array (N x n_sens) of counts
+
+    """
+
+    rng = np.random if rng is None else rng
+    if groups is None:
+        idx = random_integers(rng,n_sens,size=(N,n_sens)) if P is None else P
+        idx = idx + n_sens*np.arange(N)[:,None]
+        return np.bincount(idx.ravel(),minlength=N*n_sens).reshape(N,n_sens)
+
+    m = np.array([len(g) for g in groups])
+    start = np.cumsum(m) - m
+    order = np.concatenate(groups)
+    C = np.zeros((N,n_sens),dtype=np.int64)
+    for i in range(N):
+        Pi = random_integers(rng,len(groups),size=len(groups)) if P is None else P[i]
+        p = np.repeat(Pi,m[Pi])
+        C[i,:] = np.bincount(order[start[p] + random_integers(rng,m[p])],minlength=n_sens)
+
+    return C
+
+
+def balanced_batch(left,b,rng):
+    """
+    Next b samples of a balanced bootstrap, i.e. the next b rows of a random permutation of the remaining
+    copies of the sensors (patients), without creating the permutation of all copies
+    The copies contained in the b rows are drawn without replacement from the remaining copies
+    (multivariate hypergeometric, drawn sensor by sensor) and permuted. For the last rows all remaining
+    copies are used, the copies are then ordered as np.tile(np.arange(n),b) before permuting
+
+    Input:
+    left:       Numpy array (n) of the number of remaining copies of each sensor, updated in place
+    b:          Number of samples
+    rng:        Numpy random Generator or RandomState
+
+    Output:
+    P:          Numpy array (b x n) of the sensors of the samples
+
+    """
+
+    n = len(left)
+    cnt = left.copy()
+    if b*n < np.sum(left):
+        need, rest = b*n, np.sum(left)
+        for j in range(n-1):
+            rest -= left[j]
+            cnt[j] = rng.hypergeometric(left[j],rest,need) if need > 0 and left[j] > 0 else 0
+            need -= cnt[j]
+        cnt[n-1] = need
+    left -= cnt
+
+    # Copies ordered by copy number and sensor (as np.tile for equal numbers of copies)
+    sens = np.repeat(np.arange(n),cnt)
+    k = np.arange(len(sens)) - np.repeat(np.cumsum(cnt)-cnt,cnt)
+    sens = sens[np.argsort(k*n + sens,kind="stable")]
+
+    return rng.permutation(sens).reshape(b,n)
+
+
+def cluster_samples(N,n_sens,groups=None,batch=None,scheme="iid",score=None,rng=None):
+    """
+    Batches of clustered bootstrap samples (as counts of each sensor, see cluster_counts)
+
+    Resampling schemes:
+    "iid":          Sensors (patients) are drawn independently with replacement
+    "balanced":     Balanced bootstrap, each sensor (patient for two-stage resampling) is contained
+                    exactly N times in all N samples (Davison AC, Hinkley DV, Schechtman E. Efficient
+                    bootstrap simulation. Biometrika. 1986;73(3):555-566). The random permutation of the
+                    N copies is generated batch by batch (see balanced_batch), a single batch gives the same
+                    samples as a permutation of all copies at once
+    "antithetic":   Antithetic resampling, each sample is paired with a sample in which every drawn sensor
+                    is replaced by the sensor of opposite rank of score (Hall P. Antithetic resampling for
+                    the bootstrap. Biometrika. 1989;76(4):713-724)
+
+    Input:
+    N:          Number of bootstrap samples
+    n_sens:     Number of sensors
+    groups:     List of sensor indices of each patient for two-stage resampling (optional)
+    batch:      Number of bootstrap samples per batch (default: N)
+    scheme:     Resampling scheme ("iid", "balanced" or "antithetic")
+    score:      Numpy array with a summary statistic of each sensor for ranking (antithetic resampling)
+    rng:        Numpy random Generator or RandomState (global numpy random state if None)
+
+    Output:
+    Generator of (index of first sample of the batch, counts of the batch)
+
+    """
+
+    rng = np.random if rng is None else rng
+    batch = N if batch is None else batch
+    if scheme == "iid":
+        for i in range(0,N,batch):
+            yield i, cluster_counts(min(batch,N-i),n_sens,groups,rng=rng)
+
+    elif scheme == "balanced":
+        # Random permutation of N copies of all sensors (patients), split into N samples
+        # Only the part of the permutation of the current batch is created (memory independent of N)
+        n = n_sens if groups is None else len(groups)
+        left = np.full(n,N,dtype=np.int64)
+        for i in range(0,N,batch):
+            P = balanced_batch(left,min(batch,N-i),rng)
+            yield i, cluster_counts(P.shape[0],n_sens,groups,P=P,rng=rng)
+
+    elif scheme == "antithetic":
+        if groups is not None:
+            raise ValueError("Antithetic resampling is not available for two-stage resampling")
+        # Samples of ranks and their antithetic samples in alternating rows
+        rank = np.argsort(score,kind="stable")
+        batch = batch + batch%2
+        for i in range(0,N,batch):
+            U = random_integers(rng,n_sens,size=((min(batch,N-i)+1)//2,n_sens))
+            R = np.stack([U,n_sens-1-U],axis=1).reshape(-1,n_sens)[:min(batch,N-i)]
+            yield i, cluster_counts(R.shape[0],n_sens,P=rank[R])
+
+    else:
+        raise ValueError("Unknown resampling scheme "+str(scheme))
+
+
+def random_state(seed):
+    """
+    Random number generator of a single run (the global numpy random state is not used)
+    A seed gives the same random numbers as the global random state after np.random.seed(seed), without
+    seed ([] or None) the generator is initialized randomly
+
+    """
+
+    return np.random.RandomState(seed) if seed else np.random.RandomState()
+
+
+def shard_seed(seed,shard,n_shards):
+    """
+    Seed of a bootstrap shard
+    A single shard uses the seed itself (identical to the bootstrap without shards), otherwise the
+    seeds of the shards are derived from seed with numpy's SeedSequence
+
+    """
+
+    if n_shards == 1:
+        return seed
+    return np.random.SeedSequence(seed).spawn(n_shards)[shard].generate_state(4)
+
+
+def data_hash(df):
+    """
+    Hash of the input data (columns "SensorID", "Comp", "CGM" and "PatientID" if available) for validating shards
+
+    """
+
+    cols = ["SensorID","Comp","CGM"] + ["PatientID"]*("PatientID" in df.columns)
+    return hashlib.sha256(pd.util.hash_pandas_object(df[cols],index=False).to_numpy().tobytes()).hexdigest()
+
+
+def merge_shards(files,tool,df_hash):
+    """
+    Load and validate a set of shard files and concatenate their bootstrap samples
+
+    Input:
+    files:      List of shard files
+    tool:       Tool that created the shards
+    df_hash:    Hash of the input data (see data_hash)
+
+    Output:
+    BS:         Numpy array of bootstrap samples of all shards (in order of the shards)
+    meta:       Dict with meta information of the first shard
+
+    """
+
+    shards = []
+    for file in files:
+        with np.load(file) as f:
+            meta = json.loads(str(f["meta"]))
+            BS = f["BS"]
+        if meta["tool"] != tool:
+            raise ValueError(str(file)+" is not a shard of "+tool)
+        if meta["data_hash"] != df_hash:
+            raise ValueError(str(file)+" was computed from different input data")
+        if BS.shape[-1] != meta["N"]:
+            raise ValueError(str(file)+" contains "+str(BS.shape[-1])+" instead of "+str(meta["N"])+" bootstrap samples")
+        shards.append((meta,BS))
+
+    if not(shards):
+        raise ValueError("No shard files provided")
+    ref = shards[0][0]
+    for meta, _ in shards:
+        for key in ["n_shards","N_BS","seed","two_stage"]:
+            if meta[key] != ref[key]:
+                raise ValueError("Shards differ in "+key)
+    found = sorted(meta["shard"] for meta, _ in shards)
+    if found != list(range(ref["n_shards"])):
+        raise ValueError("Incomplete or duplicate shards: found "+str(found)+" of "+str(ref["n_shards"]))
+
+    BS = np.concatenate([BS for _, BS in sorted(shards,key=lambda x: x[0]["shard"])],axis=-1)
+
+    return BS, ref
+
+
+def influence_table(u,theta,clus,names,ranges,col="SensorID",z_crit=3):
+    """
+    Influence of each sensor (or patient) on the estimates from the jackknife estimates leaving out one
+    sensor at a time (calculated anyway for the acceleration of BCa, no reruns of the analysis)
+    Sensors are flagged if their standardized influence (influence divided by the standard deviation of the
+    influences of all sensors) exceeds z_crit
+
+    Input:
+    u:          List (one per range) of numpy arrays (n_clusters x n_estimates) of jackknife estimates
+    theta:      List of numpy arrays (n_estimates) of the estimates of the complete data
+    clus:       List of arrays of sorted cluster IDs (rows of u)
+    names:      List of lists of names of the estimates
+    ranges:     List of names of the ranges
+    col:        Name of the cluster column ("SensorID" or "PatientID")
+    z_crit:     Limit of the absolute standardized influence for flagging
+
+    Output:
+    inf:        Pandas dataframe with one row per range, estimate and cluster and columns "Range", "Estimate",
+                col, "Value" (complete data), "Jackknife" (without cluster), "Shift" (Jackknife - Value),
+                "Influence" (jackknife influence (n-1)*(mean - Jackknife)), "Z" (standardized influence) and "Flag"
+
+    """
+
+    tabs = []
+    for r in range(len(u)):
+        n, m = u[r].shape
+        infl = (n-1)*(np.mean(u[r],axis=0)-u[r])
+        with np.errstate(divide="ignore",invalid="ignore"):
+            z = infl / np.sqrt(np.sum(infl**2,axis=0)/(n-1))
+        z[infl == 0] = 0
+        tabs.append(pd.DataFrame({"Range": ranges[r], "Estimate": np.tile(names[r][:m],n),
+                                  col: np.repeat(clus[r],m), "Value": np.tile(theta[r],n),
+                                  "Jackknife": u[r].ravel(), "Shift": (u[r]-theta[r]).ravel(),
+                                  "Influence": infl.ravel(), "Z": z.ravel()}))
+    inf = pd.concat(tabs,ignore_index=True)
+    inf["Flag"] = inf["Z"].abs() > z_crit
+
+    return inf
+
+
+def stream_summary(replay,theta_h,bins=1024):
+    """
+    First pass over bootstrap samples that are generated in batches (without keeping them):
+    number of samples, NaNs, minimum, maximum, samples below theta_h and a histogram of each row
+    The bin edges are quantiles of the first batch, so that each bin contains about N/bins samples
+
+    Input:
+    replay:     Function returning a new generator of the same batches of bootstrap samples
+                (numpy arrays M x batch size)
+    theta_h:    Numpy array (M) of estimators of the original sample
+    bins:       Number of histogram bins
+
+    Output:
+    summ:       Dict with numpy arrays "n", "nan", "lo", "hi", "below" (M) and lists "edges", "cnt",
+                "bmin", "bmax" (histogram edges, counts, minimum and maximum of each bin of each row)
+
+    """
+
+    M = len(theta_h)
+    summ = {"n": np.zeros(M,dtype=np.int64), "nan": np.zeros(M,dtype=np.int64), "below": np.zeros(M,dtype=np.int64),
+            "lo": np.full(M,np.inf), "hi": np.full(M,-np.inf), "edges": [None]*M, "cnt": [None]*M,
+            "bmin": [None]*M, "bmax": [None]*M}
+    for X in replay():
+        for m in range(M):
+            x = X[m][~np.isnan(X[m])]
+            summ["nan"][m] += len(X[m]) - len(x)
+            if len(x) == 0:
+                continue
+            summ["n"][m] += len(x)
+            summ["below"][m] += np.sum((x < theta_h[m])*1)
+            summ["lo"][m] = min(summ["lo"][m],np.min(x))
+            summ["hi"][m] = max(summ["hi"][m],np.max(x))
+            if summ["edges"][m] is None:
+                summ["edges"][m] = np.unique(np.quantile(x,np.linspace(0,1,bins+1)[1:-1]))
+                nb = len(summ["edges"][m]) + 1
+                summ["cnt"][m], summ["bmin"][m], summ["bmax"][m] = np.zeros(nb,dtype=np.int64), np.full(nb,np.inf), np.full(nb,-np.inf)
+            histogram(x,summ["edges"][m],summ["cnt"][m],summ["bmin"][m],summ["bmax"][m])
+
+    return summ
+
+
+def histogram(x,edges,cnt,bmin,bmax):
+    """
+    Add values to the counts, minima and maxima of histogram bins [edges[j-1],edges[j]) (in place)
+
+    """
+
+    j = np.searchsorted(edges,x,side="right")
+    cnt += np.bincount(j,minlength=len(cnt))
+    np.minimum.at(bmin,j,x)
+    np.maximum.at(bmax,j,x)
+
+
+def stream_quantiles(replay,summ,q,bins=1024,cap=2**16):
+    """
+    Exact quantiles (linear interpolation, identical to np.quantile) of each row of bootstrap samples that
+    are generated in batches, without keeping the samples
+    The order statistics required for each quantile are bracketed by a histogram bin (see stream_summary).
+    Further passes over the bootstrap samples collect the samples within the bracket if they are at most
+    cap, otherwise the bracket is divided into bins again (mostly a single further pass)
+
+    Input:
+    replay:     Function returning a new generator of the same batches of bootstrap samples (see stream_summary)
+    summ:       Results of stream_summary
+    q:          Numpy array (M) of quantiles (0 to 1) of each row, NaN if not required
+    bins:       Number of histogram bins
+    cap:        Maximum number of samples collected for a single order statistic
+
+    Output:
+    res:        Numpy array (M) of quantiles
+
+    """
+
+    def bracket(t,edges,cnt,bmin,bmax,lo,hi):
+        # Bin of the order statistic, resolved if all samples in the bin are identical
+        cum = np.cumsum(cnt)
+        j = int(np.searchsorted(cum,t["k"]-t["below"],side="right"))
+        t["below"] += int(cum[j-1]) if j > 0 else 0
+        t["lo"] = edges[j-1] if j > 0 else lo
+        t["hi"] = edges[j] if j < len(edges) else hi
+        if bmin[j] == bmax[j]:
+            t["value"] = bmin[j]
+        elif cnt[j] <= cap:
+            t["vals"] = []
+        else:
+            t["vals"] = None
+            t["edges"] = np.unique(np.linspace(bmin[j],bmax[j],bins+1)[1:-1])
+            nb = len(t["edges"]) + 1
+            t["cnt"], t["bmin"], t["bmax"] = np.zeros(nb,dtype=np.int64), np.full(nb,np.inf), np.full(nb,-np.inf)
+
+    # Order statistics (previous and next index) and interpolation as in numpy
+    n = summ["n"]
+    vi = (n-1)*q
+    prev = np.floor(vi)
+    gamma = vi - prev
+    targets = []
+    for m in np.flatnonzero(~np.isnan(q) & (n > 0)):
+        for k in [min(int(prev[m]),n[m]-1),min(int(prev[m])+1,n[m]-1)]:
+            t = {"m": m, "k": k, "below": 0, "value": None}
+            bracket(t,summ["edges"][m],summ["cnt"][m],summ["bmin"][m],summ["bmax"][m],-np.inf,np.inf)
+            targets.append(t)
+
+    # Passes over the bootstrap samples until all order statistics are resolved
+    open_ = [t for t in targets if t["value"] is None]
+    while open_:
+        for X in replay():
+            for t in open_:
+                x = X[t["m"]]
+                x = x[(x >= t["lo"]) & (x < t["hi"])]
+                if t["vals"] is not None:
+                    t["vals"].append(x)
+                else:
+                    histogram(x,t["edges"],t["cnt"],t["bmin"],t["bmax"])
+        for t in open_:
+            if t["vals"] is not None:
+                t["value"] = np.sort(np.concatenate(t["vals"]))[t["k"]-t["below"]]
+            else:
+                bracket(t,t["edges"],t["cnt"],t["bmin"],t["bmax"],t["lo"],t["hi"])
+        open_ = [t for t in targets if t["value"] is None]
+
+    res = np.full(len(q),np.nan)
+    for i in range(0,len(targets),2):
+        m, a, b = targets[i]["m"], targets[i]["value"], targets[i+1]["value"]
+        diff = b - a
+        res[m] = b - diff*(1-gamma[m]) if gamma[m] >= 0.5 else a + diff*gamma[m]
+
+    return res
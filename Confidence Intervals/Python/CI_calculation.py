@@ -12,9 +12,25 @@ This is a free software and comes with ABSOLUTELY NO WARRANTY
 
 import pandas as pd
 import numpy as np
-import scipy.stats as sts
 import os
+import sys
 import warnings
+import time
+import json
+import hashlib
+import copy
+from dataclasses import dataclass, field
+
+# Helpers shared by all tools (folder Common of the repository)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),"Common","Python"))
+from CGM_common import LazyImport, JIT, set_backend, Metrics
+from CGM_resampling import (cluster_index, random_integers, cluster_counts, cluster_samples, random_state,
+                            shard_seed, data_hash, merge_shards, influence_table, stream_summary, histogram,
+                            stream_quantiles)
+
+# Heavy packages are loaded on first use
+sts = LazyImport("scipy.stats")
+
 
 def CI_Clopper_Pearson(RES, df, alpha=0.05):
 
@@ -46,6 +62,65 @@ def CI_Clopper_Pearson(RES, df, alpha=0.05):
     return RES
 
 
+def WilsonCC(x, m, alpha=0.05, warn=True):
+    """
+    Continuity corrected Wilson interval for clustered binary data according to
+    Short et al. "A novel confidence interval for a single proportion in the presence of clustered binary outcome data"
+    Statistical Methods in Medical Research 2020, Vol. 29(1) 111-121
+
+    The calculation is vectorized along all but the last axis, i.e. several datasets
+    with the same number of clusters can be evaluated at once.
+
+    Input:
+    x:          Numpy array of hits per cluster (sensor), clusters along the last axis
+    m:          Numpy array of number of datapoints per cluster, same shape as x
+    alpha:      Significance level of lower one-sided confidence interval
+    warn:       True/False whether to warn if ICC is set to 0 due to negative correlation
+
+    Output:
+    WCC_CI:     Lower one-sided confidence interval (0 to 1)
+    rhoh:       Estimated intra-cluster correlation (ICC)
+
+    """
+
+    x = np.asarray(x, dtype=float)
+    m = np.asarray(m, dtype=float)
+
+    n = x.shape[-1]
+    M1 = np.sum(m, axis=-1)
+    M2 = np.sum(m**2, axis=-1)
+
+    # Estimated AR
+    pih = np.sum(x, axis=-1) / M1
+
+    # Between cluster mean square
+    BMS = (np.sum(x**2/m, axis=-1) - np.sum(x, axis=-1)**2 / M1) / (n - 1)
+
+    # Within cluster mean square
+    WMS = (np.sum(x, axis=-1) - np.sum(x**2/m, axis=-1)) / np.sum(m-1, axis=-1)
+
+    # n*
+    n_star = (M1**2 - M2) / ((n-1)*M1)
+
+    # ICC
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rhoh = (BMS - WMS) / (BMS + (n_star - 1) * WMS)
+    neg = (BMS-WMS < 0) & (pih != 0) & (pih != 1)
+    if warn and np.any(neg):
+        warnings.warn("ICC set to 0 due to negative correlation during Wilson interval calculation")
+    rhoh = np.where(neg, 0, rhoh)
+    rhoh = np.where((pih == 0) | (pih == 1), 1, rhoh)[()]
+
+    # VIF
+    xih = 1 + rhoh * (M2 - M1) / M1
+
+    # WCC (lower one-sided confidence interval)
+    z_a = sts.norm.ppf(1-alpha)
+    WCC_CI = (2 * M1 * pih + xih * z_a**2 - 1 - np.sqrt(xih) * z_a * np.sqrt(xih * z_a**2 - 2 - 1 / M1 + 4 * pih * (M1 * (1 - pih) + 1))) / (2 * (M1 + xih * z_a**2))
+
+    return WCC_CI, rhoh
+
+
 def CI_WilsonCC(RES, df, alpha=0.05):
 
     # Calculate continuity corrected Wilson interval according to 
@@ -64,39 +139,8 @@ def CI_WilsonCC(RES, df, alpha=0.05):
             
             m = statr["count"].to_numpy()
             x = statr["sum"].to_numpy()            
-      
-            n = statr["SensorID"].nunique()
-            M1 = np.sum(m)
-            M2 = np.sum(m**2)
-            
-            # Estimated AR
-            pih = np.sum(x) / M1
-            
-            # Between cluster mean square
-            BMS = (np.sum(x**2/m) - np.sum(x)**2 / M1) / (n - 1)
-            
-            # Within cluster mean square
-            WMS = (np.sum(x) - np.sum(x**2/m)) / np.sum(m-1)
-            
-            # n*
-            n_star = (M1**2 - M2) / ((n-1)*M1)
-            
-            # ICC
-            if pih == 0 or pih == 1:
-                rhoh = 1
-            else:
-                if BMS-WMS < 0:
-                    rhoh = 0
-                    warnings.warn("ICC set to 0 due to negative correlation during Wilson interval calculation")
-                else:
-                    rhoh = (BMS - WMS) / (BMS + (n_star - 1) * WMS)           
-            
-            # VIF
-            xih = 1 + rhoh * (M2 - M1) / M1
-            
-            # WCC (lower one-sided confidence interval)
-            z_a = sts.norm.ppf(1-alpha)
-            WCC_CI = (2 * M1 * pih + xih * z_a**2 - 1 - np.sqrt(xih) * z_a * np.sqrt(xih * z_a**2 - 2 - 1 / M1 + 4 * pih * (M1 * (1 - pih) + 1))) / (2 * (M1 + xih * z_a**2))
+
+            WCC_CI, rhoh = WilsonCC(x, m, alpha=alpha)
             
             # Collect Results
             RES.at[r,"WCC_CI"+WI[2:4]] = WCC_CI*100
@@ -105,9 +149,229 @@ def CI_WilsonCC(RES, df, alpha=0.05):
     return RES
 
 
-def CI_Bootstrapping(RES, df, alpha=0.05, N_BS=10000, seed=1):
+def sensor_stats(df, code, n_sens, limits=[15,20,40]):
+    """
+    Number of datapoints and hits of each sensor in each range
+    The hits of all limits are counted in one pass: the absolute deviations are sorted once and the
+    limits are located with searchsorted, a datapoint is within all limits located behind its position
+
+    Input:
+    df:         Processed dataframe (see data_processing)
+    code:       Numpy array with the index of the sensor of each datapoint (see cluster_index)
+    n_sens:     Number of sensors
+    limits:     List of limits (mg/dL or %)
+
+    Output:
+    stats:      Numpy array (n_sens x 4+4*len(limits)), Columns: Ranges (counts), Ranges x Limits (hits)
+
+    """
+
+    L = len(limits)
+    grp = code*4 + df["Range"].to_numpy().astype(np.int64) - 1
+    stats = np.zeros((n_sens, 4 + 4*L))
+    stats[:, :4] = np.bincount(grp, minlength=4*n_sens).reshape(n_sens, 4)
+
+    # Position of each limit in the sorted absolute deviations, number of limits below each datapoint
+    absd = np.abs(df["Diff"].to_numpy(dtype=float))
+    order = np.argsort(absd, kind="stable")
+    lim = np.argsort(limits, kind="stable")
+    k = np.searchsorted(absd[order], np.asarray(limits, dtype=float)[lim], side="right")
+    b = np.searchsorted(k, np.arange(len(absd)), side="right")
+
+    # Hits of each sensor, range and (sorted) limit
+    hits = np.bincount(grp[order]*(L+1) + b, minlength=4*n_sens*(L+1)).reshape(n_sens, 4, L+1).cumsum(axis=2)
+    stats[:, 4:] = hits[:, :, np.argsort(lim)].reshape(n_sens, 4*L)
+
+    return stats
+
+
+def bootstrap_AR(df, N_BS, metrics=None, two_stage=False, batch=None, limits=[15,20,40], scheme="iid", rng=None):
+    """
+    Clustered bootstrap (with respect to the sensors) of the agreement rates
+    Random numbers are drawn from rng (global numpy random state seeded by the caller if None)
+    The agreement rates of a bootstrap sample are calculated from the number of datapoints and hits of
+    each sensor and the number of times each sensor is drawn
+
+    Input:
+    df:         Processed dataframe (see data_processing) or list of processed dataframes of several devices
+                with the same sensors (paired comparison), all devices are evaluated on the same bootstrap samples
+    N_BS:       Number of bootstrap samples
+    metrics:    Metrics object (optional)
+    two_stage:  True/False whether patients (column "PatientID") and then sensors within patients are resampled
+    batch:      Number of bootstrap samples processed at once (default: depending on number of sensors)
+    limits:     List of limits (mg/dL or %)
+    scheme:     Resampling scheme ("iid", "balanced" or "antithetic", see cluster_samples),
+                sensors are ranked by their share of datapoints within the limits for antithetic resampling
+    rng:        Numpy random Generator or RandomState (optional)
+
+    Output:
+    BS_AR:      Numpy array (4x3xN_BS) of bootstrap samples
+                Rows: Ranges, Columns: AR15, AR20, AR40 (ARs of limits), Depth: bootstrap samples
+                For a list of dataframes: Numpy array (n_devices x 4x3xN_BS)
+
+    """
+
+    dfs = [df] if isinstance(df, pd.DataFrame) else list(df)
+
+    # Number of datapoints and hits of each sensor in each range (of each device)
+    # Columns: Ranges (counts), Ranges x Limits (hits)
+    code, n_sens, groups = cluster_index(dfs[0], two_stage=two_stage)
+    stats = np.hstack([sensor_stats(d, code, n_sens, limits) for d in dfs])
+    BS_AR = bootstrap_stats(stats, N_BS, L=len(limits), groups=groups, metrics=metrics, batch=batch, scheme=scheme,
+                            rng=rng)
+
+    return BS_AR[0] if isinstance(df, pd.DataFrame) else BS_AR
+
+
+def bootstrap_stats(stats, N_BS, L=3, groups=None, metrics=None, batch=None, scheme="iid", rng=None):
+    """
+    Clustered bootstrap (with respect to the sensors) of the agreement rates from the number of datapoints
+    and hits of each sensor (see sensor_stats)
+    Random numbers are drawn from rng (global numpy random state seeded by the caller if None)
+
+    Input:
+    stats:      Numpy array (n_sens x n_devices*(4+4L)) of number of datapoints and hits of each sensor
+                (several devices side by side)
+    N_BS:       Number of bootstrap samples
+    L:          Number of limits
+    groups:     List of sensor indices of each patient for two-stage resampling (optional, see cluster_index)
+    metrics:    Metrics object (optional)
+    batch:      Number of bootstrap samples processed at once (default: depending on number of sensors)
+    scheme:     Resampling scheme ("iid", "balanced" or "antithetic", see cluster_samples),
+                sensors are ranked by their share of datapoints within the limits for antithetic resampling
+    rng:        Numpy random Generator or RandomState (optional)
+
+    Output:
+    BS_AR:      Numpy array (n_devices x 4xLxN_BS) of bootstrap samples
+
+    """
+
+    metrics = Metrics() if metrics is None else metrics
+    n_dev = stats.shape[1] // (4+4*L)
+
+    # Empty Matrices containing bootstrap samples
+    # Devices, Rows: Ranges, Columns: AR15,AR20,AR40, Depth: bootstrap samples 
+    BS_AR = np.zeros((n_dev,4,L,N_BS))
+
+    print("Bootstrapping (N = "+str(N_BS)+") ... ")
+    with metrics.span("bootstrap"):
+        # Loop over batches of clustered-bootstrap samples
+        for i, BS in bootstrap_stats_batches(stats, N_BS, L=L, groups=groups, batch=batch, scheme=scheme, rng=rng):
+            BS_AR[:,:,:,i:i+BS.shape[3]] = BS
+
+            # Print status
+            percent = int(np.round((i+BS.shape[3])/N_BS*100))
+            bar = '+' * percent + "-" * (100-percent)
+            print(f"\r|{bar}| {percent:.1f}%",end="\r")
+    
+    print()
+
+    return BS_AR
+
+
+def bootstrap_stats_batches(stats, N_BS, L=3, groups=None, batch=None, scheme="iid", rng=None):
+    """
+    Batches of clustered bootstrap samples of the agreement rates (see bootstrap_stats)
+    The same random numbers give the same batches, e.g. for several passes over the bootstrap samples
+    with a copy of the random state (see BCa_stream)
+
+    Input:
+    stats, N_BS, L, groups, batch, scheme, rng:   See bootstrap_stats
+
+    Output:
+    Generator of (index of first sample of the batch, numpy array (n_devices x 4xL x batch size))
+
+    """
+
+    n_sens = stats.shape[0]
+    n_dev = stats.shape[1] // (4+4*L)
+    batch = max(1, min(N_BS, 2**22//(stats.shape[1]*n_sens))) if batch is None else batch
+    score = stats[:,4+3*L:4+4*L].sum(axis=1) / np.maximum(stats[:,3], 1)
+
+    for i, C in cluster_samples(N_BS, n_sens, groups, batch=batch, scheme=scheme, score=score, rng=rng):
+        # Agreement Rates (NaN if a Range has no data)
+        tot = (C @ stats).reshape(C.shape[0],n_dev,4+4*L)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            yield i, (tot[:,:,4:].reshape(-1,n_dev,4,L) / tot[:,:,:4,None] * 100).transpose(1,2,3,0)
+
+
+def BCa(dat,theta_h,a,alpha=0.05):
+    """
+    Function to calculate bias-corrected and accelerated bootstrap quantiles according to 
+    DiCiccio TJ, Efron B. Bootstrap confidence intervals. Stat Sci. 1996;11(3):189-228
+    Implementation is based on R package "bootstrap" (function bcanon)
+
+    Input:
+    dat:        Numpy array of bootstrapped samples
+    theta_h:    Estimator of original sample
+    a:          Acceleration
+    alpha:      Quantile of boostrap sample to be calculated (0 to 1)
+
+    Output:
+    res:    Calculated quantile
+    
+    """
+
+    # BCa method
+    sims = len(dat)
+    below = bca_kernel(np.asarray(dat,dtype=float),theta_h) if JIT.active() else None
+    below = np.sum((dat < theta_h)*1) if below is None else below
+    z_inv = below/sims
+    z = sts.norm.ppf(z_inv)
+
+    prctl_inv = sts.norm.cdf(z + (z + sts.norm.ppf(alpha))/(1 - a * (z + sts.norm.ppf(alpha))))
+    
+    res = np.quantile(dat,prctl_inv)
+
+    return res
+
+
+@JIT
+def bca_kernel(dat,theta_h):
+    """
+    Loop implementation of the number of bootstrap samples below theta_h (BCa)
+
+    """
+
+    below = 0
+    for x in dat:
+        below += x < theta_h
+
+    return below
+
+
+def BCa_stream(replay, theta_h, a, alpha, bins=1024, cap=2**16):
+    """
+    BCa quantiles (see BCa) of each row of bootstrap samples that are generated in batches, without keeping
+    the bootstrap samples. The memory does not depend on the number of bootstrap samples and the results
+    are identical to BCa of the complete rows (exact selection in several passes, see stream_quantiles)
 
-    def calc_acc(df):
+    Input:
+    replay:     Function returning a new generator of the same batches of bootstrap samples (see stream_summary)
+    theta_h:    Numpy array (M) of estimators of the original sample
+    a:          Numpy array (M) of accelerations
+    alpha:      Numpy array (M) of quantiles to be calculated (0 to 1)
+    bins, cap:  See stream_quantiles
+
+    Output:
+    res:        Numpy array (M) of calculated quantiles (NaN for rows containing NaN as np.quantile)
+
+    """
+
+    summ = stream_summary(replay, theta_h, bins=bins)
+    sims = summ["n"] + summ["nan"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = sts.norm.ppf(summ["below"]/sims)
+        q = sts.norm.cdf(z + (z + sts.norm.ppf(alpha))/(1 - a * (z + sts.norm.ppf(alpha))))
+    q[summ["nan"] > 0] = np.nan
+
+    return stream_quantiles(replay, summ, q, bins=bins, cap=cap)
+
+
+def CI_Bootstrapping(RES, df, alpha=0.05, N_BS=10000, seed=1, metrics=None, full_output=False, BS_AR=None,
+                        two_stage=False, scheme="iid", rng=None, low_memory=False):
+
+    def calc_acc(df, col="SensorID"):
         """
         Function to calculate the acceleration for BCa using a jackknife estimate with respect to the sensors
         DiCiccio TJ, Efron B. Bootstrap confidence intervals. Stat Sci. 1996;11(3):189-228
@@ -115,16 +379,18 @@ def CI_Bootstrapping(RES, df, alpha=0.05, N_BS=10000, seed=1):
 
         Input:
         df:         Dataframe with data, reduced to a certain glucose range
-        qtl:        List of quantiles for TIs  
+        col:        Column of the clusters left out ("SensorID" or "PatientID")
 
         Output:
         a:      Numpy of acceleration for TI for provided quantiles
+        u:      Numpy array (n_clusters x 3) of jackknife estimates (kept for the influence table)
+        sens:   Sorted IDs of the clusters
         
 
         """
         
         # Extract list of sensors
-        sens = df["SensorID"].unique()
+        sens = df[col].unique()
         sens.sort()
         n = len(sens)
 
@@ -132,7 +398,7 @@ def CI_Bootstrapping(RES, df, alpha=0.05, N_BS=10000, seed=1):
         u = np.zeros((n,3))    
         for i in range(n):
             # Remove single sensor and re-estimate 
-            df_tmp = df[df["SensorID"] != sens[i]]
+            df_tmp = df[df[col] != sens[i]]
             u[i,:] = (df_tmp[["WI15","WI20","WI40"]].mean() * 100).to_numpy()
         
         # Remove mean
@@ -142,131 +408,81 @@ def CI_Bootstrapping(RES, df, alpha=0.05, N_BS=10000, seed=1):
         # Estimate acceleration
         a = np.sum(uu**3,axis=0) / (6*(np.sum(uu**2,axis=0)**(3/2)))
         
-        return a    
-        
-    def BCa(dat,theta_h,a,alpha=0.05):
-        """
-        Function to calculate bias-corrected and accelerated bootstrap quantiles according to 
-        DiCiccio TJ, Efron B. Bootstrap confidence intervals. Stat Sci. 1996;11(3):189-228
-        Implementation is based on R package "bootstrap" (function bcanon)
-        In case of failure of the BCa method, the percentile method is used
-
-        Input:
-        dat:        Numpy array of bootstrapped samples
-        theta_h:    Estimator of original sample
-        a:          Acceleration
-        alpha:      Quantile of boostrap sample to be calculated (0 to 1)
-
-        Output:
-        res:    Calculated quantile
-        
-        """
-
-        # BCa method
-        sims = len(dat)
-        z_inv = np.sum((dat < theta_h)*1)/sims
-        z = sts.norm.ppf(z_inv)
-
-        prctl_inv = sts.norm.cdf(z + (z + sts.norm.ppf(alpha))/(1 - a * (z + sts.norm.ppf(alpha))))
-        
-        res = np.quantile(dat,prctl_inv)
+        return a, u, sens
 
-        return res
-
-    import time
-
-    ## Bootstrapping
-    if seed:      # Seed is provided, if not reset
-        np.random.seed(seed)       # For reproducibility
-    else:
-        np.random.seed()
-    
-    # Extract list of sensors
-    sens = df["SensorID"].unique()
-    sens.sort()
-    
-    # Empty Matrices containing bootstrap samples
-    # Rows: Ranges, Columns: Interval limits/AR15,AR20,AR40, Depth: bootstrap samples 
-    BS_AR = np.zeros((4,3,N_BS))
-    
-    # Define empty DataFrame for ARs so that missing values result in NaN instead of missing rows
-    # This DataFrame has to have the same shape as what is intended to be converted to numpy
-    df_emptyAR = pd.DataFrame(0, index=[0,1,2,3], columns=["WI15","WI20","WI40"])
-    df_emptyAR["Range"] = [1,2,3,4]
-    df_emptyAR.set_index("Range",inplace=True)
+    metrics = Metrics() if metrics is None else metrics
 
     # Start time for timing
     start = time.time()
-    print("Bootstrapping (N = "+str(N_BS)+") ... ")
-    # Loop over number of bootstap sample
-    for i in range(N_BS):
-        # Get clustered-bootstrap sample
-        df_bs = pd.DataFrame({'SensorID':np.random.choice(sens, size=len(sens),replace=True)}).merge(df,how='left')
-        
-        # Agreement Rates
-        # DataFrames are added to account for the case that a Range has no data (entry is NaN)
-        BS_AR[:,:,i] = (df_emptyAR.add(df_bs.groupby("Range")[["WI15","WI20","WI40"]].mean()*100)).to_numpy()
-
-        # Print status
-        percent = int(np.round((i+1)/N_BS*100))
-        bar = '+' * percent + "-" * (100-percent)
-        print(f"\r|{bar}| {percent:.1f}%",end="\r")
-    
-    print()
+
+    ## Bootstrapping
+    replay = None
+    if BS_AR is None and low_memory:
+        # Bootstrap samples are regenerated in each pass of BCa_stream with a copy of the random state
+        rng0 = copy.deepcopy(random_state(seed) if rng is None else rng)
+        code, n_sens, groups = cluster_index(df, two_stage=two_stage)
+        stats = sensor_stats(df, code, n_sens)
+        replay = lambda: (BS[0].reshape(12, -1) for i, BS in bootstrap_stats_batches(stats, N_BS, groups=groups, scheme=scheme,
+                                                                                    rng=copy.deepcopy(rng0)))
+    elif BS_AR is None:
+        rng = random_state(seed) if rng is None else rng      # Seed is provided for reproducibility, if not random
+        BS_AR = bootstrap_AR(df, N_BS, metrics=metrics, two_stage=two_stage, scheme=scheme, rng=rng)
+    else:       # Precomputed bootstrap samples (e.g. merged shards)
+        N_BS = BS_AR.shape[2]
 
     ## Collect Results
     # AR lower confidence bound
     # Loop over ranges
+    jack = []
+    A = np.zeros((4,3))
     for r in range(4):
         # ARs
-        a = calc_acc(df[df["Range"]==r+1])
-        # +/- 15
-        if (RES.at[r,"AR15"] == 0) | (RES.at[r,"AR15"] == 100):
-            RES.at[r,"BCa_CI15"] = RES.at[r,"CP_CI15"]
-        else:
-            RES.at[r,"BCa_CI15"] = BCa(BS_AR[r,0,:],RES.at[r,"AR15"],a[0],alpha=alpha)
-        # +/- 20
-        if (RES.at[r,"AR20"] == 0) | (RES.at[r,"AR20"] == 100):
-            RES.at[r,"BCa_CI20"] = RES.at[r,"CP_CI20"]
-        else:    
-            RES.at[r,"BCa_CI20"] = BCa(BS_AR[r,1,:],RES.at[r,"AR20"],a[1],alpha=alpha)
-        # +/- 40
-        if (RES.at[r,"AR40"] == 0) | (RES.at[r,"AR40"] == 100):
-            RES.at[r,"BCa_CI40"] = RES.at[r,"CP_CI40"]
-        else:
-            RES.at[r,"BCa_CI40"] = BCa(BS_AR[r,2,:],RES.at[r,"AR40"],a[2],alpha=alpha)
+        with metrics.span("calc_acc"):
+            A[r,:], u, sens = calc_acc(df[df["Range"]==r+1], col="PatientID" if two_stage else "SensorID")
+            jack.append((u, RES.loc[r, ["AR15","AR20","AR40"]].to_numpy(dtype=float), sens))
+    AR = RES[["AR15","AR20","AR40"]].to_numpy(dtype=float)
+    if replay is not None:
+        with metrics.span("bootstrap"):
+            BCa_CI = BCa_stream(replay, AR.ravel(), A.ravel(), np.full(12, alpha)).reshape(4,3)
+    for r in range(4):
+        with metrics.span("BCa"):
+            for l, lim in enumerate(["15","20","40"]):
+                if (RES.at[r,"AR"+lim] == 0) | (RES.at[r,"AR"+lim] == 100):
+                    RES.at[r,"BCa_CI"+lim] = RES.at[r,"CP_CI"+lim]
+                else:
+                    RES.at[r,"BCa_CI"+lim] = BCa_CI[r,l] if replay is not None else BCa(BS_AR[r,l,:], RES.at[r,"AR"+lim], A[r,l], alpha=alpha)
 
     # Print Timing    
     print("Processing Time: "+str(np.round(time.time()-start,2))+" seconds")
 
     # Provide Info
     RES.at[0,"Info"] = "Seed: "+str(seed)
-    RES.at[1,"Info"] = "N_BS: "+str(N_BS)
+    RES.at[1,"Info"] = "N_BS: "+str(N_BS) + (" ("+scheme+")")*(scheme != "iid")
     RES.at[2,"Info"] = "Conf_Level: "+str(alpha)
+    if two_stage:
+        RES.at[3,"Info"] = "Two-stage: patients, sensors"
 
+    if full_output:
+        influence = influence_table(*zip(*jack), names=[["AR15","AR20","AR40"]]*4, ranges=RES["Range"].tolist(),
+                                    col="PatientID" if two_stage else "SensorID")
+        return RES, BS_AR, influence
     return RES
 
 
-def CI_calculation(df, save_path, filename="CI_Results",
-                    N_BS=10000, seed=1, alpha=0.05):
- 
-   
-    ## Check inputs
-    # Dataframe columns
-    for col in ["SensorID","Comp","CGM"]:
-        if not(col in df.columns):
-            raise ValueError("Column "+col+" does not exist")
+def data_processing(df):
+    """
+    Calculation of deviations, assignment of glucose ranges (according to CGM) and
+    of the within/outside limits indicators
 
-    # Data Format
-    if (pd.isna(df["SensorID"])).any() or (pd.isna(df["Comp"])).any() or (pd.isna(df["CGM"])).any():
-        raise ValueError("Dataset contains NA entries")
+    Input:
+    df:         Pandas dataframe with columns "SensorID", "Comp" and "CGM"
 
-    # Save path
-    if not(os.path.isdir(save_path)):
-        raise ValueError("Provided save_path does not exist")
+    Output:
+    df:         Pandas dataframe with additional columns "AbsDiff", "RelDiff", "Range", "Diff",
+                "WI15", "WI20" and "WI40". Data of Range 4 (Total) is appended
+
+    """
 
-    
-    ## Data Processing
     df["AbsDiff"] = df["CGM"] - df["Comp"]                    # Absolute Difference
     df["RelDiff"] = df["AbsDiff"] / df["Comp"] * 100          # Relative Difference
 
@@ -289,6 +505,104 @@ def CI_calculation(df, save_path, filename="CI_Results",
     df["WI20"] = (df["Diff"].abs() <= 20)*1
     df["WI40"] = (df["Diff"].abs() <= 40)*1
 
+    return df
+
+
+@dataclass
+class CI_Results:
+    """
+    Results of the confidence interval calculation
+
+    All arrays have the shape (4x3) with Rows: Ranges (<70, 70-180, >180, Total) and
+    Columns: Limits (+/- 15, +/- 20, +/- 40 mg/dL or %), values in %
+
+    RES:        Pandas dataframe with results table (as saved in csv file)
+    AR:         Agreement rates
+    CP_CI:      Lower confidence intervals according to Clopper-Pearson
+    WCC_CI:     Lower confidence intervals according to clustered continuity-corrected Wilson
+    WCC_ICC:    Intra-cluster correlations of clustered Wilson method (0 to 1)
+    BCa_CI:     Lower confidence intervals according to bias-corrected and accelerated bootstrap
+    BS_AR:      Numpy array (4x3xN_BS) of bootstrap samples of the ARs (only if return_replicates=True)
+    info:       Dict with meta information
+    influence:  Pandas dataframe with the influence of each sensor (patient for two_stage) on the ARs
+                from the jackknife estimates of BCa, see influence_table
+
+    """
+
+    RES: pd.DataFrame
+    AR: np.ndarray
+    CP_CI: np.ndarray
+    WCC_CI: np.ndarray
+    WCC_ICC: np.ndarray
+    BCa_CI: np.ndarray
+    BS_AR: np.ndarray = None
+    info: dict = field(default_factory=dict)
+    influence: pd.DataFrame = None
+
+
+def CI_compute(df, N_BS=10000, seed=1, alpha=0.05,
+                return_replicates=False, metrics=None, replicates=None, two_stage=False, scheme="iid", rng=None,
+                low_memory=False):
+    """
+    Calculate agreement rates and their lower confidence intervals without saving results
+
+    Inputs:
+    df:                 Pandas dataframe with columns "SensorID", "Comp" and "CGM" or Dataset (see folder Data Preparation)
+    N_BS:               Number of samples for bootstrapping
+    seed:               Seed for random number generator, provide [] when random seed shall be used
+    alpha:              Significance level of lower one-sided confidence intervals
+    return_replicates:  True/False whether to include the bootstrap samples in the results
+    metrics:            Metrics object for recording processing times of the processing stages (optional)
+    replicates:         Precomputed bootstrap samples (4x3xN), e.g. merged shards, N_BS and seed are then
+                        only used as information (optional)
+    two_stage:          True/False whether patients (column "PatientID") and then sensors within patients
+                        are resampled instead of sensors
+    scheme:             Resampling scheme: "iid" (independent), "balanced" or "antithetic" (see cluster_samples)
+    rng:                Numpy random Generator or RandomState used instead of seed (optional)
+    low_memory:         True/False whether the bootstrap samples are not kept but regenerated in several passes
+                        for an exact selection of the BCa limits (see BCa_stream), memory does not grow with N_BS
+                        (no replicates returned)
+
+    Output:
+    res:                CI_Results object
+
+    """
+
+    ## Check inputs
+    # Preprocessed Dataset (see folder Data Preparation), checked on creation
+    if hasattr(df, "ci_data"):
+        if two_stage and not(df.has_patients):
+            raise ValueError("Column PatientID does not exist")
+    else:
+        # Dataframe columns
+        for col in ["SensorID","Comp","CGM"]:
+            if not(col in df.columns):
+                raise ValueError("Column "+col+" does not exist")
+
+        # Data Format
+        if (pd.isna(df["SensorID"])).any() or (pd.isna(df["Comp"])).any() or (pd.isna(df["CGM"])).any():
+            raise ValueError("Dataset contains NA entries")
+        if two_stage:
+            if not("PatientID" in df.columns):
+                raise ValueError("Column PatientID does not exist")
+            if (pd.isna(df["PatientID"])).any():
+                raise ValueError("Dataset contains NA entries")
+
+    metrics = Metrics() if metrics is None else metrics
+    N_BS = N_BS if replicates is None else replicates.shape[2]
+    if hasattr(df, "ci_data"):
+        n_data, n_sens = df.n_datapoints, df.n_sensors
+    else:
+        n_data, n_sens = df.shape[0], df["SensorID"].nunique()
+    info = {"tool": "CI_calculation", "n_datapoints": int(n_data),
+            "n_sensors": int(n_sens), "N_BS": N_BS, "seed": seed, "alpha": alpha,
+            "two_stage": two_stage, "scheme": scheme}
+    metrics.info.update(info)
+
+    ## Data Processing
+    with metrics.span("preprocessing"):
+        df = df.ci_data if hasattr(df, "ci_data") else data_processing(df.copy())
+
     # Initialize results table
     RES = pd.DataFrame() 
     RES["Range"] = ["<70","70-180",">180","Total"]
@@ -299,14 +613,907 @@ def CI_calculation(df, save_path, filename="CI_Results",
     RES["AR40"] = (df.groupby("Range")["WI40"].mean()*100).to_numpy()
 
     ## Clopper-Person CI
-    RES = CI_Clopper_Pearson(RES,df,alpha=alpha)
+    with metrics.span("clopper_pearson"):
+        RES = CI_Clopper_Pearson(RES,df,alpha=alpha)
 
     ## WilsonCC CI
-    RES = CI_WilsonCC(RES, df, alpha=alpha)
+    with metrics.span("wilson"):
+        RES = CI_WilsonCC(RES, df, alpha=alpha)
 
     ## Bootstrapping CI
-    RES = CI_Bootstrapping(RES, df, alpha=alpha, N_BS=N_BS, seed=seed)
+    RES, BS_AR, influence = CI_Bootstrapping(RES, df, alpha=alpha, N_BS=N_BS, seed=seed, metrics=metrics,
+                                             full_output=True, BS_AR=replicates, two_stage=two_stage, scheme=scheme,
+                                             rng=rng, low_memory=low_memory)
+
+    cols = lambda pre: RES[[pre+"15",pre+"20",pre+"40"]].to_numpy(dtype=float)
+    return CI_Results(RES=RES,AR=cols("AR"),CP_CI=cols("CP_CI"),WCC_CI=cols("WCC_CI"),
+                      WCC_ICC=cols("WCC_ICC"),BCa_CI=cols("BCa_CI"),
+                      BS_AR=BS_AR if return_replicates else None,info=info,influence=influence)
+
+
+def CI_calculation(df, save_path, filename="CI_Results",
+                    N_BS=10000, seed=1, alpha=0.05, metrics=None, two_stage=False, scheme="iid", rng=None,
+                    low_memory=False):
+    """
+    Calculate agreement rates and their lower confidence intervals and save the results in a csv file
+
+    Inputs:
+    df:         Pandas dataframe with columns "SensorID", "Comp" and "CGM" or Dataset (see folder Data Preparation)
+    save_path:  Path for saving results table, None if results shall not be saved
+    filename:   Filename of results table
+    N_BS:       Number of samples for bootstrapping
+    seed:       Seed for random number generator, provide [] when random seed shall be used
+    alpha:      Significance level of lower one-sided confidence intervals
+    metrics:    Metrics object for recording processing times of the processing stages (optional)
+    two_stage:  True/False whether patients (column "PatientID") and then sensors within patients are resampled
+    scheme:     Resampling scheme: "iid" (independent), "balanced" or "antithetic" (see cluster_samples)
+    rng:        Numpy random Generator or RandomState used instead of seed (optional)
+    low_memory: True/False whether the bootstrap samples are not kept (see CI_compute)
+
+    Output:
+    res:        CI_Results object
+
+    """
+
+    # Save path
+    if save_path is not None and not(os.path.isdir(save_path)):
+        raise ValueError("Provided save_path does not exist")
+
+    metrics = Metrics() if metrics is None else metrics
+
+    res = CI_compute(df, N_BS=N_BS, seed=seed, alpha=alpha, metrics=metrics, two_stage=two_stage, scheme=scheme,
+                     rng=rng, low_memory=low_memory)
 
     ## Save results
-    RES.to_csv(save_path+filename+".csv",index=None)
-    
+    if save_path is not None:
+        with metrics.span("saving"):
+            res.RES.to_csv(save_path+filename+".csv",index=None)
+
+    return res
+
+
+def CI_shard(df, shard, n_shards, N_BS=10000, seed=1, save_path=None, filename="CI_Results", metrics=None,
+                two_stage=False):
+    """
+    Perform shard number shard (0 to n_shards-1) of the bootstrapping of the agreement rates
+    The N_BS bootstrap samples are split evenly between the shards. Shards can be run independently
+    (e.g. on different machines) and are combined with CI_merge
+
+    Inputs:
+    df:         Pandas dataframe with columns "SensorID", "Comp" and "CGM"
+    shard:      Number of the shard (0 to n_shards-1)
+    n_shards:   Total number of shards
+    N_BS:       Total number of samples for bootstrapping (of all shards)
+    seed:       Seed for random number generator (has to be identical for all shards)
+    save_path:  Path for saving the shard file (filename_shard_k_of_K.npz), None if it shall not be saved
+    filename:   Filename of shard file
+    metrics:    Metrics object for recording processing times of the processing stages (optional)
+    two_stage:  True/False whether patients (column "PatientID") and then sensors within patients are resampled
+
+    Output:
+    BS_AR:      Numpy array (4x3xN) of bootstrap samples of the shard
+    meta:       Dict with meta information of the shard
+
+    """
+
+    if not(seed):
+        raise ValueError("A seed has to be provided for bootstrapping in shards")
+    if not(0 <= shard < n_shards):
+        raise ValueError("shard has to be between 0 and n_shards-1")
+    for col in ["SensorID","Comp","CGM"]:
+        if not(col in df.columns):
+            raise ValueError("Column "+col+" does not exist")
+    if save_path is not None and not(os.path.isdir(save_path)):
+        raise ValueError("Provided save_path does not exist")
+
+    meta = {"tool": "CI_calculation", "shard": shard, "n_shards": n_shards, "N_BS": N_BS,
+            "N": N_BS//n_shards + (shard < N_BS % n_shards), "seed": seed, "two_stage": two_stage,
+            "data_hash": data_hash(df)}
+
+    df = data_processing(df.copy())
+    BS_AR = bootstrap_AR(df, meta["N"], metrics=metrics, two_stage=two_stage,
+                         rng=np.random.RandomState(shard_seed(seed, shard, n_shards)))
+
+    if save_path is not None:
+        np.savez_compressed(save_path+filename+"_shard_{}_of_{}.npz".format(shard, n_shards), BS=BS_AR, meta=json.dumps(meta))
+
+    return BS_AR, meta
+
+
+def CI_merge(df, files, alpha=0.05, return_replicates=False, metrics=None):
+    """
+    Combine the bootstrap shards of CI_shard and calculate agreement rates and their lower confidence intervals
+
+    Inputs:
+    df:                 Pandas dataframe with columns "SensorID", "Comp" and "CGM" (as used for the shards)
+    files:              List of shard files (all shards 0 to n_shards-1)
+    alpha:              Significance level of lower one-sided confidence intervals
+    return_replicates:  True/False whether to include the bootstrap samples in the results
+    metrics:            Metrics object for recording processing times of the processing stages (optional)
+
+    Output:
+    res:                CI_Results object (as CI_compute)
+
+    """
+
+    BS_AR, meta = merge_shards(files, "CI_calculation", data_hash(df))
+
+    return CI_compute(df, N_BS=meta["N_BS"], seed=meta["seed"], alpha=alpha,
+                      return_replicates=return_replicates, metrics=metrics, replicates=BS_AR,
+                      two_stage=meta["two_stage"])
+
+
+@dataclass
+class CI_Paired_Results:
+    """
+    Results of the paired comparison of the agreement rates of two devices
+
+    Arrays have the shape (4x3) with Rows: Ranges (<70, 70-180, >180, Total) and
+    Columns: Limits (+/- 15, +/- 20, +/- 40 mg/dL or %), values in %
+
+    RES:        Pandas dataframe with results table (as saved in csv file)
+    AR:         Numpy array (2x4x3) of the agreement rates of both devices
+    Diff:       Differences of the agreement rates (second - first device)
+    Diff_CI:    Numpy array (4x3x2) of the lower and upper BCa confidence limits of the differences
+    BS_Diff:    Numpy array (4x3xN_BS) of bootstrap samples of the differences (only if return_replicates=True)
+    info:       Dict with meta information
+
+    """
+
+    RES: pd.DataFrame
+    AR: np.ndarray
+    Diff: np.ndarray
+    Diff_CI: np.ndarray
+    BS_Diff: np.ndarray = None
+    info: dict = field(default_factory=dict)
+
+
+def CI_paired(df, devices, save_path=None, filename="CI_Paired",
+                N_BS=10000, seed=1, alpha=0.05, return_replicates=False, metrics=None, two_stage=False, scheme="iid",
+                rng=None):
+    """
+    Paired comparison of the agreement rates of two devices worn on the same sensors/patients
+    Both devices are evaluated on the same bootstrap samples (same resampled sensors) and BCa confidence
+    limits are calculated for the differences of the agreement rates (second - first device)
+
+    Inputs:
+    df:                 Pandas dataframe with columns "SensorID", "Comp" and the columns of both devices
+    devices:            List with the two column names of the devices, e.g. ["CGM_A", "CGM_B"]
+    save_path:          Path for saving results table, None if results shall not be saved
+    filename:           Filename of results table
+    N_BS:               Number of samples for bootstrapping
+    seed:               Seed for random number generator, provide [] when random seed shall be used
+    alpha:              Significance level of the lower and the upper one-sided confidence limits
+    return_replicates:  True/False whether to include the bootstrap samples in the results
+    metrics:            Metrics object for recording processing times of the processing stages (optional)
+    two_stage:          True/False whether patients (column "PatientID") and then sensors within patients
+                        are resampled
+    scheme:             Resampling scheme: "iid" (independent), "balanced" or "antithetic" (see cluster_samples)
+    rng:                Numpy random Generator or RandomState used instead of seed (optional)
+
+    Output:
+    res:                CI_Paired_Results object
+
+    """
+
+    ## Check inputs
+    if len(devices) != 2 or devices[0] == devices[1]:
+        raise ValueError("Two different device columns have to be provided")
+    cols = ["SensorID", "Comp"] + ["PatientID"]*two_stage
+    for col in cols + list(devices):
+        if not(col in df.columns):
+            raise ValueError("Column "+col+" does not exist")
+    if (pd.isna(df[cols + list(devices)])).any().any():
+        raise ValueError("Dataset contains NA entries")
+    if save_path is not None and not(os.path.isdir(save_path)):
+        raise ValueError("Provided save_path does not exist")
+
+    metrics = Metrics() if metrics is None else metrics
+    info = {"tool": "CI_paired", "devices": list(devices), "n_datapoints": int(df.shape[0]),
+            "n_sensors": int(df["SensorID"].nunique()), "N_BS": N_BS, "seed": seed, "alpha": alpha,
+            "two_stage": two_stage, "scheme": scheme}
+    metrics.info.update(info)
+
+    ## Data Processing (ranges according to CGM of each device)
+    with metrics.span("preprocessing"):
+        dfs = [data_processing(df[cols].assign(CGM=df[d])) for d in devices]
+        code, n_sens, groups = cluster_index(dfs[0], two_stage=two_stage)
+        stats = np.stack([sensor_stats(d, code, n_sens) for d in dfs])
+
+    # Agreement rates of both devices
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tot = stats.sum(axis=1)
+        AR = tot[:,4:].reshape(2,4,3) / tot[:,:4,None] * 100
+    Diff = AR[1] - AR[0]
+
+    # Bootstrapping of both devices with the same samples
+    start = time.time()
+    rng = random_state(seed) if rng is None else rng      # Seed is provided for reproducibility, if not random
+    BS_Diff = np.diff(bootstrap_AR(dfs, N_BS, metrics=metrics, two_stage=two_stage, scheme=scheme, rng=rng), axis=0)[0]
+
+    # Jackknife (leaving out sensors or patients) of the differences from the sums of the clusters
+    with metrics.span("calc_acc"):
+        if two_stage:
+            stats = np.stack([stats[:,g,:].sum(axis=1) for g in groups], axis=1)
+        loo = tot[:,None,:] - stats
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u = np.diff(loo[:,:,4:].reshape(2,-1,4,3) / loo[:,:,:4,None] * 100, axis=0)[0]
+
+    # BCa limits of the differences (percentile method if BCa cannot be applied)
+    Diff_CI = np.full((4,3,2), np.nan)
+    with metrics.span("BCa"):
+        for r in range(4):
+            uu = u[(stats[:,:,r] > 0).any(axis=0), r, :]
+            uu = np.mean(uu, axis=0) - uu
+            with np.errstate(divide="ignore", invalid="ignore"):
+                a = np.sum(uu**3, axis=0) / (6*(np.sum(uu**2, axis=0)**(3/2)))
+            for l in range(3):
+                dat = BS_Diff[r,l,:][~np.isnan(BS_Diff[r,l,:])]
+                if len(dat) == 0 or np.isnan(Diff[r,l]):
+                    continue
+                for j, q in enumerate([alpha, 1-alpha]):
+                    if (np.min(dat) >= Diff[r,l]) or (np.max(dat) <= Diff[r,l]) or np.isnan(a[l]):
+                        Diff_CI[r,l,j] = np.quantile(dat, q)
+                    else:
+                        Diff_CI[r,l,j] = BCa(dat, Diff[r,l], a[l], alpha=q)
+
+    print("Processing Time: "+str(np.round(time.time()-start,2))+" seconds")
+
+    ## Collect Results
+    RES = pd.DataFrame([(rng, "AR"+lim, AR[0,r,l], AR[1,r,l], Diff[r,l], Diff_CI[r,l,0], Diff_CI[r,l,1])
+                        for r, rng in enumerate(["<70","70-180",">180","Total"])
+                        for l, lim in enumerate(["15","20","40"])],
+                       columns=["Range", "Limit", devices[0], devices[1], "Difference", "CI_Lower", "CI_Upper"])
+    RES["Info"] = ""
+    RES.at[0,"Info"] = "Seed: "+str(seed)
+    RES.at[1,"Info"] = "N_BS: "+str(N_BS)
+    RES.at[2,"Info"] = "Conf_Level: "+str(alpha)
+    RES.at[3,"Info"] = "Difference: "+str(devices[1])+" - "+str(devices[0])
+    if two_stage:
+        RES.at[4,"Info"] = "Two-stage: patients, sensors"
+
+    if save_path is not None:
+        with metrics.span("saving"):
+            RES.to_csv(save_path+filename+".csv", index=None)
+
+    return CI_Paired_Results(RES=RES, AR=AR, Diff=Diff, Diff_CI=Diff_CI,
+                             BS_Diff=BS_Diff if return_replicates else None, info=info)
+
+
+def stats_acceleration(stats, L, groups=None):
+    """
+    Acceleration of the BCa method (as in CI_Bootstrapping) from a jackknife estimate leaving out single
+    sensors or patients, calculated from the number of datapoints and hits of each sensor
+
+    Input:
+    stats:      Numpy array (n_sens x 4+4L) of number of datapoints and hits of each sensor (see sensor_stats)
+    L:          Number of limits
+    groups:     List of sensor indices of each patient if patients are left out (optional, see cluster_index)
+
+    Output:
+    a:          Numpy array (4xL) of accelerations
+
+    """
+
+    tot = stats.sum(axis=0)
+    clus = stats if groups is None else np.stack([stats[g,:].sum(axis=0) for g in groups])
+    loo = tot[None,:] - clus
+    with np.errstate(divide="ignore", invalid="ignore"):
+        u = loo[:,4:].reshape(-1, 4, L) / loo[:,:4,None] * 100
+
+    a = np.zeros((4, L))
+    for r in range(4):
+        uu = u[clus[:,r] > 0, r, :]
+        uu = np.add(np.mean(uu, axis=0), -uu)
+        uu[uu == 0] = np.NaN
+        a[r,:] = np.sum(uu**3, axis=0) / (6*(np.sum(uu**2, axis=0)**(3/2)))
+
+    return a
+
+
+def stats_intervals(stats, limits, alpha=[0.05], N_BS=10000, seed=1, groups=None, metrics=None, scheme="iid",
+                    rng=None):
+    """
+    Agreement rates and their lower confidence intervals from the number of datapoints and hits of each sensor
+    Clopper-Pearson and clustered Wilson intervals only need these sums, the bootstrap samples are drawn
+    from them as well (see bootstrap_stats)
+
+    Input:
+    stats:      Numpy array (n_sens x 4+4L) of number of datapoints and hits of each sensor (see sensor_stats)
+    limits:     List of limits (mg/dL or %)
+    alpha:      List of significance levels of lower one-sided confidence intervals
+    N_BS:       Number of samples for bootstrapping, 0 if bootstrapping shall be skipped
+    seed:       Seed for random number generator, provide [] when random seed shall be used
+    groups:     List of sensor indices of each patient for two-stage resampling (optional, see cluster_index)
+    metrics:    Metrics object (optional)
+    scheme:     Resampling scheme ("iid", "balanced" or "antithetic", see cluster_samples)
+    rng:        Numpy random Generator or RandomState used instead of seed (optional)
+
+    Output:
+    AR:         Numpy array (4xL) of agreement rates
+    CP_CI:      Numpy array (4xLxA) of lower confidence intervals according to Clopper-Pearson
+    WCC_CI:     Numpy array (4xLxA) of lower confidence intervals according to clustered continuity-corrected Wilson
+    WCC_ICC:    Numpy array (4xL) of intra-cluster correlations of clustered Wilson method
+    BCa_CI:     Numpy array (4xLxA) of lower confidence intervals according to BCa bootstrap (NaN if N_BS=0)
+    BS_AR:      Numpy array (4xLxN_BS) of bootstrap samples (None if N_BS=0)
+
+    """
+
+    metrics = Metrics() if metrics is None else metrics
+    L, A = len(limits), len(alpha)
+
+    # Agreement rates
+    tot = stats.sum(axis=0)
+    n = tot[:4]
+    x = tot[4:].reshape(4, L)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        AR = x / n[:,None] * 100
+
+    ## Clopper-Person CI
+    print("Calculate Clopper-Pearson Intervals ...")
+    with metrics.span("clopper_pearson"), np.errstate(invalid="ignore"):
+        CP_CI = np.where(x[:,:,None] == 0, 0,
+                         sts.beta.ppf(np.array(alpha)[None,None,:], x[:,:,None], n[:,None,None]-x[:,:,None]+1)*100)
+
+    ## WilsonCC CI (sensors with data in the range)
+    print("Calculate Wilson Intervals ...")
+    WCC_CI = np.zeros((4, L, A))
+    WCC_ICC = np.zeros((4, L))
+    with metrics.span("wilson"), np.errstate(divide="ignore", invalid="ignore"):
+        for r in range(4):
+            sel = stats[:,r] > 0
+            xr = stats[sel, 4+r*L:4+(r+1)*L].T
+            mr = np.broadcast_to(stats[sel, r], xr.shape)
+            for j, al in enumerate(alpha):
+                WCC, WCC_ICC[r,:] = WilsonCC(xr, mr, alpha=al, warn=(j == 0))
+                WCC_CI[r,:,j] = WCC*100
+
+    BCa_CI = np.full((4, L, A), np.nan)
+    if not(N_BS):
+        return AR, CP_CI, WCC_CI, WCC_ICC, BCa_CI, None
+
+    ## Bootstrapping CI
+    start = time.time()
+    rng = random_state(seed) if rng is None else rng      # Seed is provided for reproducibility, if not random
+    BS_AR = bootstrap_stats(stats, N_BS, L=L, groups=groups, metrics=metrics, scheme=scheme, rng=rng)[0]
+
+    # Jackknife (leaving out sensors or patients) from the sums of the clusters
+    with metrics.span("calc_acc"):
+        a = stats_acceleration(stats, L, groups=groups)
+
+    with metrics.span("BCa"):
+        for r in range(4):
+            for l in range(L):
+                for j, al in enumerate(alpha):
+                    if (AR[r,l] == 0) | (AR[r,l] == 100):
+                        BCa_CI[r,l,j] = CP_CI[r,l,j]
+                    else:
+                        BCa_CI[r,l,j] = BCa(BS_AR[r,l,:], AR[r,l], a[r,l], alpha=al)
+
+    print("Processing Time: "+str(np.round(time.time()-start,2))+" seconds")
+
+    return AR, CP_CI, WCC_CI, WCC_ICC, BCa_CI, BS_AR
+
+
+@dataclass
+class CI_Sensitivity_Results:
+    """
+    Results of the confidence interval calculation for several limits and significance levels
+
+    Arrays have Rows: Ranges (<70, 70-180, >180, Total), Columns: limits and Depth: significance levels,
+    values in %
+
+    RES:        Pandas dataframe with results table (as saved in csv file), one row per range, limit and alpha
+    limits:     List of limits (mg/dL or %)
+    alpha:      List of significance levels
+    AR:         Numpy array (4xL) of agreement rates
+    CP_CI:      Numpy array (4xLxA) of lower confidence intervals according to Clopper-Pearson
+    WCC_CI:     Numpy array (4xLxA) of lower confidence intervals according to clustered continuity-corrected Wilson
+    WCC_ICC:    Numpy array (4xL) of intra-cluster correlations of clustered Wilson method (0 to 1)
+    BCa_CI:     Numpy array (4xLxA) of lower confidence intervals according to bias-corrected and accelerated bootstrap
+    BS_AR:      Numpy array (4xLxN_BS) of bootstrap samples of the ARs (only if return_replicates=True)
+    info:       Dict with meta information
+
+    """
+
+    RES: pd.DataFrame
+    limits: list
+    alpha: list
+    AR: np.ndarray
+    CP_CI: np.ndarray
+    WCC_CI: np.ndarray
+    WCC_ICC: np.ndarray
+    BCa_CI: np.ndarray
+    BS_AR: np.ndarray = None
+    info: dict = field(default_factory=dict)
+
+
+def CI_sensitivity(df, limits=[15,20,40], alpha=[0.05], save_path=None, filename="CI_Sensitivity",
+                    N_BS=10000, seed=1, return_replicates=False, metrics=None, two_stage=False, scheme="iid",
+                    rng=None):
+    """
+    Calculate agreement rates and their lower confidence intervals for several limits and significance levels
+    The hits of all limits are counted from the sorted absolute deviations and all bootstrap confidence
+    intervals are calculated from one set of bootstrap samples, i.e. the computation time hardly depends
+    on the number of limits and significance levels
+
+    Inputs:
+    df:                 Pandas dataframe with columns "SensorID", "Comp" and "CGM" or Dataset (see folder Data Preparation)
+    limits:             List of limits (mg/dL for CGM <70 mg/dL, % otherwise)
+    alpha:              List of significance levels of lower one-sided confidence intervals
+    save_path:          Path for saving results table, None if results shall not be saved
+    filename:           Filename of results table
+    N_BS:               Number of samples for bootstrapping
+    seed:               Seed for random number generator, provide [] when random seed shall be used
+    return_replicates:  True/False whether to include the bootstrap samples in the results
+    metrics:            Metrics object for recording processing times of the processing stages (optional)
+    two_stage:          True/False whether patients (column "PatientID") and then sensors within patients
+                        are resampled
+    scheme:             Resampling scheme: "iid" (independent), "balanced" or "antithetic" (see cluster_samples)
+    rng:                Numpy random Generator or RandomState used instead of seed (optional)
+
+    Output:
+    res:                CI_Sensitivity_Results object
+
+    """
+
+    ## Check inputs
+    if hasattr(df, "ci_data"):
+        if two_stage and not(df.has_patients):
+            raise ValueError("Column PatientID does not exist")
+    else:
+        for col in ["SensorID","Comp","CGM"] + ["PatientID"]*two_stage:
+            if not(col in df.columns):
+                raise ValueError("Column "+col+" does not exist")
+        if (pd.isna(df[["SensorID","Comp","CGM"] + ["PatientID"]*two_stage])).any().any():
+            raise ValueError("Dataset contains NA entries")
+    if len(limits) == 0 or len(alpha) == 0:
+        raise ValueError("At least one limit and one significance level have to be provided")
+    if save_path is not None and not(os.path.isdir(save_path)):
+        raise ValueError("Provided save_path does not exist")
+
+    metrics = Metrics() if metrics is None else metrics
+    limits, alpha = list(limits), list(alpha)
+    L, A = len(limits), len(alpha)
+    if hasattr(df, "ci_data"):
+        n_data, n_sens = df.n_datapoints, df.n_sensors
+    else:
+        n_data, n_sens = df.shape[0], df["SensorID"].nunique()
+    info = {"tool": "CI_sensitivity", "n_datapoints": int(n_data),
+            "n_sensors": int(n_sens), "N_BS": N_BS, "seed": seed, "limits": limits,
+            "alpha": alpha, "two_stage": two_stage, "scheme": scheme}
+    metrics.info.update(info)
+
+    ## Data Processing
+    with metrics.span("preprocessing"):
+        df = df.ci_data if hasattr(df, "ci_data") else data_processing(df.copy())
+        code, n_sens, groups = cluster_index(df, two_stage=two_stage)
+        stats = sensor_stats(df, code, n_sens, limits)
+
+    AR, CP_CI, WCC_CI, WCC_ICC, BCa_CI, BS_AR = stats_intervals(stats, limits, alpha=alpha, N_BS=N_BS, seed=seed,
+                                                                 groups=groups, metrics=metrics, scheme=scheme, rng=rng)
+
+    ## Collect Results
+    RES = pd.DataFrame([(rng, lim, al, AR[r,l], CP_CI[r,l,j], WCC_CI[r,l,j], WCC_ICC[r,l], BCa_CI[r,l,j])
+                        for r, rng in enumerate(["<70","70-180",">180","Total"])
+                        for l, lim in enumerate(limits) for j, al in enumerate(alpha)],
+                       columns=["Range", "Limit", "Alpha", "AR", "CP_CI", "WCC_CI", "WCC_ICC", "BCa_CI"])
+    RES["Info"] = ""
+    RES.at[0,"Info"] = "Seed: "+str(seed)
+    RES.at[1,"Info"] = "N_BS: "+str(N_BS)
+    if two_stage:
+        RES.at[2,"Info"] = "Two-stage: patients, sensors"
+
+    if save_path is not None:
+        with metrics.span("saving"):
+            RES.to_csv(save_path+filename+".csv", index=None)
+
+    return CI_Sensitivity_Results(RES=RES, limits=limits, alpha=alpha, AR=AR, CP_CI=CP_CI, WCC_CI=WCC_CI,
+                                  WCC_ICC=WCC_ICC, BCa_CI=BCa_CI, BS_AR=BS_AR if return_replicates else None,
+                                  info=info)
+
+
+def results_table(AR, CP_CI, WCC_CI, WCC_ICC, BCa_CI, limits, info):
+    """
+    Results table in the layout of CI_compute
+
+    Input:
+    AR, CP_CI, WCC_CI, WCC_ICC, BCa_CI:     Numpy arrays (4xL) of agreement rates and intervals
+    limits:     List of limits (mg/dL or %)
+    info:       List of the 4 entries of column "Info"
+
+    Output:
+    RES:        Pandas dataframe
+
+    """
+
+    RES = pd.DataFrame()
+    RES["Range"] = ["<70","70-180",">180","Total"]
+    names = ["{:g}".format(lim) for lim in limits]
+    for l, lim in enumerate(names):
+        RES["AR"+lim] = AR[:,l]
+    for l, lim in enumerate(names):
+        RES["CP_CI"+lim] = CP_CI[:,l]
+    for l, lim in enumerate(names):
+        RES["WCC_CI"+lim] = WCC_CI[:,l]
+        RES["WCC_ICC"+lim] = WCC_ICC[:,l]
+    for l, lim in enumerate(names):
+        RES["BCa_CI"+lim] = BCa_CI[:,l]
+    RES["Info"] = info
+
+    return RES
+
+
+class CI_Index:
+    """
+    Index of the number of datapoints and hits of each sensor in each range and limit, optionally split
+    by further columns (e.g. day of wear or site)
+
+    Agreement rates, Clopper-Pearson and clustered Wilson intervals of any subset (e.g. a site, all but one
+    patient or day 1) are calculated from the sums of the index rows without the original data.
+    Bootstrapped (BCa) intervals are only calculated on request, also from the sums of the index rows.
+
+    index = CI_Index.build(df, by=["Day"], limits=[15,20,40])
+    index.save(file)
+    index = CI_Index.load(file)
+    res = index.subset(Day=1).compute(alpha=0.05, N_BS=0)
+
+    """
+
+    def __init__(self, table, keys, limits):
+        """
+        Input:
+        table:      Pandas dataframe with the key columns, the number of datapoints in each range
+                    ("N_1" to "N_4") and the hits of each range and limit ("WI15_1", ...)
+        keys:       List of key columns ("SensorID" and grouping columns)
+        limits:     List of limits (mg/dL or %)
+
+        """
+
+        self.table = table
+        self.keys = list(keys)
+        self.limits = list(limits)
+
+    @staticmethod
+    def columns(limits):
+        """
+        Names of the count columns of the index (order as in sensor_stats)
+
+        """
+
+        return ["N_"+str(r+1) for r in range(4)] + ["WI{:g}_{}".format(lim, r+1) for r in range(4) for lim in limits]
+
+    @classmethod
+    def build(cls, df, by=[], limits=[15,20,40]):
+        """
+        Build the index from the data
+
+        Input:
+        df:         Pandas dataframe with columns "SensorID", "Comp", "CGM" and the columns in by
+        by:         List of further columns for splitting the rows of each sensor, e.g. ["Day"] or
+                    ["Site","PatientID"] (PatientID is required for two-stage bootstrapping)
+        limits:     List of limits (mg/dL or %)
+
+        Output:
+        index:      CI_Index object
+
+        """
+
+        keys = ["SensorID"] + [c for c in by if c != "SensorID"]
+        for col in keys + ["Comp","CGM"]:
+            if not(col in df.columns):
+                raise ValueError("Column "+col+" does not exist")
+        if (pd.isna(df[keys + ["Comp","CGM"]])).any().any():
+            raise ValueError("Dataset contains NA entries")
+
+        dat = data_processing(df[keys + ["Comp","CGM"]].copy())
+        grp = dat.groupby(keys, sort=True)
+        table = grp.size().reset_index()[keys]
+        stats = sensor_stats(dat, grp.ngroup().to_numpy(), len(table), limits)
+        table[cls.columns(limits)] = stats.astype(np.int64)
+
+        return cls(table, keys, limits)
+
+    def save(self, file):
+        """
+        Save the index as csv file
+
+        """
+
+        self.table.to_csv(file, index=None)
+
+    @classmethod
+    def load(cls, file):
+        """
+        Load an index from a csv file (see save)
+
+        """
+
+        table = pd.read_csv(file)
+        keys = list(table.columns[:list(table.columns).index("N_1")])
+        limits = [float(c[2:-2]) for c in table.columns if c.startswith("WI") and c.endswith("_1")]
+        limits = [int(lim) if lim.is_integer() else lim for lim in limits]
+        if list(table.columns) != keys + cls.columns(limits):
+            raise ValueError(str(file)+" is not a valid index file")
+
+        return cls(table, keys, limits)
+
+    def subset(self, mask=None, **values):
+        """
+        Subset of the index rows
+
+        Input:
+        mask:       Boolean array of the rows, query string (e.g. "PatientID != 'P03'") or function
+                    that returns a boolean array for the table (optional)
+        values:     Values of key columns, single value or list, e.g. Site="A" or Day=[1,2]
+
+        Output:
+        index:      CI_Index object with the selected rows
+
+        """
+
+        table = self.table
+        if isinstance(mask, str):
+            table = table.query(mask)
+        elif callable(mask):
+            table = table[mask(table)]
+        elif mask is not None:
+            table = table[np.asarray(mask, dtype=bool)]
+        for col, val in values.items():
+            if not(col in self.keys):
+                raise ValueError("Column "+col+" is not a key of the index")
+            table = table[table[col].isin(val if isinstance(val, (list, tuple, set, np.ndarray)) else [val])]
+
+        return CI_Index(table.reset_index(drop=True), self.keys, self.limits)
+
+    def compute(self, alpha=0.05, N_BS=0, seed=1, two_stage=False, scheme="iid", metrics=None, rng=None):
+        """
+        Agreement rates and their lower confidence intervals of the sensors/rows of the index
+
+        Input:
+        alpha:      Significance level of lower one-sided confidence intervals
+        N_BS:       Number of samples for bootstrapping, 0 if bootstrapping shall be skipped (BCa_CI NaN)
+        seed:       Seed for random number generator, provide [] when random seed shall be used
+        two_stage:  True/False whether patients (key column "PatientID") and then sensors within patients
+                    are resampled
+        scheme:     Resampling scheme: "iid" (independent), "balanced" or "antithetic" (see cluster_samples)
+        metrics:    Metrics object for recording processing times of the processing stages (optional)
+        rng:        Numpy random Generator or RandomState used instead of seed (optional)
+
+        Output:
+        res:        CI_Results object (as CI_compute)
+
+        """
+
+        if self.table.shape[0] == 0:
+            raise ValueError("Index contains no data")
+        if two_stage and not("PatientID" in self.keys):
+            raise ValueError("Column PatientID is not a key of the index")
+
+        metrics = Metrics() if metrics is None else metrics
+        L = len(self.limits)
+        info = {"tool": "CI_index", "n_datapoints": int(self.table["N_4"].sum()),
+                "n_sensors": int(self.table["SensorID"].nunique()), "N_BS": N_BS, "seed": seed, "alpha": alpha,
+                "limits": self.limits, "two_stage": two_stage, "scheme": scheme}
+        metrics.info.update(info)
+
+        # Sums of each sensor (sorted as in cluster_index)
+        _, _, groups = cluster_index(self.table, two_stage=two_stage)
+        stats = self.table.groupby("SensorID", sort=True)[self.columns(self.limits)].sum().to_numpy(dtype=float)
+
+        AR, CP_CI, WCC_CI, WCC_ICC, BCa_CI, BS_AR = stats_intervals(stats, self.limits, alpha=[alpha], N_BS=N_BS,
+                                                                     seed=seed, groups=groups, metrics=metrics,
+                                                                     scheme=scheme, rng=rng)
+
+        RES = results_table(AR, CP_CI[:,:,0], WCC_CI[:,:,0], WCC_ICC, BCa_CI[:,:,0], self.limits,
+                            ["Seed: "+str(seed), "N_BS: "+str(N_BS) + (" ("+scheme+")")*(scheme != "iid"),
+                             "Conf_Level: "+str(alpha), "Two-stage: patients, sensors" if two_stage else np.nan])
+
+        return CI_Results(RES=RES, AR=AR, CP_CI=CP_CI[:,:,0], WCC_CI=WCC_CI[:,:,0], WCC_ICC=WCC_ICC,
+                          BCa_CI=BCa_CI[:,:,0], BS_AR=BS_AR, info=info)
+
+
+class CI_Online:
+    """
+    Online bootstrap of the agreement rates for studies with data that are still arriving
+
+    Each sensor gets a Poisson(1) weight in each of the N_BS bootstrap replicates (Poisson bootstrap). The
+    replicates are kept as weighted sums of the number of datapoints and hits, which are updated in place
+    when a batch of paired datapoints arrives. The weights of a sensor are derived from the seed and its
+    SensorID, i.e. a sensor with data in several batches keeps its weights and the results do not depend on
+    the order or splitting of the batches. Current bounds are read from the replicates (O(N_BS)) and the sums
+    of the sensors (jackknife) without revisiting old data.
+
+    online = CI_Online(N_BS=10000, limits=[15,20,40], seed=1)
+    online.update(df_batch)
+    res = online.compute(alpha=0.05)
+    online.save(file)
+    online = CI_Online.load(file)
+
+    """
+
+    def __init__(self, N_BS=10000, limits=[15,20,40], seed=1):
+        """
+        Input:
+        N_BS:       Number of bootstrap replicates
+        limits:     List of limits (mg/dL or %)
+        seed:       Seed for the Poisson weights, provide [] when random seed shall be used
+
+        """
+
+        self.N_BS = N_BS
+        self.limits = list(limits)
+        self.seed = seed if seed else int(np.random.SeedSequence().entropy % 2**63)
+        self.sensors = {}                                             # SensorID (as string): row of stats
+        self.stats = np.zeros((0, 4+4*len(self.limits)))              # Sums of each sensor
+        self.replicates = np.zeros((N_BS, 4+4*len(self.limits)))      # Weighted sums of each replicate
+
+    def weights(self, sensors):
+        """
+        Poisson(1) weights of sensors in the replicates, derived from seed and SensorID
+
+        Input:
+        sensors:    List of SensorIDs
+
+        Output:
+        W:          Numpy array (n_sensors x N_BS)
+
+        """
+
+        W = np.empty((len(sensors), self.N_BS))
+        for i, s in enumerate(sensors):
+            key = int.from_bytes(hashlib.sha256(str(s).encode()).digest()[:8], "little")
+            W[i,:] = np.random.default_rng([self.seed, key]).poisson(1.0, self.N_BS)
+        return W
+
+    def update(self, df):
+        """
+        Add a batch of paired datapoints (new sensors or further data of known sensors)
+
+        Input:
+        df:         Pandas dataframe with columns "SensorID", "Comp" and "CGM"
+
+        Output:
+        self
+
+        """
+
+        for col in ["SensorID","Comp","CGM"]:
+            if not(col in df.columns):
+                raise ValueError("Column "+col+" does not exist")
+        if (pd.isna(df[["SensorID","Comp","CGM"]])).any().any():
+            raise ValueError("Dataset contains NA entries")
+        if df.shape[0] == 0:
+            return self
+
+        dat = data_processing(df[["SensorID","Comp","CGM"]].copy())
+        code, sensors = pd.factorize(dat["SensorID"])
+        stats = sensor_stats(dat, code, len(sensors), self.limits)
+
+        # Replicates: weighted sums of the sensors of the batch
+        self.replicates += self.weights(sensors).T @ stats
+
+        # Sums of each sensor for the jackknife and the Wilson intervals
+        # SensorIDs are kept as strings (as for the weights), so that the keys agree after save and load
+        rows = [self.sensors.setdefault(str(s), len(self.sensors)) for s in sensors]
+        if len(self.sensors) > self.stats.shape[0]:
+            self.stats = np.vstack([self.stats, np.zeros((len(self.sensors)-self.stats.shape[0], self.stats.shape[1]))])
+        self.stats[rows,:] += stats
+
+        return self
+
+    @property
+    def n_datapoints(self):
+        return int(self.stats[:,3].sum())
+
+    def replicate_AR(self):
+        """
+        Agreement rates of the replicates as numpy array (4xLxN_BS), NaN if a replicate has no data in a range
+
+        """
+
+        L = len(self.limits)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            BS_AR = self.replicates[:,4:].reshape(-1, 4, L) / self.replicates[:,:4,None] * 100
+        return np.moveaxis(BS_AR, 0, -1)
+
+    def bounds(self, alpha=0.05):
+        """
+        Current agreement rates and bootstrapped lower bounds
+
+        Input:
+        alpha:      Significance level of lower one-sided bounds
+
+        Output:
+        AR:         Numpy array (4xL) of agreement rates
+        PC_CI:      Numpy array (4xL) of percentile bounds
+        BCa_CI:     Numpy array (4xL) of BCa bounds (percentile bound if BCa is not defined,
+                    NaN for agreement rates of 0 or 100 %)
+
+        """
+
+        L = len(self.limits)
+        tot = self.stats.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            AR = tot[4:].reshape(4, L) / tot[:4,None] * 100
+        BS_AR = self.replicate_AR()
+        a = stats_acceleration(self.stats, L) if len(self.sensors) else np.full((4, L), np.nan)
+
+        PC_CI = np.full((4, L), np.nan)
+        BCa_CI = np.full((4, L), np.nan)
+        for r in range(4):
+            for l in range(L):
+                dat = BS_AR[r,l,:][~np.isnan(BS_AR[r,l,:])]
+                if len(dat) == 0 or np.isnan(AR[r,l]):
+                    continue
+                PC_CI[r,l] = np.quantile(dat, alpha)
+                if (AR[r,l] == 0) | (AR[r,l] == 100):
+                    continue
+                # BCa is not defined if all samples are on one side of the estimate or without acceleration
+                if np.isnan(a[r,l]) or dat.min() >= AR[r,l] or dat.max() <= AR[r,l]:
+                    BCa_CI[r,l] = PC_CI[r,l]
+                else:
+                    BCa_CI[r,l] = BCa(dat, AR[r,l], a[r,l], alpha=alpha)
+
+        return AR, PC_CI, BCa_CI
+
+    def compute(self, alpha=0.05, metrics=None):
+        """
+        Agreement rates and their lower confidence intervals of all data received so far
+
+        Input:
+        alpha:      Significance level of lower one-sided confidence intervals
+        metrics:    Metrics object for recording processing times of the processing stages (optional)
+
+        Output:
+        res:        CI_Results object (as CI_compute), BS_AR contains the agreement rates of the replicates
+
+        """
+
+        if len(self.sensors) == 0:
+            raise ValueError("No data received")
+
+        metrics = Metrics() if metrics is None else metrics
+        info = {"tool": "CI_online", "n_datapoints": self.n_datapoints, "n_sensors": len(self.sensors),
+                "N_BS": self.N_BS, "seed": self.seed, "alpha": alpha, "limits": self.limits}
+        metrics.info.update(info)
+
+        AR, CP_CI, WCC_CI, WCC_ICC, _, _ = stats_intervals(self.stats, self.limits, alpha=[alpha], N_BS=0,
+                                                           metrics=metrics)
+        with metrics.span("BCa"):
+            _, _, BCa_CI = self.bounds(alpha)
+            # Clopper-Pearson for agreement rates of 0 or 100 % (as in stats_intervals)
+            BCa_CI = np.where((AR == 0) | (AR == 100), CP_CI[:,:,0], BCa_CI)
+
+        RES = results_table(AR, CP_CI[:,:,0], WCC_CI[:,:,0], WCC_ICC, BCa_CI, self.limits,
+                            ["Seed: "+str(self.seed), "N_BS: "+str(self.N_BS)+" (Poisson)",
+                             "Conf_Level: "+str(alpha), np.nan])
+
+        return CI_Results(RES=RES, AR=AR, CP_CI=CP_CI[:,:,0], WCC_CI=WCC_CI[:,:,0], WCC_ICC=WCC_ICC,
+                          BCa_CI=BCa_CI, BS_AR=self.replicate_AR(), info=info)
+
+    def save(self, file):
+        """
+        Save the state (replicates and sums of the sensors) as npz file
+
+        """
+
+        np.savez(file, replicates=self.replicates, stats=self.stats,
+                 sensors=np.array([str(s) for s in self.sensors]), limits=np.array(self.limits, dtype=float),
+                 seed=np.array(self.seed))
+
+    @classmethod
+    def load(cls, file):
+        """
+        Load a state saved with save (SensorIDs are kept as strings)
+
+        """
+
+        with np.load(file) as f:
+            limits = [int(lim) if float(lim).is_integer() else float(lim) for lim in f["limits"]]
+            online = cls(N_BS=f["replicates"].shape[0], limits=limits, seed=int(f["seed"]))
+            online.replicates = f["replicates"].copy()
+            online.stats = f["stats"].copy()
+            online.sensors = {s: i for i, s in enumerate(f["sensors"].tolist())}
+
+        return online
@@ -0,0 +1,168 @@
+"""
+Sample size and power planning for the assessment of compliance with FDA iCGM criteria
+
+Estimates the probability that the lower one-sided confidence intervals on the agreement rates
+(clustered continuity-corrected Wilson method, see CI_calculation.py) exceed the FDA iCGM
+thresholds for a grid of study designs (number of sensors x points per sensor x ICC)
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import numpy as np
+import pandas as pd
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from CI_calculation import WilsonCC
+
+# FDA iCGM criteria on the lower one-sided confidence intervals of the agreement rates
+# Range 1: <70, 2: 70-180, 3: >180, 4: Total (ranges assigned according to CGM)
+# Share: expected share of a sensor's datapoints in the range (default based on Test_Data.csv)
+FDA_iCGM = pd.DataFrame({
+    "Criterion": ["AR15 <70","AR15 70-180","AR15 >180","AR40 <70","AR40 70-180","AR40 >180","AR20 Total"],
+    "Range":     [1,2,3,1,2,3,4],
+    "Limit":     [15,15,15,40,40,40,20],
+    "Threshold": [85,70,80,98,99,99,87],
+    "Share":     [0.1,0.45,0.45,0.1,0.45,0.45,1]})
+
+
+def simulate_hits(n_sens, m, AR, icc, N_sim, rng):
+    """
+    Simulate clustered binary data (within/outside agreement limit) using a beta-binomial model
+    The sensor-specific agreement probabilities follow a beta distribution with mean AR and
+    intra-cluster correlation icc
+
+    Input:
+    n_sens:     Number of sensors (clusters)
+    m:          Number of datapoints per sensor
+    AR:         True agreement rate (0 to 1)
+    icc:        Intra-cluster correlation (0 to 1)
+    N_sim:      Number of simulated datasets
+    rng:        numpy random Generator
+
+    Output:
+    x:          Numpy array (N_sim x n_sens) of hits per sensor
+    m:          Numpy array (N_sim x n_sens) of datapoints per sensor
+
+    """
+
+    m = np.full((N_sim,n_sens), m)
+
+    if icc <= 0 or AR <= 0 or AR >= 1:
+        p = np.full((N_sim,n_sens), AR)
+    else:
+        # Beta parameters with mean AR and ICC = 1/(a+b+1)
+        s = (1-icc)/icc
+        p = rng.beta(AR*s, (1-AR)*s, size=(N_sim,n_sens))
+
+    x = rng.binomial(m, p)
+
+    return x, m
+
+
+def power_WilsonCC(n_sens, n_pts, AR, icc, threshold, alpha=0.05, N_sim=1000, seed=None):
+    """
+    Estimate the probability that the lower one-sided clustered continuity-corrected Wilson
+    interval on an agreement rate exceeds a threshold
+
+    Input:
+    n_sens:     Number of sensors
+    n_pts:      Number of datapoints per sensor (in the respective glucose range)
+    AR:         Assumed true agreement rate in %
+    icc:        Assumed intra-cluster correlation
+    threshold:  Threshold for the lower confidence interval in %
+    alpha:      Significance level
+    N_sim:      Number of simulated datasets
+    seed:       Seed for random number generator (integer or numpy SeedSequence)
+
+    Output:
+    pwr:        Probability of meeting the criterion (0 to 1)
+
+    """
+
+    rng = np.random.default_rng(seed)
+
+    x, m = simulate_hits(n_sens, n_pts, AR/100, icc, N_sim, rng)
+    WCC_CI, _ = WilsonCC(x, m, alpha=alpha, warn=False)
+
+    return np.mean(WCC_CI*100 > threshold)
+
+
+def CI_planning(N_sensors, N_points, ICC, AR, criteria=FDA_iCGM,
+                    alpha=0.05, N_sim=1000, seed=1, n_jobs=None):
+    """
+    Power analysis for a grid of study designs
+
+    Inputs:
+    N_sensors:  List of number of sensors (at least 2)
+    N_points:   List of number of datapoints per sensor (all glucose ranges), at least 2 datapoints per
+                sensor are required in the glucose range of each criterion (N_points*Share)
+    ICC:        List of assumed intra-cluster correlations
+    AR:         Dict with assumed true agreement rates in % for each criterion, e.g. {"AR15 <70": 90, ...}
+                or list in the order of criteria
+    criteria:   DataFrame with columns "Criterion", "Threshold" (%) and "Share" (expected share of
+                datapoints in the glucose range), default: FDA iCGM criteria
+    alpha:      Significance level of lower one-sided confidence intervals
+    N_sim:      Number of simulated datasets per design and criterion
+    seed:       Seed for random number generator, provide [] when random seed shall be used
+    n_jobs:     Number of worker processes, None or 1 for sequential processing
+
+    Output:
+    PWR:        DataFrame with one row per design and the probability (0 to 1) of meeting each criterion
+
+    """
+
+    if not isinstance(AR, dict):
+        AR = dict(zip(criteria["Criterion"], AR))
+    for crit in criteria["Criterion"]:
+        if not(crit in AR):
+            raise ValueError("No agreement rate provided for criterion "+crit)
+    # The ICC of the clustered Wilson interval is not defined for a single sensor or datapoint per sensor
+    # (NaN intervals, i.e. a power of 0 without notice)
+    if min(N_sensors) < 2:
+        raise ValueError("At least 2 sensors are required")
+    # Beta distributed agreement rates of the sensors require 0 <= ICC < 1 (ICC = 0: independent datapoints)
+    for icc in ICC:
+        if not(0 <= icc < 1):
+            raise ValueError("ICC = "+str(icc)+" is not valid, 0 <= ICC < 1 is required")
+
+    # Design grid
+    PWR = pd.DataFrame(list(itertools.product(N_sensors,N_points,ICC)),columns=["N_Sensors","N_Points","ICC"])
+
+    # One task per design and criterion
+    tasks = []
+    for d in PWR.itertuples():
+        for c in criteria.itertuples():
+            n_pts = int(np.round(d.N_Points*c.Share))
+            if n_pts < 2:
+                raise ValueError("N_Points = "+str(d.N_Points)+" gives "+str(n_pts)+" datapoints per sensor for criterion "+
+                                 c.Criterion+", at least 2 are required")
+            tasks.append((d.N_Sensors, n_pts, AR[c.Criterion], d.ICC, c.Threshold))
+    n_sens, n_pts, ar, icc, thr = [list(t) for t in zip(*tasks)]
+
+    # Independent random streams for each task (reproducible regardless of the number of workers)
+    seeds = np.random.SeedSequence(seed if seed else None).spawn(len(tasks))
+
+    print("Power analysis ("+str(PWR.shape[0])+" designs, N_sim = "+str(N_sim)+") ... ")
+    args = (n_sens, n_pts, ar, icc, thr, [alpha]*len(tasks), [N_sim]*len(tasks), seeds)
+    if n_jobs is None or n_jobs == 1:
+        pwr = list(map(power_WilsonCC, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as ex:
+            pwr = list(ex.map(power_WilsonCC, *args, chunksize=max(len(tasks)//(4*n_jobs),1)))
+
+    # Collect results
+    pwr = np.array(pwr).reshape(PWR.shape[0],criteria.shape[0])
+    for j,crit in enumerate(criteria["Criterion"]):
+        PWR[crit] = pwr[:,j]
+    PWR["Info"] = ""
+    PWR.at[0,"Info"] = "N_sim: "+str(N_sim)+" Seed: "+str(seed)
+
+    print("DONE")
+
+    return PWR
@@ -0,0 +1,181 @@
+"""
+Preprocessed paired dataset shared by CI_calculation and CG_DIVA
+
+The deviations and both range assignments (according to CGM for CI_calculation and according to the
+comparator for CG_DIVA) are calculated once and stored in read-only arrays. CI_compute, CI_calculation,
+CI_sensitivity, CG_DIVA_compute, CG_DIVA and CG_DIVA_sensitivity accept a Dataset instead of a dataframe
+and use its processed data without copying and without modifying the input data.
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def readonly(x):
+    """
+    Numpy array that cannot be modified
+    """
+
+    x = np.ascontiguousarray(x)
+    x.flags.writeable = False
+    return x
+
+
+class Dataset:
+    """
+    Immutable array-backed dataset of paired CGM and comparator values
+
+    Input:
+    df:         Pandas dataframe with columns "SensorID", "Comp", "CGM" and optionally "PatientID"
+    dtype:      Float type of the stored values (np.float64 or np.float32). With np.float64 the results of
+                the tools are identical to the results with the dataframe
+
+    Attributes (read-only numpy arrays):
+    sensor:     Integer sensor code of each datapoint (index of sensors)
+    sensors:    Sensor identifiers
+    patient:    Integer patient code of each datapoint (None without column "PatientID")
+    patients:   Patient identifiers (None without column "PatientID")
+    comp, cgm:  Comparator and CGM values
+    abs_diff:   Absolute difference CGM - Comp
+    rel_diff:   Relative difference in %
+    range_ci:   Glucose range according to CGM (1: <70, 2: 70-180, 3: >180)
+    diff_ci:    Absolute difference for CGM <70, relative difference otherwise
+    range_cg:   Glucose range according to comparator
+    diff_cg:    Absolute difference for Comp <70, relative difference otherwise
+
+    Usage:
+    data = Dataset(df)
+    CI_compute(data,...), CG_DIVA_compute(data,...)
+
+    """
+
+    __slots__ = ("index","sensor","sensors","patient","patients","comp","cgm","abs_diff","rel_diff",
+                 "range_ci","diff_ci","range_cg","diff_cg","_frames")
+
+    def __init__(self, df, dtype=np.float64):
+        ## Check inputs
+        for col in ["SensorID","Comp","CGM"]:
+            if not(col in df.columns):
+                raise ValueError("Column "+col+" does not exist")
+        for col in ["SensorID","Comp","CGM"] + ["PatientID"]*("PatientID" in df.columns):
+            if (pd.isna(df[col])).any():
+                raise ValueError("Column "+col+" contains NA entries")
+        for col in ["Comp","CGM"]:
+            if df[col].dtype != "float64" and df[col].dtype != "int64":
+                raise ValueError("Column "+col+" contains non-number entries")
+
+        init = lambda name, value: object.__setattr__(self,name,value)
+        init("_frames",{})
+        init("index",df.index)
+
+        # Integer codes in order of appearance
+        code, ids = pd.factorize(df["SensorID"])
+        init("sensor",readonly(code.astype(np.int32)))
+        init("sensors",readonly(np.asarray(ids)))
+        if "PatientID" in df.columns:
+            code, ids = pd.factorize(df["PatientID"])
+            init("patient",readonly(code.astype(np.int32)))
+            init("patients",readonly(np.asarray(ids)))
+        else:
+            init("patient",None)
+            init("patients",None)
+
+        # Deviations (same operations as data_processing of the tools)
+        comp = df["Comp"].to_numpy()
+        cgm = df["CGM"].to_numpy()
+        abs_diff = cgm - comp
+        rel_diff = abs_diff / comp * 100
+        init("comp",readonly(comp.astype(dtype)))
+        init("cgm",readonly(cgm.astype(dtype)))
+        init("abs_diff",readonly(abs_diff.astype(dtype)))
+        init("rel_diff",readonly(rel_diff.astype(dtype)))
+
+        # Ranges according to CGM (CI_calculation) and comparator (CG_DIVA)
+        for name, ref in [("ci",cgm),("cg",comp)]:
+            init("range_"+name,readonly(((ref<70)*1 + ((ref>=70) & (ref<=180))*2 + (ref>180)*3).astype(np.int8)))
+            init("diff_"+name,readonly(((ref<70)*abs_diff + (ref>=70)*rel_diff).astype(dtype)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Dataset is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Dataset is immutable")
+
+    def __len__(self):
+        return len(self.sensor)
+
+    def __repr__(self):
+        return "Dataset({} datapoints, {} sensors{})".format(len(self),self.n_sensors,
+            "" if self.patient is None else ", {} patients".format(len(self.patients)))
+
+    @property
+    def n_datapoints(self):
+        return len(self.sensor)
+
+    @property
+    def n_sensors(self):
+        return len(self.sensors)
+
+    @property
+    def has_patients(self):
+        return self.patient is not None
+
+    def frame(self, tool):
+        """
+        Processed dataframe of a tool as returned by its data_processing (Range 4 (Total) appended).
+        The columns are created on first use as read-only arrays that are shared by all calls, each call
+        returns a new dataframe of these arrays (changing values raises a ValueError).
+
+        Input:
+        tool:       "CI_calculation" (ranges according to CGM, with columns WI15, WI20 and WI40) or
+                    "CG_DIVA" (ranges according to comparator)
+
+        Output:
+        Pandas dataframe
+
+        """
+
+        if not(tool in ["CI_calculation","CG_DIVA"]):
+            raise ValueError("tool must be CI_calculation or CG_DIVA")
+        if tool in self._frames:
+            return pd.DataFrame(self._frames[tool],index=self.index.append(self.index),copy=False)
+
+        twice = lambda x: readonly(np.concatenate([x,x]))
+        rng, diff = (self.range_ci, self.diff_ci) if tool == "CI_calculation" else (self.range_cg, self.diff_cg)
+        cols = {"SensorID": twice(self.sensors[self.sensor])}
+        if self.patient is not None:
+            cols["PatientID"] = twice(self.patients[self.patient])
+        cols.update({"Comp": twice(self.comp), "CGM": twice(self.cgm),
+                     "AbsDiff": twice(self.abs_diff), "RelDiff": twice(self.rel_diff),
+                     "Range": readonly(np.concatenate([rng,np.full(len(self),4,dtype=np.int8)]).astype(np.float64)),
+                     "Diff": readonly(np.concatenate([diff,self.rel_diff]))})
+        if tool == "CI_calculation":
+            for lim in [15,20,40]:
+                cols["WI"+str(lim)] = readonly((np.abs(cols["Diff"]) <= lim)*1)
+
+        self._frames[tool] = cols
+        return self.frame(tool)
+
+    @property
+    def ci_data(self):
+        """
+        Processed dataframe of CI_calculation
+        """
+
+        return self.frame("CI_calculation")
+
+    @property
+    def cg_data(self):
+        """
+        Processed dataframe of CG_DIVA
+        """
+
+        return self.frame("CG_DIVA")
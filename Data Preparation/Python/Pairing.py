@@ -0,0 +1,280 @@
+"""
+Pairing of raw CGM and comparator time series to the paired datapoints (SensorID, Comp, CGM) used by
+CG_DIVA and CI_calculation
+
+Each comparator measurement is paired with a CGM reading of the same sensor within a time window (nearest,
+previous or next reading, or linear interpolation between the neighbouring readings). The matching is
+done for all sensors at once on sorted arrays, so that studies with tens of millions of CGM readings can
+be paired in a few seconds.
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+METHODS = ["nearest","previous","next","linear"]
+
+NS_MIN = 60 * 10**9
+
+
+def timestamps(t):
+    """
+    Timestamps as int64 nanoseconds
+
+    Input:
+    t:      Array/Series of datetimes, datetime strings or numbers (interpreted as minutes)
+
+    Output:
+    int64 numpy array with nanoseconds
+
+    """
+
+    t = pd.Series(t) if not isinstance(t,pd.Series) else t
+    if pd.api.types.is_numeric_dtype(t) and not pd.api.types.is_bool_dtype(t):
+        return np.round(t.to_numpy(dtype=np.float64) * NS_MIN).astype(np.int64)
+    t = pd.to_datetime(t)
+    if getattr(t.dt,"tz",None) is not None:
+        t = t.dt.tz_convert("UTC").dt.tz_localize(None)
+    return t.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+def sort_order(code, t):
+    """
+    Order of the readings sorted by sensor code and time (stable, i.e. equal readings keep their order)
+
+    Input:
+    code:   int64 array of sensor codes (0 ... n_sens-1)
+    t:      int64 array of timestamps
+
+    Output:
+    Index array
+
+    """
+
+    if len(t) == 0:
+        return np.zeros(0,dtype=np.int64)
+    # Time relative to the first reading of each sensor
+    t0 = pd.Series(t).groupby(code).min().reindex(range(code.max()+1),fill_value=0).to_numpy()
+    rel = t - t0[code]
+    span = int(rel.max()) + 1
+    # A single sort key is about twice as fast as a lexicographic sort
+    if span * len(t0) < 2**62:
+        return np.argsort(code.astype(np.int64)*span + rel,kind="stable")
+    return np.lexsort((t,code))
+
+
+def neighbours(cgm_code, cgm_time, comp_code, comp_time, before, after):
+    """
+    Previous and next CGM reading of the same sensor for each comparator measurement
+
+    Input:
+    cgm_code, cgm_time:     Sensor codes and timestamps (int64) of the CGM readings
+    comp_code, comp_time:   Sensor codes and timestamps (int64) of the comparator measurements
+    before, after:          Maximum time (same unit as timestamps) between comparator measurement and previous
+                            / next CGM reading
+
+    Output:
+    prev, nxt:              Index of the previous (time <= comparator time) and next (time > comparator time)
+                            CGM reading within the window, -1 if there is none
+    dt_prev, dt_next:       Time differences to these readings
+
+    """
+
+    n_c = len(cgm_code)
+    if n_c == 0:
+        none = np.full(len(comp_code),-1,dtype=np.int64)
+        return none, none.copy(), np.zeros(len(comp_code),dtype=np.int64), np.zeros(len(comp_code),dtype=np.int64)
+    code = np.concatenate([cgm_code,comp_code])
+    t = np.concatenate([cgm_time,comp_time])
+
+    # CGM readings come first, so that they precede comparator measurements with equal timestamps
+    order = sort_order(code,t)
+    is_cgm = order < n_c
+    pos = np.arange(len(order))
+    last = np.maximum.accumulate(np.where(is_cgm,pos,-1))
+    first = np.minimum.accumulate(np.where(is_cgm,pos,len(order))[::-1])[::-1]
+
+    sel = ~is_cgm
+    r = order[sel] - n_c
+    prev = np.full(len(comp_code),-1,dtype=np.int64)
+    nxt = np.full(len(comp_code),-1,dtype=np.int64)
+    prev[r] = np.where(last[sel] >= 0,order[np.maximum(last[sel],0)],-1)
+    nxt[r] = np.where(first[sel] < len(order),order[np.minimum(first[sel],len(order)-1)],-1)
+
+    # Readings of other sensors or outside the window
+    dt_prev = comp_time - cgm_time[prev]
+    dt_next = cgm_time[nxt] - comp_time
+    prev[(prev < 0) | (cgm_code[prev] != comp_code) | (dt_prev > before)] = -1
+    nxt[(nxt < 0) | (cgm_code[nxt] != comp_code) | (dt_next > after)] = -1
+
+    return prev, nxt, dt_prev, dt_next
+
+
+def pair_data(cgm, comp, window=5, lag=0, method="nearest", unique=False, columns=None,
+              wear_day=False, sensor_col="SensorID", time_col="Time", cgm_col="CGM", comp_col="Comp"):
+    """
+    Pairing of CGM readings and comparator measurements
+
+    Inputs:
+    cgm:        Pandas DataFrame with columns SensorID, Time and CGM (raw CGM time series)
+    comp:       Pandas DataFrame with columns SensorID, Time and Comp (comparator measurements). Several
+                sensors worn in parallel are given by one row per sensor
+    window:     Maximum time difference in minutes between comparator measurement and CGM reading, either
+                one value or [before, after] (CGM reading before / after the comparator measurement)
+    lag:        Time lag of the CGM in minutes. The comparator measurement at time t is paired with the CGM
+                readings around t+lag
+    method:     "nearest": nearest CGM reading (the earlier one for equal distance)
+                "previous": last CGM reading before or at the comparator measurement
+                "next": first CGM reading after the comparator measurement
+                "linear": linear interpolation between previous and next CGM reading
+    unique:     True/False whether each CGM reading is paired with one comparator measurement only (the
+                nearest one)
+    columns:    List of further columns of comp that are added to the pairs (e.g. ["PatientID"])
+    wear_day:   True/False whether the day of sensor wear (column "Day", 1 = first 24 h after the first
+                CGM reading of the sensor) is added
+    sensor_col, time_col, cgm_col, comp_col:    Column names of the input data. Times are datetimes or
+                numbers in minutes
+
+    Output:
+    Pandas DataFrame with columns SensorID, Comp, CGM, Time (time of comparator measurement), CGM_Time
+    (time of the CGM reading, for "linear" the one of the previous reading), TimeDiff (CGM_Time - Time - lag
+    in minutes) and the requested columns. Comparator measurements without CGM reading within the window
+    are dropped. The DataFrame can be used directly as input of CG_DIVA and CI_calculation.
+
+    """
+
+    if method not in METHODS:
+        raise ValueError("method must be one of {}".format(METHODS))
+    before, after = (window,window) if np.isscalar(window) else window
+    before, after = int(round(before*NS_MIN)), int(round(after*NS_MIN))
+    columns = [] if columns is None else list(columns)
+
+    # Missing values are not paired
+    cgm = cgm[cgm[cgm_col].notna() & cgm[time_col].notna()]
+    comp = comp[comp[comp_col].notna() & comp[time_col].notna()]
+
+    # Integer sensor codes for both series
+    codes, sensors = pd.factorize(np.concatenate([cgm[sensor_col].to_numpy(),comp[sensor_col].to_numpy()]))
+    cgm_code, comp_code = codes[:len(cgm)].astype(np.int64), codes[len(cgm):].astype(np.int64)
+    cgm_time = timestamps(cgm[time_col]) - int(round(lag*NS_MIN))
+    comp_time = timestamps(comp[time_col])
+    cgm_val = cgm[cgm_col].to_numpy(dtype=np.float64)
+
+    prev, nxt, dt_prev, dt_next = neighbours(cgm_code,cgm_time,comp_code,comp_time,before,after)
+
+    if method == "previous":
+        idx = prev
+    elif method == "next":
+        idx = nxt
+    elif method == "nearest":
+        idx = np.where((prev >= 0) & ((nxt < 0) | (dt_prev <= dt_next)),prev,nxt)
+    else:
+        idx = np.where((prev >= 0) & (nxt >= 0),prev,-1)
+        w = dt_prev / np.maximum(dt_prev + dt_next,1)
+        value = cgm_val[prev] + w * (cgm_val[nxt] - cgm_val[prev])
+
+    r = np.flatnonzero(idx >= 0)
+    idx = idx[r]
+    dt = cgm_time[idx] - comp_time[r]
+
+    # Each CGM reading is used for the nearest comparator measurement only
+    if unique and method != "linear":
+        o = np.lexsort((np.abs(dt),idx))
+        keep = np.ones(len(o),dtype=bool)
+        keep[1:] = idx[o[1:]] != idx[o[:-1]]
+        keep = np.sort(o[keep])
+        r, idx, dt = r[keep], idx[keep], dt[keep]
+
+    pairs = pd.DataFrame({
+        "SensorID": sensors[comp_code[r]],
+        "Comp": comp[comp_col].to_numpy(dtype=np.float64)[r],
+        "CGM": value[r] if method == "linear" else cgm_val[idx],
+        "Time": comp[time_col].to_numpy()[r],
+        "CGM_Time": cgm[time_col].to_numpy()[idx],
+        "TimeDiff": dt / NS_MIN,
+    })
+    for col in columns:
+        pairs[col] = comp[col].to_numpy()[r]
+
+    if wear_day:
+        t0 = pd.Series(cgm_time).groupby(cgm_code).min().reindex(range(len(sensors))).to_numpy()
+        pairs["Day"] = (comp_time[r] - t0[comp_code[r]] + int(round(lag*NS_MIN))) // (24*60*NS_MIN) + 1
+
+    return pairs
+
+
+def synthetic_series(n_sensors=100, n_days=10, interval=5, comp_interval=15, comp_hours=8, seed=1):
+    """
+    Synthetic raw CGM and comparator time series for testing and benchmarking the pairing
+
+    Inputs:
+    n_sensors:      Number of sensors
+    n_days:         Days of sensor wear
+    interval:       CGM measurement interval in minutes
+    comp_interval:  Comparator measurement interval in minutes
+    comp_hours:     Hours with comparator measurements per day
+    seed:           Seed for the random number generator
+
+    Output:
+    cgm, comp:      Pandas DataFrames with columns SensorID, Time and CGM / Comp (time in minutes)
+
+    """
+
+    rng = np.random.default_rng(seed)
+    phase = rng.uniform(0,2*np.pi,n_sensors)
+    bias = rng.normal(0,8,n_sensors)
+
+    # CGM readings with jittered timestamps
+    n = n_days * 24 * 60 // interval
+    t = np.tile(np.arange(n)*float(interval),n_sensors) + rng.uniform(0,interval/5,n*n_sensors)
+    glucose = 150 + 100*np.sin(t/180 + np.repeat(phase,n))
+    cgm = pd.DataFrame({"SensorID": np.repeat(np.arange(1,n_sensors+1),n),"Time": t,
+                        "CGM": np.round(glucose + np.repeat(bias,n) + rng.normal(0,15,len(t)))})
+
+    # Comparator measurements during the first comp_hours of each day
+    tc = np.concatenate([d*1440 + np.arange(0,comp_hours*60,comp_interval) for d in range(n_days)]).astype(float)
+    m = len(tc)
+    tc = np.tile(tc,n_sensors)
+    comp = pd.DataFrame({"SensorID": np.repeat(np.arange(1,n_sensors+1),m),"Time": tc,
+                         "Comp": np.round(150 + 100*np.sin(tc/180 + np.repeat(phase,m)) + rng.normal(0,2,len(tc)),1)})
+    return cgm, comp
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pairing of raw CGM and comparator time series")
+    parser.add_argument("cgm",nargs="?",help="csv file with columns SensorID, Time and CGM")
+    parser.add_argument("comp",nargs="?",help="csv file with columns SensorID, Time and Comp")
+    parser.add_argument("--window",type=float,nargs="+",default=[5],help="Window in minutes (one value or before after)")
+    parser.add_argument("--lag",type=float,default=0,help="Time lag of the CGM in minutes")
+    parser.add_argument("--method",default="nearest",choices=METHODS)
+    parser.add_argument("--unique",action="store_true",help="Use each CGM reading only once")
+    parser.add_argument("--columns",nargs="*",default=None,help="Further columns of the comparator file")
+    parser.add_argument("--wear_day",action="store_true",help="Add the day of sensor wear")
+    parser.add_argument("--output",default="Pairs.csv",help="Output csv file")
+    parser.add_argument("--benchmark",type=int,default=None,help="Pair a synthetic study with this number of sensors")
+    args = parser.parse_args()
+
+    window = args.window[0] if len(args.window) == 1 else args.window[:2]
+    if args.benchmark:
+        cgm, comp = synthetic_series(n_sensors=args.benchmark)
+        start = time.perf_counter()
+        pairs = pair_data(cgm,comp,window=window,lag=args.lag,method=args.method,unique=args.unique)
+        print("{} CGM readings, {} comparator measurements, {} pairs: {:.2f} s".format(
+            len(cgm),len(comp),len(pairs),time.perf_counter()-start))
+    else:
+        cgm = pd.read_csv(args.cgm)
+        comp = pd.read_csv(args.comp)
+        pairs = pair_data(cgm,comp,window=window,lag=args.lag,method=args.method,unique=args.unique,
+                          columns=args.columns,wear_day=args.wear_day)
+        pairs.to_csv(args.output,index=None)
+        print("{} pairs written to {}".format(len(pairs),os.path.abspath(args.output)))
@@ -0,0 +1,313 @@
+"""
+Permutation tests for differences between sensor lots (or sites) in the deviation intervals (CG-DIVA),
+agreement rates (CI_calculation) and between-sensor variability
+
+The lot labels are permuted across the sensors of a lot and the reference lot. The test statistics of all
+permutations are calculated in batches from precomputed summaries of each sensor (number of datapoints
+and hits, sorted deviations, sensor medians) without repeating the preprocessing. Several lots are
+tested on a pool of worker processes.
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import sys
+import time
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+
+# Make tools importable
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for folder in ["CG-DIVA","Confidence Intervals","Data Preparation"]:
+    sys.path.append(os.path.join(root,folder,"Python"))
+
+import CG_DIVA
+import CI_calculation as CI_calc
+from Dataset import Dataset
+
+RANGES = ["<70","70-180",">180","Total"]
+
+
+@dataclass
+class Sensor_Summaries:
+    """
+    Summaries of each sensor from which the test statistics of any group of sensors are calculated
+
+    labels:     Numpy array of the lot (group) of each sensor
+    stats:      Numpy array (n_sens x 4+4L) of number of datapoints and hits (see CI_calculation.sensor_stats)
+    values:     List (one per range) of tuples of sorted deviations and sensor index of each deviation
+                (ranges according to comparator as in CG-DIVA)
+    medians:    Numpy array (n_sens x 4) of the median deviation of each sensor (NaN for less than
+                3 datapoints, as in CG-DIVA)
+    limits:     List of limits of agreement rates
+    qtl:        Quantiles of the deviation interval limits of each range (see CG_DIVA.interval_quantiles),
+                intervals of a range with the same size as a previous interval are omitted
+
+    """
+
+    labels: np.ndarray
+    stats: np.ndarray
+    values: list
+    medians: np.ndarray
+    limits: list
+    qtl: list = field(default_factory=list)
+
+    def names(self):
+        """
+        Names of the test statistics (order of statistics)
+        """
+
+        di = lambda r: ["DI{}_{}".format(k+1,b) for k in range(len(self.qtl[r])//2) for b in ["Lower","Upper"]]
+        return ([(s,r) for r in range(4) for s in di(r)] + [("AR{:g}".format(lim),r) for r in range(4) for lim in self.limits]
+                + [("BSV_Range",r) for r in range(4)])
+
+    def subset(self, sel):
+        """
+        Summaries of the sensors sel (boolean array)
+        """
+
+        new = -np.ones(len(sel),dtype=np.int64)
+        new[sel] = np.arange(sel.sum())
+        values = [(v[sel[lab]], new[lab[sel[lab]]]) for v, lab in self.values]
+        return Sensor_Summaries(labels=self.labels[sel],stats=self.stats[sel],values=values,
+                                medians=self.medians[sel],limits=self.limits,qtl=self.qtl)
+
+    def statistics(self, M):
+        """
+        Test statistics of groups of sensors
+
+        Input:
+        M:          Numpy array (P x n_sens) of the number of times each sensor is contained in each of
+                    P groups (0/1 for subsets of sensors)
+
+        Output:
+        T:          Numpy array (P x n_stat): deviation interval limits of each range, agreement rates of
+                    each range and limit and BSV range of each range (order as in names)
+
+        """
+
+        P = M.shape[0]
+        L = len(self.limits)
+
+        # Deviation interval limits (identical to the quantiles of the pooled data of each group)
+        DI = np.concatenate([CG_DIVA.weighted_quantile(v,lab,M,self.qtl[r]) for r, (v, lab) in enumerate(self.values)],axis=1)
+
+        # Agreement rates
+        tot = M @ self.stats
+        with np.errstate(divide="ignore",invalid="ignore"):
+            AR = (tot[:,4:].reshape(P,4,L) / tot[:,:4,None] * 100).reshape(P,4*L)
+
+        # Range of sensor medians
+        med = np.where(M[:,:,None] > 0,self.medians[None,:,:],np.nan)
+        with np.errstate(invalid="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore",RuntimeWarning)      # All-NaN slices of ranges without sensors
+            BSV = np.nanmax(med,axis=1) - np.nanmin(med,axis=1)
+
+        return np.concatenate([DI,AR,BSV],axis=1)
+
+
+def sensor_summaries(df, group="Lot", limits=[15,20,40], int_sizes=None):
+    """
+    Summaries of each sensor for the permutation tests
+
+    Inputs:
+    df:         Pandas dataframe with columns "SensorID", "Comp", "CGM" and group
+    group:      Column with the lot (or site) of each sensor
+    limits:     List of limits of agreement rates (mg/dL or %)
+    int_sizes:  Interval sizes of the deviation intervals (see CG_DIVA.interval_sizes, default: FDA sizes)
+
+    Output:
+    summ:       Sensor_Summaries object
+
+    """
+
+    if not(group in df.columns):
+        raise ValueError("Column "+group+" does not exist")
+    if (pd.isna(df[group])).any():
+        raise ValueError("Column "+group+" contains NA entries")
+
+    data = Dataset(df)
+    n_sens = data.n_sensors
+    lots = pd.Series(df[group].to_numpy()).groupby(data.sensor).agg(["first","nunique"])
+    if (lots["nunique"] > 1).any():
+        raise ValueError("Sensors must belong to a single "+group)
+
+    # Number of datapoints and hits (ranges according to CGM)
+    code = np.concatenate([data.sensor,data.sensor]).astype(np.int64)
+    stats = CI_calc.sensor_stats(data.ci_data,code,n_sens,limits)
+
+    # Sorted deviations and medians of each sensor (ranges according to comparator)
+    cg = data.cg_data
+    rng = cg["Range"].to_numpy()
+    diff = cg["Diff"].to_numpy(dtype=float)
+    values = []
+    medians = np.full((n_sens,4),np.nan)
+    for r in range(4):
+        sel = rng == r+1
+        order = np.argsort(diff[sel],kind="stable")
+        values.append((diff[sel][order],code[sel][order]))
+        agg = pd.Series(diff[sel]).groupby(code[sel]).agg(["median","count"])
+        agg = agg[agg["count"] >= 3]
+        medians[agg.index.to_numpy(),r] = agg["median"].to_numpy()
+
+    # Intervals of equal size (e.g. both FDA intervals of range Total) are only tested once
+    qtl = [[q for k in range(0,len(Q),2) if not(Q[k:k+2] in [Q[j:j+2] for j in range(0,k,2)]) for q in Q[k:k+2]]
+           for Q in CG_DIVA.interval_quantiles(int_sizes)]
+
+    return Sensor_Summaries(labels=lots["first"].to_numpy(),stats=stats,values=values,medians=medians,
+                            limits=list(limits),qtl=qtl)
+
+
+def lot_test(summ, reference, lot, N_perm=10000, seed=1, batch=None):
+    """
+    Permutation test of one lot against the reference lot
+
+    Inputs:
+    summ:       Sensor_Summaries object
+    reference:  Label of the reference lot
+    lot:        Label of the tested lot
+    N_perm:     Number of random permutations
+    seed:       Seed (int or list of ints) of the random number generator
+    batch:      Number of permutations processed at once (default: chosen from the number of datapoints)
+
+    Output:
+    T_ref:      Numpy array (n_stat) of the statistics of the reference lot
+    T_lot:      Numpy array (n_stat) of the statistics of the tested lot
+    p:          Numpy array (n_stat) of two-sided p-values of the differences (lot - reference)
+
+    """
+
+    sub = summ.subset((summ.labels == reference) | (summ.labels == lot))
+    is_lot = (sub.labels == lot).astype(float)
+    T_ref, T_lot = sub.statistics(np.stack([1-is_lot,is_lot]))
+    T = np.abs(T_lot - T_ref)
+
+    # Permutations of the lot labels across the sensors of both lots
+    rng = np.random.default_rng(seed)
+    n_val = max(len(v) for v, lab in sub.values)
+    batch = batch if batch else max(1,min(N_perm,int(2e7 // max(n_val,1))))
+    exceed = np.zeros(len(T))
+    valid = np.zeros(len(T))
+    done = 0
+    while done < N_perm:
+        B = min(batch,N_perm-done)
+        M = rng.permuted(np.tile(is_lot,(B,1)),axis=1)
+        T_p = sub.statistics(np.concatenate([M,1-M]))
+        D = np.abs(T_p[:B] - T_p[B:])
+        exceed += (D >= T - 1e-10*np.maximum(np.abs(T),1)).sum(axis=0)
+        valid += (~np.isnan(D)).sum(axis=0)
+        done += B
+
+    with np.errstate(invalid="ignore"):
+        p = np.where(np.isnan(T),np.nan,(1 + exceed) / (1 + valid))
+
+    return T_ref, T_lot, p
+
+
+@dataclass
+class Permutation_Results:
+    """
+    Results of the permutation tests
+
+    RES:        Pandas dataframe with one row per lot, statistic and range and the columns "Reference",
+                "Lot", "Statistic", "Range", "Reference_Value", "Lot_Value", "Difference" and "p_value"
+    info:       Dict with meta information
+
+    """
+
+    RES: pd.DataFrame
+    info: dict = field(default_factory=dict)
+
+
+def permutation_test(df, group="Lot", reference=None, lots=None, N_perm=10000, seed=1, limits=[15,20,40],
+                     int_sizes=None, workers=1, batch=None, save_path=None, filename="Permutation_Test"):
+    """
+    Permutation tests of lots (or sites) against a reference lot
+
+    Inputs:
+    df:         Pandas dataframe with columns "SensorID", "Comp", "CGM" and group
+    group:      Column with the lot (or site) of each sensor
+    reference:  Reference lot (default: first lot in sorted order)
+    lots:       List of tested lots (default: all other lots)
+    N_perm:     Number of random permutations per lot
+    seed:       Seed for random number generator, the permutations of the k-th lot use the seed [seed, k]
+    limits:     List of limits of agreement rates (mg/dL or %)
+    int_sizes:  Interval sizes of the deviation intervals (see CG_DIVA.interval_sizes, default: FDA sizes)
+    workers:    Number of worker processes (1: no process pool)
+    batch:      Number of permutations processed at once (default: chosen from the number of datapoints)
+    save_path:  Path for saving the csv results file, None if results shall not be saved
+    filename:   Filename of results file
+
+    Output:
+    res:        Permutation_Results object
+
+    """
+
+    if save_path is not None and not(os.path.isdir(save_path)):
+        raise ValueError("Provided save_path does not exist")
+
+    start = time.time()
+    summ = sensor_summaries(df,group=group,limits=limits,int_sizes=int_sizes)
+    all_lots = sorted(pd.unique(summ.labels))
+    reference = all_lots[0] if reference is None else reference
+    lots = [l for l in all_lots if l != reference] if lots is None else list(lots)
+    for l in [reference] + lots:
+        if not(l in all_lots):
+            raise ValueError("Lot "+str(l)+" does not exist in column "+group)
+
+    print("Permutation tests ({} lots, {} permutations) ...".format(len(lots),N_perm))
+    args = [(summ,reference,l,N_perm,[seed,k],batch) for k, l in enumerate(lots)]
+    if workers > 1 and len(lots) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            out = list(ex.map(lot_test,*zip(*args)))
+    else:
+        out = [lot_test(*a) for a in args]
+
+    rows = []
+    names = summ.names()
+    for l, (T_ref, T_lot, p) in zip(lots,out):
+        for i, (stat, r) in enumerate(names):
+            rows.append({"Reference": reference, "Lot": l, "Statistic": stat, "Range": RANGES[r],
+                         "Reference_Value": T_ref[i], "Lot_Value": T_lot[i], "Difference": T_lot[i] - T_ref[i],
+                         "p_value": p[i]})
+    RES = pd.DataFrame(rows)
+    print("DONE","Processing Time: "+str(np.round(time.time()-start,2))+" seconds")
+
+    info = {"tool": "Permutation_Test", "group": group, "reference": reference, "lots": lots,
+            "n_sensors": len(summ.labels), "N_perm": N_perm, "seed": seed, "limits": list(limits)}
+
+    if save_path is not None:
+        RES.to_csv(os.path.join(save_path,filename+".csv"),index=None)
+
+    return Permutation_Results(RES=RES,info=info)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Permutation tests of sensor lots against a reference lot")
+    parser.add_argument("input",help="csv file with columns SensorID, Comp, CGM and the lot column")
+    parser.add_argument("--group",default="Lot",help="Column with the lot (or site) of each sensor")
+    parser.add_argument("--reference",default=None,help="Reference lot")
+    parser.add_argument("--N_perm",type=int,default=10000)
+    parser.add_argument("--seed",type=int,default=1)
+    parser.add_argument("--workers",type=int,default=1)
+    parser.add_argument("--save_path",default=".")
+    parser.add_argument("--filename",default="Permutation_Test")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input)
+    reference = args.reference
+    if reference is not None and df[args.group].dtype != object:
+        reference = df[args.group].dtype.type(reference)
+    res = permutation_test(df,group=args.group,reference=reference,N_perm=args.N_perm,seed=args.seed,
+                           workers=args.workers,save_path=args.save_path,filename=args.filename)
+    print(res.RES.to_string(index=False))
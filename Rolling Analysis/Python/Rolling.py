@@ -0,0 +1,322 @@
+"""
+Deviation intervals (CG-DIVA) and agreement rates (CI_calculation) over the sensor wear time and in sliding
+windows for detecting performance drift
+
+The windows are processed in temporal order. Datapoints entering and leaving a window update one sorted
+structure (binary indexed tree over the ranks of the deviations) per range for the interval limits and
+running counters for the agreement rates, i.e. each update costs O(log n) instead of recalculating the
+whole window. Bootstrapped limits can be calculated at selected checkpoints.
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import sys
+import io
+import math
+import argparse
+import contextlib
+import numpy as np
+import pandas as pd
+
+# Make tools importable
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for folder in ["CG-DIVA","Confidence Intervals","Data Preparation"]:
+    sys.path.append(os.path.join(root,folder,"Python"))
+
+import CG_DIVA
+import CI_calculation as CI_calc
+from Dataset import Dataset
+
+RANGES = ["<70","70-180",">180","Total"]
+
+
+class OrderStatistics:
+    """
+    Multiset of values with insertion, removal and k-th smallest value in O(log n)
+
+    The values that can occur are known in advance (values): the multiset is a binary indexed tree (Fenwick
+    tree) of counts over the ranks of these values. Several values are inserted or removed at once with one
+    vectorized update per tree level.
+
+    Input:
+    values:     Numpy array of all values that can be inserted (each value is addressed by its index)
+
+    Usage:
+    s = OrderStatistics(values)
+    s.add(idx), s.remove(idx), s.update(idx,d), s.kth(k), s.quantile(q)
+
+    """
+
+    __slots__ = ("sorted","rank","tree","n","top","size")
+
+    def __init__(self, values):
+        order = np.argsort(values,kind="stable")
+        self.sorted = values[order]
+        self.rank = np.empty(len(values),dtype=np.int64)
+        self.rank[order] = np.arange(1,len(values)+1)
+        self.n = len(values)
+        self.tree = np.zeros(self.n+1,dtype=np.int64)
+        self.top = 1 << self.n.bit_length() if self.n else 0
+        self.size = 0
+
+    def update(self, idx, d):
+        """
+        Insert (d=1) or remove (d=-1) the values with indices idx
+        """
+
+        r = self.rank[np.atleast_1d(idx)]
+        self.size += d*len(r)
+        # Each value updates the tree nodes on its path to the root (log n levels)
+        while len(r):
+            np.add.at(self.tree,r,d)
+            r = r + (r & -r)
+            r = r[r <= self.n]
+
+    def add(self, idx):
+        self.update(idx,1)
+
+    def remove(self, idx):
+        self.update(idx,-1)
+
+    def kth(self, k):
+        """
+        k-th smallest value (k = 0 ... size-1)
+        """
+
+        tree, n = self.tree, self.n
+        pos, step = 0, self.top
+        k += 1
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] < k:
+                pos = nxt
+                k -= tree[nxt]
+            step >>= 1
+        return float(self.sorted[pos])
+
+    def quantile(self, q):
+        """
+        Quantile with linear interpolation, identical to pandas/numpy quantiles of the current values
+        """
+
+        if self.size == 0:
+            return np.nan
+        # Virtual index as in numpy (quantiles are passed in % by pandas)
+        vi = (self.size-1) * (q*100/100)
+        prev = math.floor(vi)
+        gamma = vi - prev
+        a = self.kth(prev)
+        b = self.kth(min(prev+1,self.size-1))
+        diff = b - a
+        return b - diff*(1-gamma) if gamma >= 0.5 else a + diff*gamma
+
+    def median(self):
+        """
+        Median, identical to pandas median
+        """
+
+        if self.size == 0:
+            return np.nan
+        h = self.size // 2
+        return self.kth(h) if self.size % 2 else (self.kth(h-1) + self.kth(h)) / 2
+
+
+def window_starts(t, window, step, start=None):
+    """
+    Start times of the windows [start, start+window), all windows starting up to the last time of t
+    """
+
+    start = np.floor(np.min(t)) if start is None else start
+    n = max(int(np.floor((np.max(t) - start) / step + 1e-9)) + 1, 1)
+    return start + step*np.arange(n)
+
+
+def rolling(df, by="Day", window=1, step=1, start=None, limits=[15,20,40], int_sizes=None,
+            checkpoints=None, N_BS=10000, seed=1, alpha=0.05, conf_level=0.95, two_stage=False,
+            save_path=None, filename="Rolling"):
+    """
+    Deviation intervals (ranges according to comparator) and agreement rates (ranges according to CGM) in
+    windows over the wear time
+
+    Inputs:
+    df:             Pandas dataframe with columns "SensorID", "Comp", "CGM" and the time column by
+    by:             Column with the time of each datapoint, e.g. "Day" (day of wear, see pair_data in folder
+                    Data Preparation) or hours since sensor start
+    window:         Width of the windows (unit of column by), window=1 and step=1 with by="Day" gives one
+                    window per wear day
+    step:           Distance between the starts of consecutive windows
+    start:          Start of the first window (default: minimum of column by, rounded down)
+    limits:         Limits of the agreement rates (mg/dL or %)
+    int_sizes:      Interval sizes of the deviation intervals (see CG_DIVA.interval_sizes, default: FDA sizes)
+    checkpoints:    List of window starts at which bootstrapped limits are calculated, "all" for all windows
+                    or None
+    N_BS:           Number of bootstrap samples at the checkpoints
+    seed:           Seed for random number generator
+    alpha:          Significance level of the lower confidence limits of the agreement rates (BCa)
+    conf_level:     Confidence level of the bootstrapped deviation interval limits (BCa)
+    two_stage:      True/False whether the two-stage bootstrap is used at the checkpoints
+    save_path:      Path for saving the csv results file, None if results shall not be saved
+    filename:       Filename of results file
+
+    Output:
+    RES:            Pandas dataframe with one row per window and range and the columns "Start", "End",
+                    "Range", "N_DI" (datapoints in range according to comparator), "Median", "DI{k}_Lower",
+                    "DI{k}_Upper" (k = 1 ... number of interval sizes), "N_AR" (datapoints in range
+                    according to CGM) and "AR{limit}". At checkpoints additionally "DI{k}_Lower_CI",
+                    "DI{k}_Upper_CI" and "BCa_CI{limit}" (NaN if a window contains too few datapoints)
+
+    """
+
+    for col in ["SensorID","Comp","CGM",by]:
+        if not(col in df.columns):
+            raise ValueError("Column "+col+" does not exist")
+    if (pd.isna(df[by])).any():
+        raise ValueError("Column "+by+" contains NA entries")
+    if window <= 0 or step <= 0:
+        raise ValueError("window and step have to be positive")
+    if save_path is not None and not(os.path.isdir(save_path)):
+        raise ValueError("Provided save_path does not exist")
+
+    data = Dataset(df)
+    qtl = CG_DIVA.interval_quantiles(int_sizes)
+    K = len(qtl[0]) // 2
+    L = len(limits)
+
+    # Datapoints in temporal order
+    t = df[by].to_numpy(dtype=float)
+    order = np.argsort(t,kind="stable")
+    t_sorted = t[order]
+    starts = window_starts(t,window,step,start)
+
+    # Sorted structure per range (ranges according to comparator, Range 4: Total)
+    rng_cg = data.range_cg.astype(np.int64) - 1
+    struct = [OrderStatistics(np.where(rng_cg == r,data.diff_cg,np.nan)) for r in range(3)]
+    struct.append(OrderStatistics(data.rel_diff.astype(np.float64)))
+
+    # Running counters of datapoints and hits per range (ranges according to CGM)
+    rng_ci = data.range_ci.astype(np.int64) - 1
+    hit_r = np.abs(data.diff_ci)[:,None] <= np.asarray(limits)[None,:]
+    hit_t = np.abs(data.rel_diff)[:,None] <= np.asarray(limits)[None,:]
+    n_ar = np.zeros(4,dtype=np.int64)
+    hits = np.zeros((4,L),dtype=np.int64)
+
+    def update(idx, d):
+        """
+        Datapoints idx entering (d=1) or leaving (d=-1) the window
+        """
+        r = rng_cg[idx]
+        for k in range(3):
+            struct[k].update(idx[r == k],d)
+        struct[3].update(idx,d)
+        r = rng_ci[idx]
+        n_ar[:3] += d*np.bincount(r,minlength=3)
+        n_ar[3] += d*len(idx)
+        for k in range(3):
+            hits[k] += d*hit_r[idx[r == k]].sum(axis=0)
+        hits[3] += d*hit_t[idx].sum(axis=0)
+
+    if checkpoints is not None:
+        checkpoints = starts if isinstance(checkpoints,str) and checkpoints == "all" else np.asarray(checkpoints,dtype=float)
+
+    rows = []
+    lo = hi = 0
+    for s in starts:
+        e = s + window
+        # Datapoints entering and leaving the window
+        hi_new = np.searchsorted(t_sorted,e,side="left")
+        update(order[hi:hi_new],1)
+        hi = hi_new
+        lo_new = max(min(np.searchsorted(t_sorted,s,side="left"),hi),lo)
+        update(order[lo:lo_new],-1)
+        lo = lo_new
+
+        res = [{"Start": s, "End": e, "Range": RANGES[r], "N_DI": struct[r].size, "Median": struct[r].median()}
+               for r in range(4)]
+        for r in range(4):
+            for k in range(K):
+                res[r]["DI{}_Lower".format(k+1)] = struct[r].quantile(qtl[r][2*k])
+                res[r]["DI{}_Upper".format(k+1)] = struct[r].quantile(qtl[r][2*k+1])
+            res[r]["N_AR"] = int(n_ar[r])
+            for l, lim in enumerate(limits):
+                res[r]["AR{:g}".format(lim)] = hits[r,l] / n_ar[r] * 100 if n_ar[r] else np.nan
+
+        # Bootstrapped limits at checkpoints
+        if checkpoints is not None and np.isclose(checkpoints,s).any():
+            sub = df.iloc[order[lo:hi]]
+            print("Checkpoint",s)
+            for r, ci in enumerate(checkpoint_bounds(sub,limits,int_sizes,N_BS,seed,alpha,conf_level,two_stage)):
+                res[r].update(ci)
+
+        rows.extend(res)
+
+    RES = pd.DataFrame(rows)
+
+    if save_path is not None:
+        RES.to_csv(os.path.join(save_path,filename+".csv"),index=None)
+
+    return RES
+
+
+def checkpoint_bounds(df, limits, int_sizes, N_BS, seed, alpha, conf_level, two_stage):
+    """
+    Bootstrapped limits of the deviation intervals and agreement rates of one window
+
+    Output:
+    List of dicts (one per range) with the columns "DI{k}_Lower_CI", "DI{k}_Upper_CI" and "BCa_CI{limit}"
+
+    """
+
+    K = CG_DIVA.interval_sizes(int_sizes).shape[1]
+    DI_CI = np.full((4,K,2),np.nan)
+    BCa_CI = np.full((4,len(limits)),np.nan)
+    errors = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            DI_CI = CG_DIVA.CG_DIVA_sensitivity(df,int_sizes=int_sizes,conf_level=[conf_level],N_BS=N_BS,seed=seed,
+                                                two_stage=two_stage).DI_CI[...,0]
+        except ValueError as e:
+            errors.append("CG_DIVA: "+str(e))
+        try:
+            BCa_CI = CI_calc.CI_sensitivity(df,limits=limits,alpha=[alpha],N_BS=N_BS,seed=seed,
+                                            two_stage=two_stage).BCa_CI[...,0]
+        except ValueError as e:
+            errors.append("CI_calculation: "+str(e))
+    for e in errors:
+        print("WARNING: No bootstrapped limits at checkpoint,",e)
+
+    res = []
+    for r in range(4):
+        ci = {}
+        for k in range(K):
+            ci["DI{}_Lower_CI".format(k+1)] = DI_CI[r,k,0]
+            ci["DI{}_Upper_CI".format(k+1)] = DI_CI[r,k,1]
+        for l, lim in enumerate(limits):
+            ci["BCa_CI{:g}".format(lim)] = BCa_CI[r,l]
+        res.append(ci)
+    return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deviation intervals and agreement rates over the wear time")
+    parser.add_argument("input",help="csv file with columns SensorID, Comp, CGM and the time column")
+    parser.add_argument("--by",default="Day",help="Time column (default: Day)")
+    parser.add_argument("--window",type=float,default=1,help="Width of the windows")
+    parser.add_argument("--step",type=float,default=1,help="Distance between window starts")
+    parser.add_argument("--checkpoints",type=float,nargs="*",default=None,help="Window starts with bootstrapped limits")
+    parser.add_argument("--N_BS",type=int,default=10000)
+    parser.add_argument("--seed",type=int,default=1)
+    parser.add_argument("--save_path",default=".")
+    parser.add_argument("--filename",default="Rolling")
+    args = parser.parse_args()
+
+    RES = rolling(pd.read_csv(args.input),by=args.by,window=args.window,step=args.step,
+                  checkpoints=args.checkpoints,N_BS=args.N_BS,seed=args.seed,
+                  save_path=args.save_path,filename=args.filename)
+    print(RES.to_string(index=False))
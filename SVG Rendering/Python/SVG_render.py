@@ -0,0 +1,493 @@
+"""
+Direct SVG/HTML rendering of the CG-DIVA, DGR and CTCA figures without matplotlib
+
+The figures are written as compact SVG from the computed results with the geometry of the figures of
+the tools (DI_plot and S2SV_plot of CG_DIVA, DGR_plot, CTCA): same axis limits, colored areas, boxes,
+cells, bars and labels in data coordinates. Figures render in milliseconds and can be embedded into
+HTML pages (see html_page).
+
+For documentation see
+https://github.com/IfDTUlm/CGM_Performance_Assessment
+
+Created by: Institut für Diabetes-Technology Forschungs- und Entwichlungsgesellschaft mbH an der Universität Ulm
+Contact: cgm_performance@idt-ulm.de
+
+This is a free software and comes with ABSOLUTELY NO WARRANTY
+"""
+
+import os
+import sys
+import html
+import numpy as np
+
+# Make tools importable (matplotlib is only imported by the tools when a matplotlib figure is created)
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for folder in ["CG-DIVA","Dynamic Glucose Region (DGR) Plot","Clinical Trend Concurrence Analysis"]:
+    sys.path.append(os.path.join(root,folder,"Python"))
+
+import DGR_plot as DGR
+import CTCA as CTCA_tool
+
+PX = 96/2.5         # Pixels per unit of figsize (figsize in cm is divided by 2.5 as in the tools)
+PT = 96/72          # Pixels per point (line widths and font sizes)
+
+# Matplotlib colors without SVG name
+COLORS = {"tab:green": "#2ca02c", "tab:blue": "#1f77b4", "k": "black"}
+
+# Unicode arrows of the mathtext arrows in the CTCA tick labels
+ARROWS = {r"$\downdownarrows$": "⇊", r"$\downarrow$": "↓", r"$\searrow$": "↘",
+          r"$\rightarrow$": "→", r"$\nearrow$": "↗", r"$\uparrow$": "↑",
+          r"$\upuparrows$": "⇈"}
+
+
+def num(v):
+    """
+    Compact number format of coordinates (2 decimals)
+    """
+
+    s = ("%.2f" % v).rstrip("0").rstrip(".")
+    return "0" if s == "-0" else s
+
+
+def color(c):
+    """
+    SVG color of a matplotlib color name or RGB tuple (0 to 1)
+    """
+
+    if isinstance(c,(tuple,list)):
+        return "#%02x%02x%02x" % tuple(int(round(x*255)) for x in c[:3])
+    return COLORS.get(c,c)
+
+
+class SVG:
+    """
+    Minimal SVG document, elements are appended as strings
+
+    Input:
+    width, height:  Size in pixels
+    font_size:      Default font size in points
+
+    """
+
+    def __init__(self, width, height, font_size=10):
+        self.width, self.height = width, height
+        self.font_size = font_size
+        self.defs = []
+        self.items = []
+
+    def element(self, tag, content=None, **attr):
+        a = "".join(' {}="{}"'.format(k.replace("_","-"),num(v) if isinstance(v,(int,float,np.number)) else v)
+                    for k, v in attr.items() if v is not None)
+        self.items.append("<{}{}>{}</{}>".format(tag,a,content,tag) if content is not None else "<{}{}/>".format(tag,a))
+
+    def text(self, x, y, s, ha="left", va="baseline", c="black", size=None, weight=None, alpha=None, rotate=None):
+        """
+        Text at pixel position (x, y), alignment as in matplotlib (ha: left/center/right,
+        va: baseline/bottom/center/top), several lines separated by newline
+        """
+
+        lines = str(s).split("\n")
+        size = (self.font_size if size is None else size)*PT
+        # Offset of the first line from the anchor (line spacing 1.2)
+        first = {"top": 0.8, "center": 0.35 - 0.6*(len(lines)-1)}.get(va,-1.2*(len(lines)-1) - 0.2*(va == "bottom"))
+        content = "".join('<tspan x="{}" dy="{}em">{}</tspan>'.format(num(x),num(first if i == 0 else 1.2),html.escape(l))
+                          for i, l in enumerate(lines))
+        self.element("text",content,x=x,y=y,fill=color(c),font_size=round(size,1),font_weight=weight,opacity=alpha,
+                     text_anchor={"left": None, "center": "middle", "right": "end"}[ha],
+                     transform=None if rotate is None else "rotate({} {} {})".format(num(rotate),num(x),num(y)))
+
+    def to_string(self):
+        return ('<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}" viewBox="0 0 {w} {h}" '
+                'font-family="Arial,Helvetica,sans-serif">'.format(w=num(self.width),h=num(self.height))
+                + ("<defs>"+"".join(self.defs)+"</defs>" if self.defs else "")
+                + '<rect width="100%" height="100%" fill="white"/>' + "".join(self.items) + "</svg>")
+
+
+class Axes:
+    """
+    Plot area with linear data coordinates (as an axis of matplotlib)
+
+    Input:
+    svg:        SVG document
+    box:        [left, top, width, height] of the plot area in pixels
+    xlim, ylim: Limits of the data coordinates
+
+    """
+
+    def __init__(self, svg, box, xlim, ylim):
+        self.svg, self.box = svg, box
+        self.xlim, self.ylim = list(xlim), list(ylim)
+        self.clip = "url(#c{})".format(len(svg.defs))
+        svg.defs.append('<clipPath id="c{}"><rect x="{}" y="{}" width="{}" height="{}"/></clipPath>'.format(
+                        len(svg.defs),*[num(v) for v in box]))
+
+    def X(self, x):
+        return self.box[0] + (np.asarray(x,dtype=float)-self.xlim[0])/(self.xlim[1]-self.xlim[0])*self.box[2]
+
+    def Y(self, y):
+        return self.box[1] + (self.ylim[1]-np.asarray(y,dtype=float))/(self.ylim[1]-self.ylim[0])*self.box[3]
+
+    def rect(self, x0, y0, x1, y1, fill="none", alpha=None, edge=None, lw=None, clip=True):
+        X, Y = sorted([self.X(x0),self.X(x1)]), sorted([self.Y(y0),self.Y(y1)])
+        self.svg.element("rect",x=X[0],y=Y[0],width=X[1]-X[0],height=Y[1]-Y[0],fill=color(fill),fill_opacity=alpha,
+                         stroke=None if edge is None else color(edge),stroke_width=None if lw is None else lw*PT,
+                         clip_path=self.clip if clip else None)
+
+    def line(self, x, y, c="black", lw=1, alpha=None, dash=None, clip=True):
+        pts = " ".join(num(a)+","+num(b) for a, b in zip(self.X(x),self.Y(y)))
+        self.svg.element("polyline",points=pts,fill="none",stroke=color(c),stroke_width=lw*PT,stroke_opacity=alpha,
+                         stroke_dasharray=dash,clip_path=self.clip if clip else None)
+
+    def polygon(self, x, y, fill, alpha=None):
+        pts = " ".join(num(a)+","+num(b) for a, b in zip(self.X(x),self.Y(y)))
+        self.svg.element("polygon",points=pts,fill=color(fill),fill_opacity=alpha,clip_path=self.clip)
+
+    def points(self, x, y, size, c, alpha=None):
+        # Markers as round line caps of zero-length path segments (compact for many points)
+        sel = ~(np.isnan(x) | np.isnan(y))
+        d = "".join("M{} {}h0".format(num(a),num(b)) for a, b in zip(self.X(x[sel]),self.Y(y[sel])))
+        if d:
+            self.svg.element("path",d=d,stroke=color(c),stroke_width=size*PT,stroke_linecap="round",
+                             stroke_opacity=alpha,clip_path=self.clip)
+
+    def text(self, x, y, s, **kwargs):
+        self.svg.text(float(self.X(x)),float(self.Y(y)),s,**kwargs)
+
+    def text_axes(self, fx, fy, s, **kwargs):
+        # Position as fraction of the axis (as transform=ax.transAxes)
+        self.svg.text(self.box[0]+fx*self.box[2],self.box[1]+(1-fy)*self.box[3],s,**kwargs)
+
+    def frame(self, xticks=[], xticklabels=None, yticks=[], yticklabels=None, xlabel=None, ylabel=None,
+              title=None, right=None, top=None, grid=False, lw=0.8):
+        """
+        Axis frame with ticks, tick labels, axis labels and title
+        right, top: (ticks in data coordinates, tick labels, axis label) of secondary axes
+        """
+
+        svg = self.svg
+        l, t, w, h = self.box
+        tick = 3.5*PT
+        if grid:
+            for y in yticks:
+                self.line(self.xlim,[y,y],c="#b0b0b0",lw=0.8)
+        svg.element("rect",x=l,y=t,width=w,height=h,fill="none",stroke="black",stroke_width=lw*PT)
+        for x, s in zip(xticks,xticklabels if xticklabels is not None else [num(x) for x in xticks]):
+            svg.element("line",x1=self.X(x),x2=self.X(x),y1=t+h,y2=t+h+tick,stroke="black",stroke_width=lw*PT)
+            svg.text(float(self.X(x)),t+h+tick+2,s,ha="center",va="top")
+        for y, s in zip(yticks,yticklabels if yticklabels is not None else [num(y) for y in yticks]):
+            svg.element("line",x1=l-tick,x2=l,y1=self.Y(y),y2=self.Y(y),stroke="black",stroke_width=lw*PT)
+            svg.text(l-tick-2,float(self.Y(y)),s,ha="right",va="center")
+        if right is not None:
+            for y, s in zip(right[0],right[1]):
+                svg.element("line",x1=l+w,x2=l+w+tick,y1=self.Y(y),y2=self.Y(y),stroke="black",stroke_width=lw*PT)
+                svg.text(l+w+tick+2,float(self.Y(y)),s,ha="left",va="center")
+            if right[2]:
+                width = max([len(str(s)) for s in right[1]]+[0])
+                svg.text(l+w+tick+4+(0.6*width+0.8)*svg.font_size*PT,t+h/2,right[2],ha="center",va="center",rotate=90)
+        if top is not None:
+            for x, s in zip(top[0],top[1]):
+                svg.element("line",x1=self.X(x),x2=self.X(x),y1=t-tick,y2=t,stroke="black",stroke_width=lw*PT)
+                svg.text(float(self.X(x)),t-tick-2,s,ha="center",va="bottom")
+            if top[2]:
+                svg.text(l+w/2,t-tick-2-1.4*svg.font_size*PT,top[2],ha="center",va="bottom")
+        if xlabel:
+            n = max([str(s).count("\n")+1 for s in (xticklabels if xticklabels is not None else [""])])
+            svg.text(l+w/2,t+h+tick+4+(n+0.3)*1.2*svg.font_size*PT,xlabel,ha="center",va="top")
+        if ylabel:
+            width = max([len(str(s)) for s in (yticklabels if yticklabels is not None else [num(y) for y in yticks])]+[0])
+            svg.text(l-tick-6-0.6*width*svg.font_size*PT,t+h/2,ylabel,ha="center",va="bottom",rotate=-90)
+        if title:
+            svg.text(l+w/2,t-15,title,ha="center",va="bottom",weight="bold")
+
+
+def save(content, save_path, filename, ext):
+    """
+    Write SVG/HTML content to save_path/filename.ext (nothing if save_path is None)
+    """
+
+    if save_path is not None:
+        if not(os.path.isdir(save_path)):
+            raise ValueError("Provided save_path does not exist")
+        with open(os.path.join(save_path,filename+ext),"w",encoding="utf-8") as f:
+            f.write(content)
+
+
+def CG_DIVA_svg(res, ylims=[-80,80], s_max=25, figsize=[16.5,8.5], save_path=None, filename="CG-DIVA"):
+    """
+    CG-DIVA figure (deviation intervals and sensor-to-sensor variability) as SVG
+
+    Input:
+    res:        CG_DIVA_Results object (see CG_DIVA_compute)
+    ylims:      Limits of y-axis
+    s_max:      Maximum number of sensors to display in sensor-to-sensor variability plot
+    figsize:    [Width,Height] of figure in cm
+    save_path:  Path for saving the svg file, None if it shall not be saved
+    filename:   Filename of svg file
+
+    Output:
+    svg:        SVG string
+
+    """
+
+    RES, df = res.RES, res.data
+    W, H = figsize[0]*PX, figsize[1]*PX
+    svg = SVG(W,H,font_size=7.5)
+    left, gap, right, top, bottom = 48, 68, 42, 32, 52
+    w, h = (W-left-gap-right)/2, H-top-bottom
+    xlbl = ["<70\n(<3.9)","70-180\n(3.9-10.0)",">180\n(>10.0)","Total"]
+    yticks = list(range(ylims[0],ylims[1]+1,20))
+    mmol = list(range(int(np.ceil(ylims[0]/18)),int(np.floor(ylims[1]/18))+1))
+
+    ## Deviation intervals (geometry of DI_plot)
+    ax = Axes(svg,[left,top,w,h],[0.5,4.5],ylims)
+    colors = [(94/255,156/255,32/255),(251/255,145/255,36/255),(238/255,12/255,4/255)]
+    al = 0.4
+    x1, x2 = [0,3.5], [3.5,4.5]
+    for x, lo, hi, c in [(x1,-15,15,0),(x2,-20,20,0),(x1,15,40,1),(x1,-40,-15,1),(x1,40,200,2),(x1,-200,-40,2),
+                         (x2,20,200,2),(x2,-200,-20,2)]:
+        ax.rect(x[0],lo,x[1],hi,fill=colors[c],alpha=al)
+    ax.frame(yticks=yticks,xlabel="Comparator Glucose Range [mg/dL (mmol/L)]",ylabel="Deviation [mg/dL or %]",
+             xticks=range(1,5),xticklabels=xlbl,title="Deviation Intervals",grid=True,
+             right=([m*18 for m in mmol],[str(m) for m in mmol],None))
+    ax.line([0,10],[0,0],c="grey")
+    for x in range(1,4):
+        ax.line([x+0.5]*2,ylims,c="grey")
+    wdth, blw = 0.5, 1.5
+    Int_size1 = ["85%","70%","80%","87%"]
+    Int_size2 = ["(98%)","(99%)","(99%)"]
+    for r in range(4):
+        pos = r+1
+        if r<3:
+            ax.rect(pos-wdth/2,RES.at[r,"DI2_Lower"],pos+wdth/2,RES.at[r,"DI2_Upper"],fill="grey",alpha=0.4,edge="black",lw=blw)
+            ax.text(pos+0.21,ylims[1]+2,Int_size2[r],ha="center",c="dimgrey")
+        ax.rect(pos-wdth/2,RES.at[r,"DI1_Lower"],pos+wdth/2,RES.at[r,"DI1_Upper"],fill="grey",alpha=0.8,edge="black",lw=blw)
+        ax.line([pos-wdth/6,pos+wdth/6],[RES.at[r,"Median"]]*2,lw=blw)
+        ax.text(pos-0.21*(r<3),ylims[1]+2,Int_size1[r],ha="center")
+    svg.text(4,H-4,"CG-DIVA "+str(res.info.get("version","")),size=6)
+
+    ## Sensor-to-sensor variability (geometry of S2SV_plot)
+    ax = Axes(svg,[left+w+gap,top,w,h],[0.5,4.5],ylims)
+    ax.rect(0.5,ylims[0],4.5,ylims[1],fill="lightgrey")
+    ax.frame(yticks=yticks,xticks=range(1,5),xticklabels=xlbl,xlabel="Comparator Glucose Range [mg/dL (mmol/L)]",
+             title="Sensor-to-Sensor Variability",grid=True,right=([m*18 for m in mmol],[str(m) for m in mmol],"Deviation [mmol/L]"))
+    ax.line([0,10],[0,0],c="grey")
+    for x in range(1,4):
+        ax.line([x+0.5]*2,ylims,c="grey")
+
+    # Sensors sorted (descending) by their median of the total range, at most s_max sensors
+    n_s = df["SensorID"].nunique()
+    ds_med = df[df["Range"]==4].groupby("SensorID")["Diff"].median().reset_index()
+    ds_med = ds_med.sort_values("Diff",ascending=False).reset_index(drop=True)
+    if n_s > s_max:
+        ds_med = ds_med.iloc[list(np.floor(np.linspace(0,n_s-1,s_max)).astype(int)),:]
+    sens = ds_med["SensorID"].to_list()
+
+    # Median and 90% range (full range for less than 10 datapoints) of each sensor and range
+    grp = df[df["SensorID"].isin(sens)].groupby(["SensorID","Range"])["Diff"]
+    qtl = grp.quantile([0.05,0.95,0,1]).unstack()
+    qtl.columns = ["q05","q95","min","max"]
+    st = grp.agg(["count","median"]).join(qtl)
+    x = np.arange(0.6,4.6)
+    xi = np.linspace(0,0.8,len(sens))
+    cap = 1*PT/(w/4)
+    for r in range(4):
+        for i, s in enumerate(sens):
+            if not((s,r+1) in st.index) or st.at[(s,r+1),"count"] < 3:
+                continue
+            row = st.loc[(s,r+1)]
+            lo, hi = (row["q05"], row["q95"]) if row["count"] >= 10 else (row["min"], row["max"])
+            xs = x[r]+xi[i]
+            ax.line([xs,xs],[lo,hi],lw=0.75)
+            if row["count"] < 10:
+                for y in [lo,hi]:
+                    ax.line([xs-cap,xs+cap],[y,y],lw=0.75)
+            ax.points(np.array([xs]),np.array([row["median"]]),2,"black")
+
+    svg = svg.to_string()
+    save(svg,save_path,filename,".svg")
+    return svg
+
+
+def DGR_svg(df, config=None, remove_dat=True, show_mmol=True, figsize=[13,10], save_path=None, filename="DGR_plot"):
+    """
+    Dynamic Glucose Region plot as SVG
+
+    Input:
+    df:         Pandas dataframe with columns "BG" and "ROC"
+    config:     DGR_Config object with the parameters of the DGR plot (default: DGR_Config())
+    remove_dat: True/False whether to remove data to fullfill the requirements (see remove_data)
+    show_mmol:  True/False whether to inlcude axes in mmol/L or mmol/L/min
+    figsize:    [Width,Height] of figure in cm
+    save_path:  Path for saving the svg file, None if it shall not be saved
+    filename:   Filename of svg file
+
+    Output:
+    svg:        SVG string
+
+    """
+
+    c = DGR.DGR_Config() if config is None else config
+    ROC_lim, BG_lim, pad, bspace, req = list(c.ROC_lim), list(c.BG_lim), c.pad, c.bspace, c.req
+    if remove_dat:
+        df, _, _, _ = DGR.remove_data(df,c)
+    cnt = DGR.region_cnt(df,c)
+
+    W, H = figsize[0]*PX, figsize[1]*PX
+    svg = SVG(W,H,font_size=10)
+    left, right, top, bottom = 48, 45 if show_mmol else 12, 58 if show_mmol else 12, 48
+    ax = Axes(svg,[left,top,W-left-right,H-top-bottom],[ROC_lim[0],ROC_lim[1]+bspace+pad],BG_lim)
+
+    # Grid, regions, data and boundaries in the order of DGR_plot
+    for x in np.arange(ROC_lim[0]+1,ROC_lim[1],1):
+        ax.line([x,x],BG_lim,c="grey",alpha=0.5,lw=0.5)
+    for y in np.arange(BG_lim[0]+50,BG_lim[1],50):
+        ax.line(ROC_lim,[y,y],c="grey",alpha=0.5,lw=0.5)
+    borders, fills = DGR.region_shapes(c)
+    for x, y, col, alpha in fills:
+        ax.polygon(x,y,col,alpha)
+    roc, bg = df["ROC"].to_numpy(dtype=float), df["BG"].to_numpy(dtype=float)
+    sel = ~(roc > 5)
+    ax.points(roc[sel],bg[sel],2,"tab:blue",alpha=0.4)
+    for x, y in borders:
+        ax.line(x,y,c="dimgrey",lw=0.8)
+    ax.line([ROC_lim[1]]*2,BG_lim,c="dimgrey",lw=1)
+    ax.line([ROC_lim[1]+pad]*2,BG_lim,c="dimgrey",lw=1)
+
+    # Region labels
+    pady = 10
+    ax.text(ROC_lim[0]+0.2,350,"BG\nhigh",va="center",c="orangered")
+    ax.text(ROC_lim[1]-0.2,35,"BG\nlow",va="center",ha="right",c="orangered")
+    ax.text(ROC_lim[1]-0.2,180,"Alert\nhigh",va="top",ha="right",c="red")
+    ax.text(ROC_lim[0]+0.2,c.BGLow+pady,"Alert\nlow",va="bottom",c="red")
+    ax.text(1.8,60,"Stable",va="top",ha="center",c="tab:green")
+
+    # Bars on the right
+    hmax = 12
+    share = cnt / cnt[5] * 100
+    share = [share[0],share[2],share[3],share[1],share[4]]
+    for i, col, alpha, pos, lbl, colt in zip(range(4),["darkorange","red","red","darkorange"],[0.4,0.2,0.2,0.4],
+                                             [35,105,265,335],["BG low","Alert low","Alert high","BG high"],
+                                             ["orangered","red","red","orangered"]):
+        ax.rect(ROC_lim[1]+pad,pos-22.5,ROC_lim[1]+pad+share[i]/hmax*bspace,pos+22.5,fill=col,alpha=alpha)
+        ax.text(ROC_lim[1]+pad*2,pos+10,lbl,va="center",c=colt)
+        ax.text(ROC_lim[1]+pad*2,pos-10,"{:.1f}%".format(share[i]),va="center")
+    ax.text(ROC_lim[1]+pad*2,BG_lim[1]-5,"n={:d}".format(int(cnt[5])),va="top")
+    ax.text(ROC_lim[1]+pad*2,195,"Stable",va="center",c="tab:green")
+    ax.text(ROC_lim[1]+pad*2,175,"{:.1f}%".format(share[4]),va="center")
+    ax.text(ROC_lim[1]+bspace,BG_lim[0]-5,"MARoC: {:.2f}".format(df["ROC"].abs().mean()),va="top",ha="right")
+    ax.line([ROC_lim[1]+pad+bspace*(req/hmax)]*2,[0,400],c="red",lw=0.8,dash="4,2")
+    ax.text(ROC_lim[1]+pad+bspace*(req/hmax)+pad,BG_lim[1]-5,"{:.1f}%".format(req),c="red",va="top")
+
+    # Axes
+    mmol = dict(right=([y*18 for y in range(int(BG_lim[0]/18),int(BG_lim[1]/18)+1,3)],
+                       [str(y) for y in range(int(BG_lim[0]/18),int(BG_lim[1]/18)+1,3)],"BG concentration [mmol/L]"),
+                top=([x*18 for x in np.arange(-0.2,0.25,0.1)],["{:.1f}".format(x) for x in np.arange(-0.2,0.25,0.1)],None))
+    ax.frame(xticks=range(ROC_lim[0],ROC_lim[1]+1,1),yticks=range(BG_lim[0],BG_lim[1]+1,50),
+             ylabel="BG concentration [mg/dL]",**(mmol if show_mmol else {}))
+    ax.text_axes(0.4,-0.15,"BG RoC [mg/dL/min]",ha="center")
+    if show_mmol:
+        ax.text_axes(0.4,1.11,"BG RoC [mmol/L/min]",ha="center")
+
+    svg = svg.to_string()
+    save(svg,save_path,filename,".svg")
+    return svg
+
+
+def CTCA_svg(df, config=None, figsize=[16,6], save_path=None, filename="CTCA"):
+    """
+    Clinical Trend Concurrence Analysis display as SVG
+
+    Input:
+    df:         Pandas dataframe with columns "Comp_ROC", "Comp_ROC_Cat" and "CGM_ROC_Cat"
+    config:     CTCA_Config object with the parameters of the display (default: CTCA_Config())
+    figsize:    [Width,Height] of figure in cm
+    save_path:  Path for saving the svg file, None if it shall not be saved
+    filename:   Filename of svg file
+
+    Output:
+    svg:        SVG string
+
+    """
+
+    for col in ["Comp_ROC","Comp_ROC_Cat","CGM_ROC_Cat"]:
+        if not(col in df.columns):
+            raise ValueError("Column "+col+" does not exist")
+    config = CTCA_tool.CTCA_Config() if config is None else config
+    ncats = df["Comp_ROC_Cat"].nunique() if config.ncats is None else config.ncats
+    CTCA_tool.check_categories(df,ncats)
+    ticklbls_comp, ticklbls_cgm, colors, colors2, al = CTCA_tool.get_params(ncats,config)
+    maroc = df["Comp_ROC"].abs().mean()
+    CM, CMcnt = CTCA_tool.concurrence_matrix(df,ncats)
+    Acnt, Bcnt, Ccnt, Dcnt, n = CTCA_tool.zone_count(CMcnt,ncats)
+    for k, v in ARROWS.items():
+        ticklbls_cgm = [s.replace(k,v) for s in ticklbls_cgm]
+
+    W, H = figsize[0]*PX, figsize[1]*PX
+    svg = SVG(W,H,font_size=10)
+    left, top, bottom = 150, 52, 24
+    w = (W-left)*4/5 - 10
+
+    ## Concurrence matrix
+    ax = Axes(svg,[left,top,w,H-top-bottom],[0.5,7.5],[-ncats-0.5,-0.5])
+    yp, xp = np.arange(-1,-ncats-1,-1), np.arange(1,8,1)
+    txt_off = 0.03*ncats
+    off = 0.07
+    ax.text(xp[0]-1,ax.ylim[0]-txt_off,"Total",va="top",ha="center")
+    for i in range(ncats):
+        for j in range(7):
+            if i == 0:
+                ax.text(xp[j],ax.ylim[0]-txt_off,"{:d}".format(int(CMcnt[:,j].sum())),va="top",ha="center")
+            ax.rect(xp[j]-0.5,yp[i]-0.5,xp[j]+0.5,yp[i]+0.5,fill=colors[i][j],alpha=al)
+            ax.text(xp[j],yp[i]-off,"{:.1f}%".format(CM[i,j]) if CM[i,j] != 0 else "-",va="center",ha="center",
+                    size=config.fontsize)
+    for x in xp:
+        ax.line([x-0.5]*2,ax.ylim,lw=0.8)
+    for y in yp:
+        ax.line(ax.xlim,[y+0.5]*2,lw=0.8)
+    ax.frame(yticks=range(-ncats,0),yticklabels=list(reversed(ticklbls_cgm)),ylabel="CGM RoC [mg/dl/min]",
+             top=(range(1,8),ticklbls_comp,"Comparator RoC [mg/dl/min]"))
+
+    ## Bars of the zones
+    ax = Axes(svg,[left+w+10,top,(W-left)/5,H-top-bottom],[0,1],[0,100])
+    bottom_, xb = 0, 0.25
+    for cnt, col in zip([Acnt,Bcnt,Ccnt,Dcnt],colors2):
+        ax.rect(xb-0.2,bottom_,xb+0.2,bottom_+cnt/n*100,fill=col,alpha=al,clip=False)
+        bottom_ = bottom_ + cnt/n*100
+    off = 0.25
+    ax.text(xb+off,Acnt/n*100/2,"A: {:.1f}%".format(Acnt/n*100),va="center")
+    ax.text(xb+off,(Acnt+Bcnt/2)/n*100,"B: {:.1f}%".format(Bcnt/n*100),va="center")
+    ax.text(xb+off,(Acnt+Bcnt+Ccnt)/n*100,"C: {:.1f}%".format(Ccnt/n*100),va="top")
+    ax.text(xb+off,100,"D: {:.1f}%".format(Dcnt/n*100),va="bottom")
+    ax.text(xb+off,0,"MARoC\n{:.2f}".format(maroc),va="bottom")
+    ax.text(xb,-3,"{:d}".format(int(n)),va="top",ha="center")
+
+    svg = svg.to_string()
+    save(svg,save_path,filename,".svg")
+    return svg
+
+
+def html_page(figures, title="CGM Performance Assessment", save_path=None, filename="Report"):
+    """
+    HTML page with embedded SVG figures
+
+    Input:
+    figures:    List of SVG strings or (caption, SVG string) tuples
+    title:      Title of the page
+    save_path:  Path for saving the html file, None if it shall not be saved
+    filename:   Filename of html file
+
+    Output:
+    page:       HTML string
+
+    """
+
+    body = []
+    for fig in figures:
+        caption, svg = fig if isinstance(fig,tuple) else (None, fig)
+        body.append("<figure>" + svg + ("<figcaption>"+html.escape(str(caption))+"</figcaption>" if caption else "")
+                    + "</figure>")
+    page = ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>{t}</title>'
+            '<style>body{{font-family:Arial,Helvetica,sans-serif}} figure{{display:inline-block;margin:8px}}</style>'
+            '</head><body><h1>{t}</h1>{b}</body></html>').format(t=html.escape(title),b="".join(body))
+    save(page,save_path,filename,".html")
+    return page